@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Benchmark: Password hashing
+===========================
+
+Measures circuits event loop latency while a burst of concurrent password
+changes is hashed, once on the loop and once in a worker pool, the same
+way EnrolManager._hash does it.
+
+A probe timer ticks every few milliseconds and records how late it fires.
+As std_hash is a cheap salted sha512, an expensive KDF is simulated with
+PBKDF2 to make the difference visible.
+
+Usage:
+
+    python benchmarks/hashing.py [--changes 200] [--iterations 20000] [--workers 4]
+
+"""
+
+import argparse
+from hashlib import pbkdf2_hmac
+from time import time, sleep
+
+from circuits import Component, Event, Manager, Timer, Worker, task, handler
+
+PROBE_INTERVAL = 0.005
+
+
+def kdf(password, salt, iterations):
+    """Stand-in for a properly tuned, expensive password KDF"""
+
+    return pbkdf2_hmac('sha512', password.encode('utf-8'), salt, iterations).hex()
+
+
+class change_password(Event):
+    pass
+
+
+class Probe(Component):
+    """Records how late a periodic timer fires, i.e. the loop lag"""
+
+    def init(self):
+        self.lag = []
+        self.expected = time() + PROBE_INTERVAL
+        Timer(PROBE_INTERVAL, Event.create('probe'), self.channel,
+              persist=True).register(self)
+
+    @handler('probe')
+    def probe(self):
+        now = time()
+        self.lag.append(max(0.0, now - self.expected))
+        self.expected = now + PROBE_INTERVAL
+
+
+class Hasher(Component):
+    """Hashes passwords like EnrolManager, optionally in a worker pool"""
+
+    def init(self, iterations, workers):
+        self.iterations = iterations
+        self.done = 0
+
+        if workers > 0:
+            self.worker = Worker(workers=workers, channel='bench-hashing').register(self)
+        else:
+            self.worker = None
+
+    def _hash(self, password):
+        if self.worker is None:
+            return kdf(password, b'salt', self.iterations)
+
+        value = yield self.call(task(kdf, password, b'salt', self.iterations),
+                                self.worker.channel)
+        return value.value
+
+    @handler('change_password')
+    def change_password(self, password):
+        # Like EnrolManager.changepassword: verify old, then hash new
+        yield from self._hash(password)
+        yield from self._hash(password[::-1])
+        self.done += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(changes, iterations, workers):
+    manager = Manager()
+    probe = Probe()
+    probe.register(manager)
+    hasher = Hasher(iterations, workers)
+    hasher.register(manager)
+
+    manager.start()
+
+    start = time()
+    for i in range(changes):
+        manager.fire(change_password('password%i' % i))
+
+    while hasher.done < changes:
+        if time() - start > 600:
+            break
+        sleep(0.01)
+
+    duration = time() - start
+    manager.stop()
+
+    lag = probe.lag
+    return {
+        'workers': workers,
+        'changes': hasher.done,
+        'duration': duration,
+        'lag_p50_ms': percentile(lag, 0.5) * 1000,
+        'lag_p99_ms': percentile(lag, 0.99) * 1000,
+        'lag_max_ms': max(lag or [0]) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Password hashing loop latency benchmark')
+    parser.add_argument('--changes', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    print('%-8s %8s %10s %12s %12s %12s' % (
+        'workers', 'changes', 'duration', 'lag p50 ms', 'lag p99 ms', 'lag max ms'))
+
+    for workers in (0, args.workers):
+        result = run(args.changes, args.iterations, workers)
+        print('%-8i %8i %9.2fs %12.2f %12.2f %12.2f' % (
+            result['workers'], result['changes'], result['duration'],
+            result['lag_p50_ms'], result['lag_p99_ms'], result['lag_max_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Benchmark: Load test
+====================
+
+Drives a complete EnrolManager with a mix of realistic client sessions and
+reports throughput, latency per action and the peak memory use. Runs
+offline: the database is replaced by the in-memory stand-in of
+isomer.enrol.testing and mails end up in a sink, that optionally simulates
+a slow mail server.
+
+Sessions (weights set with --mix):
+
+* enrol: captcha -> enrol with the solved captcha -> accept the invitation
+* admin: invite a new user -> accept the enrollment as admin
+* password: change the password of an existing user
+
+A number of --concurrency clients run sessions at the same time, until
+--sessions sessions have been completed. Every request is timed from
+firing its event until the EnrolManager answered it.
+
+Usage:
+
+    python benchmarks/loadtest.py [--sessions 300] [--concurrency 20]
+        [--mix enrol:6,admin:2,password:2] [--hash-workers 0]
+        [--mail-delay 0] [--seed 0]
+
+"""
+
+import argparse
+import random
+import resource
+import sys
+from itertools import count
+from time import perf_counter, sleep, time
+
+from circuits import Component, Event, Manager, handler
+
+import isomer.logger
+from isomer.misc.std import std_hash
+
+from isomer.enrol import enrolmanager
+from isomer.enrol.testing import memorydb, ConfiguredEnrolManager, Client, MailSink, User
+
+memorydb.install()
+
+PASSWORD = 'benchmark'
+SEED_USERS = 100
+
+
+class start(Event):
+    pass
+
+
+class Driver(Component):
+    """Runs client sessions against the EnrolManager
+
+    Sessions are generators, that yield (event, expected reply actions)
+    and receive the reply packet.
+    """
+
+    channel = 'isomer-web'
+
+    def init(self, manager, sessions, concurrency, mix, seed):
+        self.enrol = manager
+        self.remaining = sessions
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.scenarios = []
+        for name, weight in mix:
+            self.scenarios.extend([name] * weight)
+
+        self.counter = count()
+        self.pending = {}
+        self.started = None
+        self.finished = None
+        self.sessions = 0
+        self.failures = 0
+        self.latencies = {}
+
+    @handler('start', channel='loadtest')
+    def start(self):
+        self.started = perf_counter()
+        for i in range(min(self.concurrency, self.remaining)):
+            self._next_session()
+
+    def _next_session(self):
+        if self.remaining <= 0:
+            if len(self.pending) == 0 and self.finished is None:
+                self.finished = perf_counter()
+            return
+
+        self.remaining -= 1
+        client = Client('loadtest-%i' % next(self.counter))
+        scenario = self.random.choice(self.scenarios)
+        session = getattr(self, '_' + scenario)(client)
+        self._advance(client.uuid, scenario, session, None)
+
+    def _advance(self, client, scenario, session, packet):
+        try:
+            event, expected = session.send(packet)
+        except StopIteration:
+            self.sessions += 1
+            self._next_session()
+            return
+
+        self.pending[client] = (scenario, session, expected, event.action, perf_counter())
+        self.fire(event)
+
+    @handler('send')
+    def send(self, event):
+        pending = self.pending.get(event.uuid, None)
+        if pending is None:
+            return
+
+        scenario, session, expected, action, started = pending
+        packet = event.packet
+        if packet.get('action', None) not in expected:
+            return
+
+        self.latencies.setdefault(action, []).append(perf_counter() - started)
+        del self.pending[event.uuid]
+
+        data = packet.get('data', None)
+        if isinstance(data, (list, tuple)) and len(data) > 0 and data[0] is False:
+            self.failures += 1
+            self.sessions += 1
+            self._next_session()
+            return
+
+        self._advance(event.uuid, scenario, session, packet)
+
+    def _enrol(self, client):
+        yield enrolmanager.captcha('captcha', None, client), ('captcha',)
+
+        solution = self.enrol.captchas.get(client.uuid)['text']
+        name = 'enrolled-' + client.uuid
+        data = {
+            'username': name,
+            'password': PASSWORD,
+            'mail': name + '@example.org',
+            'captcha': solution
+        }
+        packet = yield enrolmanager.enrol('enrol', data, client), ('invite', 'enrol')
+        if packet['action'] != 'invite':
+            return
+
+        # The invitation link from the mail
+        uuid = enrolmanager.objectmodels['enrollment'].find_one({'name': name}).uuid
+        yield enrolmanager.accept('accept', uuid, client), ('accept',)
+
+    def _admin(self, client):
+        admin = User('loadtest-admin')
+        name = 'invited-' + client.uuid
+        data = {
+            'name': name,
+            'email': name + '@example.org',
+            'method': 'Enrolled'
+        }
+        yield enrolmanager.invite(admin, 'invite', data, client), ('invite',)
+
+        uuid = enrolmanager.objectmodels['enrollment'].find_one({'name': name}).uuid
+        data = {'uuid': uuid, 'status': 'Accepted'}
+        yield enrolmanager.change(admin, 'change', data, client), ('change',)
+
+    def _password(self, client):
+        user = User('seed-%i' % self.random.randrange(SEED_USERS))
+        data = {'old': PASSWORD, 'new': PASSWORD}
+        yield enrolmanager.changepassword(user, 'changepassword', data, client), \
+            ('changepassword',)
+
+
+def seed_users(salt):
+    """Create users, whose passwords are changed by the password sessions"""
+
+    users = enrolmanager.objectmodels['user']
+    passhash = std_hash(PASSWORD, salt)
+
+    users.bulk_create([users({
+        'uuid': 'seed-%i' % number,
+        'name': 'seed-%i' % number,
+        'mail': 'seed-%i@example.org' % number,
+        'passhash': passhash,
+        'roles': ['crew']
+    }) for number in range(SEED_USERS)])
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def parse_mix(text):
+    mix = []
+    for item in text.split(','):
+        name, weight = item.split(':')
+        if name not in ('enrol', 'admin', 'password'):
+            raise argparse.ArgumentTypeError('Unknown session type: ' + name)
+        mix.append((name, int(weight)))
+
+    return mix
+
+
+def run(args):
+    ConfiguredEnrolManager.overrides = {
+        'rate_limits': {},
+        'captcha_delay': 0,
+        'hash_workers': args.hash_workers,
+        'mail_rate': args.mail_rate
+    }
+
+    manager = Manager()
+    sink = MailSink(args.mail_delay).register(manager)
+    enrol = ConfiguredEnrolManager()
+    enrol.register(manager)
+    seed_users(enrol.salt)
+
+    driver = Driver(enrol, args.sessions, args.concurrency, args.mix, args.seed)
+    driver.register(manager)
+
+    manager.start()
+    # Let all components register and the captcha pool start filling
+    sleep(0.5)
+
+    manager.fire(start(), 'loadtest')
+
+    deadline = time() + args.timeout
+    while driver.finished is None and time() < deadline:
+        sleep(0.05)
+
+    manager.stop()
+    enrol.captcha_pool.stop()
+
+    duration = (driver.finished or perf_counter()) - driver.started
+
+    return driver, sink, enrolmanager.objectmodels['enrolmail'].count(), duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enrolment load test')
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mix', type=parse_mix, default='enrol:6,admin:2,password:2')
+    parser.add_argument('--hash-workers', type=int, default=0)
+    parser.add_argument('--mail-rate', type=int, default=1000)
+    parser.add_argument('--mail-delay', type=float, default=0.0,
+                        help='Seconds the mail sink takes per mail')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        isomer.logger.verbosity['global'] = isomer.logger.off
+        isomer.logger.verbosity['console'] = isomer.logger.off
+
+    driver, sink, queued, duration = run(args)
+
+    requests = sum(len(latencies) for latencies in driver.latencies.values())
+
+    print('%-16s %8s %10s %10s %10s' % ('action', 'requests', 'req/s', 'p50 ms', 'p99 ms'))
+    for action, latencies in sorted(driver.latencies.items()):
+        print('%-16s %8i %10.1f %10.2f %10.2f' % (
+            action, len(latencies), len(latencies) / duration,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+
+    print()
+    print('sessions:  %i completed, %i failed, %i unfinished' % (
+        driver.sessions - driver.failures, driver.failures, len(driver.pending)))
+    print('requests:  %i in %.2fs, %.1f req/s' % (requests, duration, requests / duration))
+    print('mails:     %i delivered, %i not yet delivered' % (len(sink.mails), queued))
+    # ru_maxrss is reported in kilobytes on Linux
+    print('peak RSS:  %.1f MiB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if driver.finished is None:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Benchmark: Startup
+==================
+
+Measures what the captcha subsystem of the EnrolManager costs on a cold
+node boot and on configuration reloads.
+
+Every measurement runs in a fresh interpreter, so module imports and font
+loading are really cold:
+
+* import: importing the captcha module, with and without the image engine
+* eager: what _setup used to do, i.e. create the engine, load the font and
+  start filling the pool right away
+* lazy: what _setup does now, i.e. create an idle pool
+* first: the deferred cost, paid by the first captcha request
+* reload: the captcha related work done on each configuration reload,
+  before (new engine and pool) and now (nothing, unless captcha keys change)
+
+Usage:
+
+    python benchmarks/startup.py [--runs 5] [--pool 50]
+
+"""
+
+import argparse
+import subprocess
+import sys
+from statistics import median
+
+SNIPPETS = {
+    'import':
+        'from isomer.enrol.captchas import CaptchaPool',
+    'import+engine':
+        'from isomer.enrol.captchas import CaptchaPool\n'
+        'import captcha.image',
+    'eager':
+        'from isomer.enrol.captchas import CaptchaPool, CaptchaRenderer\n'
+        'START\n'
+        'engine = CaptchaRenderer()\n'
+        'engine.generate("warmup")\n'
+        'pool = CaptchaPool(lambda: engine, POOL, 10)\n'
+        'pool.pop()\n'
+        'STOP',
+    'lazy':
+        'from isomer.enrol.captchas import CaptchaPool, CaptchaRenderer\n'
+        'START\n'
+        'pool = CaptchaPool(CaptchaRenderer, POOL, 10)\n'
+        'STOP',
+    'first':
+        'from isomer.enrol.captchas import CaptchaPool, CaptchaRenderer\n'
+        'pool = CaptchaPool(CaptchaRenderer, POOL, 10)\n'
+        'START\n'
+        'pool.pop()\n'
+        'STOP',
+    'reload before':
+        'from isomer.enrol.captchas import CaptchaPool, CaptchaRenderer, _engines\n'
+        'pool = CaptchaPool(CaptchaRenderer, 0, 0)\n'
+        'START\n'
+        '_engines.clear()\n'
+        'engine = CaptchaRenderer()\n'
+        'engine.generate("warmup")\n'
+        'pool.stop()\n'
+        'pool = CaptchaPool(lambda: engine, POOL, 10)\n'
+        'pool.pop()\n'
+        'STOP',
+    'reload now':
+        'from isomer.enrol.captchas import CaptchaPool, CaptchaRenderer\n'
+        'pool = CaptchaPool(CaptchaRenderer, POOL, 10)\n'
+        'pool.pop()\n'
+        'START\n'
+        'pool.resize(POOL, 10)\n'
+        'STOP',
+}
+
+TIMER = 'from time import perf_counter\n'
+
+
+def measure(name, pool):
+    """Run a snippet in a fresh interpreter and return its duration"""
+
+    code = SNIPPETS[name]
+    if 'START' not in code:
+        code = 'START\n' + code + '\nSTOP'
+
+    code = TIMER + code \
+        .replace('START', '__start = perf_counter()') \
+        .replace('STOP', 'print(perf_counter() - __start)') \
+        .replace('POOL', str(pool))
+
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return float(output.decode('ascii').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Captcha startup and reload benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--pool', type=int, default=50)
+    args = parser.parse_args()
+
+    print('%-16s %12s %12s' % ('step', 'median ms', 'max ms'))
+
+    for name in SNIPPETS:
+        durations = [measure(name, args.pool) for i in range(args.runs)]
+        print('%-16s %12.2f %12.2f' % (
+            name, median(durations) * 1000, max(durations) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Benchmark: Mail templates
+=========================
+
+Compares rendering invitation mails by parsing the configured template
+strings for every mail (the former _send_mail) with the compiled
+MailTemplate objects.
+
+Usage:
+
+    python benchmarks/templates.py [--renders 10000]
+
+"""
+
+import argparse
+from time import time
+
+from pystache import render
+
+from isomer.enrol.enrolmanager import EnrolManager
+from isomer.enrol.templates import MailTemplate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mail template rendering benchmark')
+    parser.add_argument('--renders', type=int, default=10000)
+    args = parser.parse_args()
+
+    subject = EnrolManager.configprops['invitation_subject']['default']
+    body = EnrolManager.configprops['invitation_mail']['default']
+
+    static_context = {
+        'invitation_url': 'https://example.org/#!/invitation/',
+        'node_name': 'Example node',
+        'node_url': 'https://example.org'
+    }
+    contexts = [{'name': 'user%i' % i, 'uuid': '%036i' % i} for i in range(args.renders)]
+
+    start = time()
+    for context in contexts:
+        full_context = dict(static_context)
+        full_context.update(context)
+        render(body, full_context)
+        render(subject, full_context)
+    parsed = time() - start
+
+    start = time()
+    template = MailTemplate(subject, body, static_context)
+    for context in contexts:
+        template.render(context)
+    compiled = time() - start
+
+    print('%-10s %10s %14s' % ('path', 'total', 'per mail'))
+    print('%-10s %9.3fs %12.1fus' % ('parse', parsed, parsed / args.renders * 1e6))
+    print('%-10s %9.3fs %12.1fus' % ('compiled', compiled, compiled / args.renders * 1e6))
+    print('Speedup: %.1fx' % (parsed / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,10 @@ export function routing($stateProvider) {
             url: '/resetaccount',
             template: '<resetaccount></resetaccount>'
         })
+        .state('app.resetpassword', {
+            url: '/resetaccount/:token',
+            template: '<resetaccount></resetaccount>'
+        })
         .state('app.enrolment', {
             url: '/enrolment',
             template: '<enrolment></enrolment>'
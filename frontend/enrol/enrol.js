@@ -56,6 +56,7 @@ class Enrol {
         this.action_users = '';
 
         this.enrollments = {};
+        this.enrollment_cursor = null;
         this.checked_enrollments = {};
         this.all_enrollments = false;
         this.action_enrollments = '';
@@ -103,6 +104,26 @@ class Enrol {
                     self.enrollments[result.uuid] = result;
                 }
                 self.update_enrollment_badge();
+            } else if (msg.action === 'change_batch') {
+                let result = msg.data;
+                self.notification.add('success', 'Enrol', 'Changed ' + result.changed.length + ' enrollments to ' + result.status, 3);
+                if (result.missing.length > 0) {
+                    self.notification.add('warning', 'Enrol', result.missing.length + ' enrollments were not found', 3);
+                }
+                self.get_data();
+            } else if (msg.action === 'list') {
+                let result = msg.data;
+                if (result[0] === false) {
+                    self.notification.add('warning', 'Enrol', 'Could not list enrollments', 3);
+                    return;
+                }
+                for (let enrollment of result.items) {
+                    self.enrollments[enrollment.uuid] = enrollment;
+                }
+                if (result.final === true) {
+                    self.enrollment_cursor = result.cursor;
+                }
+                self.update_enrollment_badge();
             } else if (msg.action === 'create') {
                 let status = msg.data[0] ? 'success' : 'danger';
                 self.notification.add(status, 'Enrol', msg.data[1], 3);
@@ -123,15 +144,8 @@ class Enrol {
 
         this.get_data = function () {
             console.log('[ENROL] Getting data');
-            self.op.search('enrollment', '*', '*').then(function (msg) {
-                let enrollments = msg.data.list;
-                console.log('[ENROL] Data received:', enrollments);
-
-                for (let enrollment of enrollments) {
-                    self.enrollments[enrollment.uuid] = enrollment;
-                }
-                self.update_enrollment_badge();
-            });
+            self.enrollment_cursor = null;
+            self.list_enrollments();
             self.op.search('user', '*', '*').then(function (msg) {
                 let users = msg.data.list;
                 console.log('[ENROL] Data received:', users);
@@ -175,6 +189,23 @@ class Enrol {
         };
     }
 
+    list_enrollments(cursor) {
+        let data = {};
+        if (typeof cursor !== 'undefined' && cursor !== null) {
+            data.cursor = cursor;
+        }
+        this.socket.send({
+            component: 'isomer.enrol.enrolmanager',
+            action: 'list',
+            data: data
+        });
+    }
+
+    load_more_enrollments() {
+        this.list_enrollments(this.enrollment_cursor);
+        this.enrollment_cursor = null;
+    }
+
     get_qr(uuid) {
         return this.invite_url + '/' + uuid;
     }
@@ -186,11 +217,27 @@ class Enrol {
     }
 
     act_enrollments() {
+        let uuids = [];
         for (let uuid of Object.keys(this.checked_enrollments)) {
             if (this.checked_enrollments[uuid] === true) {
-                this.set_status(uuid, this.action_enrollments);
+                if (this.action_enrollments === 'Deleted') {
+                    this.set_status(uuid, this.action_enrollments);
+                } else {
+                    uuids.push(uuid);
+                }
             }
         }
+        if (uuids.length > 0) {
+            console.log('[ENROL] Changing enrollment status', uuids, 'to', this.action_enrollments);
+            this.socket.send({
+                component: 'isomer.enrol.enrolmanager',
+                action: 'change',
+                data: {
+                    uuids: uuids,
+                    status: this.action_enrollments
+                }
+            });
+        }
         if (this.action_enrollments === 'Deleted') {
             this.all_enrollments = false;
         }
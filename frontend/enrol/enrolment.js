@@ -56,6 +56,9 @@ class Enrol {
         let self = this;
 
         this.socket.listen('isomer.enrol.enrolmanager', function (msg) {
+            if (self.rejected(msg)) {
+                return;
+            }
             if (msg.action === 'captcha') {
                 console.log('[ENROL] Got captcha:', msg);
                 self.captcha_image = msg.data;
@@ -91,6 +94,19 @@ class Enrol {
         }
     }
 
+    rejected(msg) {
+        // Captcha and status replies carry their result directly, a
+        // (false, message) pair means the request was refused, e.g. rate limited
+        if ((msg.action !== 'captcha' && msg.action !== 'status') ||
+            !Array.isArray(msg.data) || msg.data[0] !== false) {
+            return false;
+        }
+
+        console.log('[ENROL] Request refused:', msg);
+        this.notification.add('warning', 'Please wait', msg.data[1], 5);
+        return true;
+    }
+
     get_captcha() {
         console.log('[ENROL] Getting captcha');
         this.captcha_image = null;
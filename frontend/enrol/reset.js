@@ -28,13 +28,51 @@
  */
 class AccountReset {
 
-    constructor(scope, user, socket) {
+    constructor(scope, user, socket, notification, $stateParams, state) {
         this.scope = scope;
         this.user = user;
         this.socket = socket;
+        this.notification = notification;
+        this.stateParams = $stateParams;
+        this.state = state;
 
         this.username = '';
         this.email = '';
+
+        this.token = null;
+        this.password_new = '';
+        this.password_confirm = '';
+
+        this.requested = false;
+        this.status = '';
+
+        let self = this;
+
+        this.socket.listen('isomer.enrol.enrolmanager', function (msg) {
+            if (msg.action === 'request_reset') {
+                console.log('[RESET] Request:', msg.data);
+                if (msg.data[0] === true) {
+                    self.requested = true;
+                    self.status = msg.data[1];
+                } else {
+                    self.notification.add('danger', 'Reset not requested', msg.data[1], 5);
+                }
+            } else if (msg.action === 'reset_password') {
+                console.log('[RESET] Reset:', msg.data);
+                if (msg.data[0] === true) {
+                    self.notification.add('success', 'Password changed!', msg.data[1], 5);
+                    self.state.go('app.menu');
+                } else {
+                    self.notification.add('danger', 'Password not changed', msg.data[1], 5);
+                }
+            }
+        });
+    }
+
+    $onInit() {
+        if (typeof this.stateParams.token !== 'undefined' && this.stateParams.token !== '') {
+            this.token = this.stateParams.token;
+        }
     }
 
     request_reset() {
@@ -51,8 +89,27 @@ class AccountReset {
         this.socket.send(packet);
     }
 
+    reset_password() {
+        if (this.password_new !== this.password_confirm) {
+            console.log("Unexpected: New passwords don't match!");
+            return
+        }
+
+        console.log('Transmitting password reset');
+
+        let packet = {
+            component: 'isomer.enrol.enrolmanager',
+            action: 'reset_password',
+            data: {
+                'token': this.token,
+                'password': this.password_new
+            }
+        };
+        this.socket.send(packet);
+    }
+
 }
 
-AccountReset.$inject = ['$scope', 'user', 'socket'];
+AccountReset.$inject = ['$scope', 'user', 'socket', 'notification', '$stateParams', '$state'];
 
 export default AccountReset;
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Availability
+====================
+
+In-memory index of taken user names, enrollment names and mail addresses.
+
+Unknown entries are answered from memory without touching the database, so
+signups with fresh names (and floods of them) cost no lookups. Known
+(taken) entries are confirmed with a single query, as users and enrollments
+may also be deleted or renamed outside of the EnrolManager, and forgotten
+if they are gone.
+
+Changes announced by the object manager update the entries of the changed
+object by its uuid. Entries created elsewhere without announcement are
+learned when the index is warmed again after the configured lifetime. The
+unique indices of the user collection catch those in between; enrollment
+names have no unique index, so strict checks confirm unknown names, too.
+
+The index is warmed with the first query, not when it is created, to keep
+the collection scans out of node startup.
+
+"""
+
+from time import time
+
+from isomer.database import objectmodels
+from isomer.logger import isolog, debug
+
+
+class AvailabilityIndex(object):
+    """Answers whether a user name or mail address is already taken"""
+
+    def __init__(self, ttl=0):
+        """
+        :param ttl: Seconds after which the index is warmed again (0 to keep
+            it until invalidated)
+        """
+
+        self.ttl = ttl
+
+        self.user_names = set()
+        self.enrollment_names = set()
+        self.mails = set()
+
+        # Entries by uuid, to update them on changes of single objects
+        self.users = {}
+        self.enrollments = {}
+
+        self.warmed = None
+
+        self.hits = 0
+        self.lookups = 0
+
+    def log(self, *args, **kwargs):
+        isolog(emitter='ENROL-AVAILABILITY', *args, **kwargs)
+
+    def warm(self):
+        """Load all taken names and mail addresses from the database"""
+
+        user_names = set()
+        enrollment_names = set()
+        mails = set()
+        users = {}
+        enrollments = {}
+
+        for item in objectmodels['user'].collection().find(
+                {}, {'uuid': 1, 'name': 1, 'mail': 1, '_id': 0}):
+            name, mail = item.get('name', None), item.get('mail', None)
+            user_names.add(name)
+            mails.add(mail)
+            users[item.get('uuid', None)] = (name, mail)
+
+        for item in objectmodels['enrollment'].collection().find(
+                {}, {'uuid': 1, 'name': 1, '_id': 0}):
+            name = item.get('name', None)
+            enrollment_names.add(name)
+            enrollments[item.get('uuid', None)] = name
+
+        self.user_names = user_names
+        self.enrollment_names = enrollment_names
+        self.mails = mails
+        self.users = users
+        self.enrollments = enrollments
+        self.warmed = time()
+
+        self.log('Indexed', len(user_names), 'users and', len(enrollment_names),
+                 'enrollments', lvl=debug)
+
+    def invalidate(self):
+        """Warm the index again with the next query"""
+
+        self.warmed = None
+
+    def update(self, schema, uuid):
+        """Reload the entries of a user or an enrollment, that was created or
+        changed elsewhere"""
+
+        if self.warmed is None:
+            return
+
+        self.remove(schema, uuid)
+
+        if schema == 'user':
+            item = objectmodels['user'].collection().find_one(
+                {'uuid': uuid}, {'name': 1, 'mail': 1, '_id': 0})
+            if item is not None:
+                self.add_user(item.get('name', None), item.get('mail', None), uuid)
+        elif schema == 'enrollment':
+            item = objectmodels['enrollment'].collection().find_one(
+                {'uuid': uuid}, {'name': 1, '_id': 0})
+            if item is not None:
+                self.add_enrollment(item.get('name', None), uuid)
+
+    def remove(self, schema, uuid):
+        """Forget the entries of a user or an enrollment by its uuid"""
+
+        if schema == 'user':
+            entry = self.users.pop(uuid, None)
+            if entry is not None:
+                self.remove_user(*entry)
+        elif schema == 'enrollment':
+            name = self.enrollments.pop(uuid, None)
+            if name is not None:
+                self.remove_enrollment(name)
+
+    def _ensure_warm(self):
+        if self.warmed is None or (self.ttl > 0 and time() - self.warmed > self.ttl):
+            self.warm()
+
+    def confirm_many(self, names, mails):
+        """Confirm which of many names and mail addresses known as taken
+        still are, with one query per collection, and forget the others"""
+
+        self._ensure_warm()
+
+        names = set(name for name in names if name in self.user_names or
+                    name in self.enrollment_names)
+        mails = set(mail for mail in mails if mail in self.mails)
+
+        if len(names) == 0 and len(mails) == 0:
+            return
+
+        self.lookups += 1
+
+        user_names = set()
+        user_mails = set()
+        for item in objectmodels['user'].collection().find(
+                {'$or': [{'name': {'$in': list(names)}}, {'mail': {'$in': list(mails)}}]},
+                {'name': 1, 'mail': 1, '_id': 0}):
+            user_names.add(item.get('name', None))
+            user_mails.add(item.get('mail', None))
+
+        enrollment_names = set()
+        if len(names) > 0:
+            for item in objectmodels['enrollment'].collection().find(
+                    {'name': {'$in': list(names)}}, {'name': 1, '_id': 0}):
+                enrollment_names.add(item.get('name', None))
+
+        self.user_names.difference_update(names - user_names)
+        self.enrollment_names.difference_update(names - enrollment_names)
+        self.mails.difference_update(mails - user_mails)
+
+    def user_exists(self, name, confirm=True):
+        """Check if a user with the given name exists
+
+        :param confirm: Confirm known names with the database
+        """
+
+        self._ensure_warm()
+
+        if name not in self.user_names:
+            self.hits += 1
+            return False
+
+        if not confirm:
+            self.hits += 1
+            return True
+
+        self.lookups += 1
+        if objectmodels['user'].count({'name': name}) > 0:
+            return True
+
+        self.user_names.discard(name)
+        return False
+
+    def name_taken(self, name, confirm=True, strict=False):
+        """Check if a user or an enrollment with the given name exists
+
+        :param strict: Confirm unknown names with the database, too
+        """
+
+        self._ensure_warm()
+
+        if strict and name not in self.enrollment_names and name not in self.user_names:
+            self.lookups += 1
+            if objectmodels['enrollment'].count({'name': name}) > 0:
+                self.enrollment_names.add(name)
+                return True
+            if objectmodels['user'].count({'name': name}) > 0:
+                self.user_names.add(name)
+                return True
+
+            return False
+
+        if name in self.enrollment_names:
+            if not confirm:
+                self.hits += 1
+                return True
+
+            self.lookups += 1
+            if objectmodels['enrollment'].count({'name': name}) > 0:
+                return True
+
+            self.enrollment_names.discard(name)
+
+        return self.user_exists(name, confirm)
+
+    def mail_taken(self, mail, confirm=True):
+        """Check if a user with the given mail address exists"""
+
+        self._ensure_warm()
+
+        if mail not in self.mails:
+            self.hits += 1
+            return False
+
+        if not confirm:
+            self.hits += 1
+            return True
+
+        self.lookups += 1
+        if objectmodels['user'].count({'mail': mail}) > 0:
+            return True
+
+        self.mails.discard(mail)
+        return False
+
+    def add_user(self, name, mail, uuid=None):
+        self.user_names.add(name)
+        self.mails.add(mail)
+        if uuid is not None:
+            self.users[uuid] = (name, mail)
+
+    def remove_user(self, name, mail, uuid=None):
+        self.user_names.discard(name)
+        self.mails.discard(mail)
+        self.users.pop(uuid, None)
+
+    def add_enrollment(self, name, uuid=None):
+        self.enrollment_names.add(name)
+        if uuid is not None:
+            self.enrollments[uuid] = name
+
+    def remove_enrollment(self, name, uuid=None):
+        self.enrollment_names.discard(name)
+        self.enrollments.pop(uuid, None)
+
+    def stats(self):
+        """Return index sizes and hit/lookup counters"""
+
+        return {
+            'user_names': len(self.user_names),
+            'enrollment_names': len(self.enrollment_names),
+            'mails': len(self.mails),
+            'hits': self.hits,
+            'lookups': self.lookups
+        }
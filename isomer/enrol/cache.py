@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Cache
+=============
+
+Small, size bounded cache with per entry expiry.
+
+Used to answer repeated requests (e.g. clicks on an invitation link) from
+memory. Entries are evicted least recently used first, when the cache is
+full.
+
+"""
+
+from collections import OrderedDict
+from time import time
+
+MISSING = object()
+
+
+class TTLCache(object):
+    """Least recently used cache, whose entries expire after a while"""
+
+    def __init__(self, ttl=60, max_entries=10000):
+        """
+        :param ttl: Default lifetime of entries in seconds
+        :param max_entries: Maximum amount of cached entries
+        """
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """Return a cached value or MISSING"""
+
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        if now is None:
+            now = time()
+
+        value, expires = entry
+        if expires < now:
+            del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value, ttl=None, now=None):
+        """Cache a value, optionally with a lifetime other than the default"""
+
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        if now is None:
+            now = time()
+
+        self._entries[key] = (value, now + ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Drop the entries of the given keys"""
+
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Return entry count and hit/miss counters"""
+
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Captchas
+================
+
+Pre-rendered captcha challenges for the EnrolManager.
+
+Rendering a captcha image is expensive PIL work, so a bounded pool of
+(text, image) pairs is kept filled by a background thread. The event loop
+only has to pop a ready challenge off the pool. The image engine and its
+fonts are loaded on the first request and shared for the process lifetime.
+
+Images are rendered either in the pool's thread or, to keep them off the
+GIL entirely, in worker processes. Either way they come out encoded as
+base64 data URIs, ready to be transmitted.
+
+Issued challenges are held in a bounded store, until they are solved,
+expire or their client disconnects.
+
+"""
+
+from base64 import b64encode
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+from string import ascii_letters, digits
+from random import choice
+from threading import Condition, Thread, current_thread
+from time import time
+
+from isomer.logger import isolog, error, verbose
+
+CAPTCHA_FONTS = ('/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf',)
+
+CAPTCHA_FORMATS = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg'
+}
+
+_engines = {}
+
+
+def get_engine(width=160, height=60, fonts=CAPTCHA_FONTS):
+    """Return the shared captcha image engine for a size and set of fonts
+
+    The engine (and with it, the fonts) is only loaded on first use and then
+    kept for the lifetime of the process, so configuration reloads do not
+    have to load it again.
+    """
+
+    key = (width, height, tuple(fonts))
+    engine = _engines.get(key, None)
+
+    if engine is None:
+        from captcha.image import ImageCaptcha
+
+        engine = _engines[key] = ImageCaptcha(width=width, height=height,
+                                              fonts=list(fonts))
+
+    return engine
+
+
+def render_captcha(text, width=160, height=60, fonts=CAPTCHA_FONTS,
+                   image_format='PNG', quality=70):
+    """Render a captcha image and return it as base64 encoded data URI"""
+
+    image = get_engine(width, height, fonts).generate_image(text)
+
+    buffer = BytesIO()
+    if image_format == 'JPEG':
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    else:
+        image.save(buffer, format=image_format, optimize=True)
+
+    return 'data:%s;base64,%s' % (
+        CAPTCHA_FORMATS[image_format],
+        b64encode(buffer.getvalue()).decode('ascii')
+    )
+
+
+class CaptchaRenderer(object):
+    """Renders captcha images in the calling thread"""
+
+    # Amount of images the pool should request at once
+    batch = 1
+
+    def __init__(self, width=160, height=60, fonts=CAPTCHA_FONTS,
+                 image_format='PNG', quality=70):
+        """
+        :param width: Image width in pixels
+        :param height: Image height in pixels
+        :param fonts: List of TrueType font files to pick glyphs from
+        :param image_format: Output format, one of CAPTCHA_FORMATS
+        :param quality: JPEG quality (1-95)
+        """
+
+        if image_format not in CAPTCHA_FORMATS:
+            raise ValueError('Unsupported captcha format: %s' % image_format)
+
+        self.options = (width, height, tuple(fonts), image_format, quality)
+
+    def generate(self, text):
+        return render_captcha(text, *self.options)
+
+    def generate_many(self, texts):
+        return [self.generate(text) for text in texts]
+
+    def stop(self):
+        pass
+
+
+class ProcessCaptchaRenderer(CaptchaRenderer):
+    """Renders captcha images in a pool of worker processes, so rendering
+    does not compete with the event loop for the GIL"""
+
+    def __init__(self, processes=2, **kwargs):
+        """
+        :param processes: Amount of worker processes
+        """
+
+        super(ProcessCaptchaRenderer, self).__init__(**kwargs)
+
+        self.processes = processes
+        self.batch = processes * 4
+
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes)
+
+        return self._executor
+
+    def generate(self, text):
+        return self.executor.submit(render_captcha, text, *self.options).result()
+
+    def generate_many(self, texts):
+        options = [repeat(option) for option in self.options]
+        return list(self.executor.map(render_captcha, texts, *options))
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def generate_captcha_string():
+    """Generates a randomized collection of 6 letters and digits"""
+
+    return "".join(choice(ascii_letters + digits) for i in range(6))
+
+
+class CaptchaPool(object):
+    """Bounded pool of pre-generated captcha challenges with background refill"""
+
+    # Seconds to wait after failed rendering, doubled with every further
+    # failure up to the maximum
+    retry_delay = 1.0
+    max_retry_delay = 60.0
+
+    def __init__(self, engine_factory=CaptchaRenderer, size=50, low_water=10):
+        """
+        :param engine_factory: Callable returning the captcha renderer, which
+            must provide generate(text) and generate_many(texts) returning
+            encoded images. Called on first use.
+        :param size: Maximum amount of pre-generated challenges
+        :param low_water: Refill the pool, when it holds fewer challenges
+        """
+
+        self.engine_factory = engine_factory
+        self.size = 0
+        self.low_water = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._engine = None
+        self._pool = deque()
+        self._condition = Condition()
+        self._running = False
+        self._thread = None
+
+        self.resize(size, low_water)
+
+    def log(self, *args, **kwargs):
+        isolog(emitter='ENROL-CAPTCHAPOOL', *args, **kwargs)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self.engine_factory()
+
+        return self._engine
+
+    def generate(self):
+        """Render a new captcha challenge"""
+
+        text = generate_captcha_string()
+        return text, self.engine.generate(text)
+
+    def replace(self, engine_factory):
+        """Switch to another renderer, dropping challenges of the old one"""
+
+        with self._condition:
+            engine = self._engine
+
+            self.engine_factory = engine_factory
+            self._engine = None
+            self._pool.clear()
+            self._condition.notify()
+
+        if engine is not None:
+            engine.stop()
+
+    def resize(self, size, low_water):
+        """Change the pool limits, keeping already rendered challenges"""
+
+        with self._condition:
+            self.size = max(0, size)
+            self.low_water = min(max(0, low_water), self.size)
+
+            while len(self._pool) > self.size:
+                self._pool.pop()
+
+            if self.size == 0:
+                self._running = False
+                self._thread = None
+
+            self._condition.notify()
+
+    def pop(self):
+        """Get a captcha challenge, render it inline if the pool is empty
+
+        The background refill is only started with the first request, so
+        nothing is rendered (or loaded) for nodes nobody enrols on.
+        """
+
+        with self._condition:
+            if self._thread is None and self.size > 0:
+                self._start()
+
+            try:
+                entry = self._pool.popleft()
+                self.hits += 1
+            except IndexError:
+                entry = None
+                self.misses += 1
+
+            if len(self._pool) <= self.low_water:
+                self._condition.notify()
+
+        if entry is None:
+            self.log('Captcha pool exhausted, rendering inline', lvl=verbose)
+            entry = self.generate()
+
+        return entry
+
+    def stop(self):
+        """Stop the background refill thread"""
+
+        with self._condition:
+            self._running = False
+            self._thread = None
+            self._condition.notify()
+
+        if self._engine is not None:
+            self._engine.stop()
+
+    def _start(self):
+        self._running = True
+        self._thread = Thread(target=self._refill, name='EnrolCaptchaPool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stats(self):
+        """Return pool fill level and hit/miss counters"""
+
+        return {
+            'size': self.size,
+            'low_water': self.low_water,
+            'available': len(self._pool),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _refill(self):
+        """Background thread: top up the pool, whenever it runs low"""
+
+        thread = current_thread()
+        delay = self.retry_delay
+
+        while True:
+            with self._condition:
+                while self._running and self._thread is thread and (
+                        len(self._pool) > self.low_water or
+                        len(self._pool) >= self.size):
+                    self._condition.wait()
+
+                if not self._running or self._thread is not thread:
+                    return
+
+                missing = self.size - len(self._pool)
+                engine = self.engine
+
+            while missing > 0:
+                texts = [generate_captcha_string()
+                         for i in range(min(missing, engine.batch))]
+                missing -= len(texts)
+
+                try:
+                    images = engine.generate_many(texts)
+                except Exception as e:
+                    self.log('Could not render captchas, retrying in', delay, 'seconds:',
+                             e, type(e), lvl=error)
+                    # Renderers set themselves up again on their next use,
+                    # e.g. after worker processes died
+                    engine.stop()
+                    with self._condition:
+                        self._condition.wait_for(
+                            lambda: not self._running or self._thread is not thread, delay
+                        )
+                    delay = min(delay * 2, self.max_retry_delay)
+                    break
+
+                delay = self.retry_delay
+
+                with self._condition:
+                    if not self._running or self._thread is not thread:
+                        return
+                    if engine is not self._engine:
+                        # Rendered by a replaced engine
+                        break
+                    for entry in zip(texts, images):
+                        if len(self._pool) < self.size:
+                            self._pool.append(entry)
+
+
+class CaptchaStore(object):
+    """Size bounded, expiring store of issued captcha challenges by client"""
+
+    def __init__(self, ttl=300, max_entries=1000, max_bytes=16 * 1024 * 1024):
+        """
+        :param ttl: Seconds after which an issued challenge expires
+        :param max_entries: Maximum amount of stored challenges
+        :param max_bytes: Maximum accumulated size of stored images
+        """
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+        # Ordered by issue time, oldest first
+        self._entries = OrderedDict()
+
+    def configure(self, ttl, max_entries, max_bytes):
+        """Change the store limits, keeping still valid challenges"""
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.expire()
+        self._evict()
+
+    def __contains__(self, uuid):
+        return self.get(uuid) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _size(captcha):
+        return len(captcha['image'])
+
+    def put(self, uuid, captcha):
+        """Store a newly issued challenge for a client, replacing older ones"""
+
+        self.discard(uuid)
+
+        captcha['size'] = self._size(captcha)
+        self._entries[uuid] = captcha
+        self.bytes += captcha['size']
+
+        self.expire(captcha['time'])
+        self._evict()
+
+    def get(self, uuid, now=None):
+        """Return a client's still valid challenge or None"""
+
+        captcha = self._entries.get(uuid, None)
+        if captcha is None:
+            return None
+
+        if now is None:
+            now = time()
+
+        if captcha['time'] + self.ttl < now:
+            self._remove(uuid)
+            self.expired += 1
+            return None
+
+        return captcha
+
+    def consume(self, uuid, text):
+        """Verify a solution, the challenge can only be used once"""
+
+        captcha = self.get(uuid)
+        if captcha is None:
+            return False
+
+        self._remove(uuid)
+
+        return text == captcha['text']
+
+    def discard(self, uuid):
+        """Drop a client's challenge, e.g. when it disconnects"""
+
+        if uuid in self._entries:
+            self._remove(uuid)
+
+    def expire(self, now=None):
+        """Drop all challenges that have run out of time"""
+
+        if now is None:
+            now = time()
+
+        deadline = now - self.ttl
+        count = 0
+
+        while len(self._entries) > 0:
+            uuid, captcha = next(iter(self._entries.items()))
+            if captcha['time'] >= deadline:
+                break
+
+            self._remove(uuid)
+            count += 1
+
+        self.expired += count
+        return count
+
+    def stats(self):
+        """Return entry count, memory usage and eviction counters"""
+
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or \
+                (self.bytes > self.max_bytes and len(self._entries) > 1):
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def _remove(self, uuid):
+        captcha = self._entries.pop(uuid)
+        self.bytes -= captcha['size']
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: CLI
+===========
+
+Management commands of the enrol module, available as 'iso plugin enrol'.
+
+Import and export enrollments and users:
+
+    iso plugin enrol export users users.jsonl
+    iso plugin enrol import enrollments enrollments.csv
+
+Imports should be run while the node is stopped, as running EnrolManagers
+do not learn about names and addresses imported from the command line.
+Use the 'import_records' event of a running node instead.
+
+"""
+
+import sys
+
+import click
+from click_didyoumean import DYMGroup
+
+from isomer.logger import isolog, warn, error
+
+
+def log(*args, **kwargs):
+    isolog(emitter='ENROL-CLI', *args, **kwargs)
+
+
+KIND = click.Choice(['enrollments', 'users'])
+FORMAT = click.Choice(['csv', 'jsonl'])
+
+
+@click.group(cls=DYMGroup)
+@click.pass_context
+def enrol(ctx):
+    """[GROUP] Enrollment and user management operations"""
+
+    from isomer import database
+    database.initialize(ctx.obj['dbhost'], ctx.obj['dbname'])
+    ctx.obj['db'] = database
+
+
+@enrol.command('export', short_help='Export enrollments or users')
+@click.argument('kind', type=KIND)
+@click.argument('filename', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'file_format', type=FORMAT, default=None,
+              help='File format, guessed from the file name by default')
+@click.option('--secrets', is_flag=True, default=False,
+              help='Include password hashes of users and passwords of enrollments')
+@click.pass_context
+def export_command(ctx, kind, filename, file_format, secrets):
+    """Export all enrollments or users to a CSV or JSONL file"""
+
+    from isomer.enrol.transfer import stream_export, detect_format
+
+    if file_format is None:
+        file_format = detect_format(filename)
+
+    written = 0
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        for written in stream_export(kind, f, file_format, secrets):
+            log('Exported', written, kind)
+
+    log('Done, exported', written, kind, 'to', filename)
+
+
+@enrol.command('import', short_help='Import enrollments or users')
+@click.argument('kind', type=KIND)
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=FORMAT, default=None,
+              help='File format, guessed from the file name by default')
+@click.option('--chunk-size', default=500, help='Records to write at once')
+@click.option('--roles', default='crew',
+              help='Comma separated roles of imported users without any')
+@click.option('--restart', is_flag=True, default=False,
+              help='Start over instead of resuming an interrupted import')
+@click.pass_context
+def import_command(ctx, kind, filename, file_format, chunk_size, roles, restart):
+    """Import enrollments or users from a CSV or JSONL file
+
+    Users may either have a 'passhash' or a plain 'password' field, which
+    is hashed with the system salt.
+    """
+
+    from isomer.enrol.transfer import Importer
+
+    systemconfig = ctx.obj['db'].objectmodels['systemconfig'].find_one({'active': True})
+    try:
+        salt = systemconfig.salt.encode('ascii')
+    except (KeyError, AttributeError):
+        log('No systemconfig or it is without a salt, plain passwords cannot be '
+            'imported', lvl=warn)
+        salt = None
+
+    importer = Importer(kind, filename, file_format, chunk_size, salt,
+                        [role.strip() for role in roles.split(',')], restart)
+
+    progress = None
+    for progress in importer.run():
+        for record, reason in progress['rejected_records']:
+            log('Record', record, 'rejected:', reason, lvl=warn)
+        log('Imported', progress['imported'], 'skipped', progress['skipped'],
+            'rejected', progress['rejected'], 'of', progress['record'], 'records')
+
+    if progress['rejected'] > 0:
+        log('Done, but', progress['rejected'], 'records were rejected', lvl=error)
+        sys.exit(1)
+
+    log('Done')
@@ -48,7 +48,7 @@ EnrollmentSchema['properties'].update({
     'status': {
         'type': 'string',
         'enum': [
-            'Open', 'Pending', 'Denied', 'Accepted'
+            'Open', 'Pending', 'Denied', 'Accepted', 'Expired'
         ],
         'title': 'Enrollment description',
         'description': 'Enrollment description'
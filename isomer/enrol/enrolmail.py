@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Schema: Enrolmail
+=================
+
+Contains
+--------
+
+enrolmail: Outbound mail queued for delivery by the enrol module
+
+
+"""
+
+from isomer.schemata.defaultform import *
+from isomer.schemata.base import base_object
+
+EnrolMailSchema = base_object('enrolmail')
+
+EnrolMailSchema['properties'].update({
+    'recipient': {
+        'type': 'string', 'title': 'Recipient',
+        'description': 'Mail address to deliver to'
+    },
+    'subject': {
+        'type': 'string', 'title': 'Subject',
+        'description': 'Rendered mail subject'
+    },
+    'body': {
+        'type': 'string', 'title': 'Body',
+        'description': 'Rendered mail body'
+    },
+    'enrollment': {
+        'type': 'string', 'title': 'Enrollment',
+        'description': 'Unique id of the enrollment (or, for password resets, '
+                       'the user) this mail belongs to'
+    },
+    'kind': {
+        'type': 'string',
+        'enum': [
+            'invitation', 'acceptance', 'reset'
+        ],
+        'title': 'Kind',
+        'description': 'Kind of mail, only one mail per kind and enrollment is queued'
+    },
+    'secrets': {
+        'type': 'array', 'title': 'Secrets',
+        'items': {'type': 'string'},
+        'description': 'Names of the placeholders in the body, whose values are '
+                       'only kept in memory'
+    },
+    'batch': {
+        'type': 'string', 'title': 'Batch',
+        'description': 'Unique id of the bulk invitation this mail belongs to'
+    },
+    'status': {
+        'type': 'string',
+        'enum': [
+            'Queued', 'Failed'
+        ],
+        'title': 'Status',
+        'description': 'Delivery status'
+    },
+    'reason': {
+        'type': 'string', 'title': 'Reason',
+        'description': 'Why the delivery failed'
+    },
+    'attempts': {
+        'type': 'integer', 'title': 'Attempts',
+        'description': 'Number of failed delivery attempts',
+        'default': 0
+    },
+    'next_attempt': {
+        'type': 'number', 'title': 'Next attempt',
+        'description': 'Time of the next delivery attempt'
+    },
+    'timestamp': {
+        'type': 'string', 'format': 'datetimepicker',
+        'title': 'Queued',
+        'description': 'Date the mail was queued'
+    }
+})
+
+EnrolMailForm = [
+    {
+        'type': 'section',
+        'htmlClass': 'row',
+        'items': [
+            {
+                'type': 'section',
+                'htmlClass': 'col-xs-4',
+                'items': [
+                    'recipient', 'subject', 'kind'
+                ]
+            },
+            {
+                'type': 'section',
+                'htmlClass': 'col-xs-4',
+                'items': [
+                    'status', 'attempts', 'timestamp'
+                ]
+            },
+        ]
+    },
+    editbuttons
+]
+
+EnrolMail = {'schema': EnrolMailSchema, 'form': EnrolMailForm}
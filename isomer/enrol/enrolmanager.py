@@ -30,25 +30,44 @@ Module: EnrolManager
 
 """
 
-from base64 import b64encode
+from collections import deque
+from copy import deepcopy
+from csv import reader
+from datetime import datetime, timedelta
+from io import StringIO
+from json import dump
+from os import replace
+from os.path import basename, join
 from time import time
-from string import ascii_letters, digits
-from random import choice
-from captcha.image import ImageCaptcha
-from validate_email import validate_email
-from circuits import Timer, Event
-from pystache import render
+from circuits import Timer, Event, Worker, task
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from isomer.component import ConfigurableComponent, handler
 from isomer.events.system import authorized_event, anonymous_event
 from isomer.events.client import send
 from isomer.database import objectmodels, ValidationError
-from isomer.logger import warn, debug, verbose, error, hilight, isolog
+from isomer.logger import warn, debug, verbose, error, isolog
 from isomer.misc import i18n as _
 from isomer.misc.std import std_hash, std_now, std_uuid, std_human_uid
 from isomer.ui.auth import minimum_password_length, minimum_username_length
 from isomer.mail import send_mail
 
+from isomer.enrol.availability import AvailabilityIndex
+from isomer.enrol.enrollment import EnrollmentForm
+from isomer.enrol.indices import prepare_indices
+from isomer.enrol.metrics import Metrics, instrumented
+from isomer.enrol.packets import PacketCache, packet as build_packet
+from isomer.enrol.resets import request_token, set_password
+from isomer.enrol.cache import TTLCache, MISSING
+from isomer.enrol.validation import MailValidator, VALIDATION_MODES
+from isomer.enrol.transfer import Importer, stream_export, detect_format, \
+    KINDS as TRANSFER_KINDS, FORMATS as TRANSFER_FORMATS
+from isomer.enrol.captchas import CaptchaPool, CaptchaStore, CaptchaRenderer, \
+    ProcessCaptchaRenderer, CAPTCHA_FONTS, CAPTCHA_FORMATS
+from isomer.enrol.outbox import MailQueue, placeholder
+from isomer.enrol.ratelimit import RateLimiter
+from isomer.enrol.templates import MailTemplate
+
 
 class change(authorized_event):
     roles = ['admin']
@@ -58,6 +77,38 @@ class invite(authorized_event):
     roles = ['admin']
 
 
+class bulk_invite(authorized_event):
+    roles = ['admin']
+
+
+class mail_status(authorized_event):
+    roles = ['admin']
+
+
+class metrics(authorized_event):
+    roles = ['admin']
+
+
+class slow_handlers(authorized_event):
+    roles = ['admin']
+
+
+class export_records(authorized_event):
+    roles = ['admin']
+
+
+class import_records(authorized_event):
+    roles = ['admin']
+
+
+class list_enrollments(authorized_event):
+    roles = ['admin']
+
+
+# Sent as 'list' action, without shadowing the builtin in this module
+list_enrollments.__name__ = list_enrollments.__qualname__ = 'list'
+
+
 class delete(authorized_event):
     roles = ['admin']
 
@@ -102,6 +153,10 @@ class request_reset(anonymous_event):
     pass
 
 
+class reset_password(anonymous_event):
+    pass
+
+
 class EnrolManager(ConfigurableComponent):
     """
     The Enrol-EnrolManager handles enrollment requests, invitations and user
@@ -198,9 +253,393 @@ Click this link to login:
 Have fun,
 the friendly robot of {{node_name}}
 '''
+        },
+        'reset_subject': {
+            'type': 'string',
+            'title': 'Reset Subject',
+            'description': 'Password reset mail subject',
+            'default': 'Password reset on {{node_name}}'
+        },
+        'reset_mail': {
+            'type': 'string',
+            'title': 'Reset mail',
+            'description': 'Password reset mail text',
+            'x-schema-form': {
+                'type': 'textarea'
+            },
+            'default': '''Hello {{name}}!
+Someone, hopefully you, asked to reset your password on {{node_name}}.
+Click this link to choose a new password:
+{{reset_url}}
+
+If you did not ask for this, you can ignore this mail.
+
+Have fun,
+the friendly robot of {{node_name}}
+'''
+        },
+        'reset_ttl': {
+            'type': 'integer',
+            'title': 'Reset link lifetime',
+            'description': 'Seconds a password reset link can be used',
+            'default': 3600
+        },
+        'captcha_pool_size': {
+            'type': 'integer',
+            'title': 'Captcha pool size',
+            'description': 'Amount of captchas to render in advance (0 to disable)',
+            'default': 50
+        },
+        'captcha_pool_low_water': {
+            'type': 'integer',
+            'title': 'Captcha pool low water mark',
+            'description': 'Refill the captcha pool when fewer captchas are left',
+            'default': 10
+        },
+        'captcha_ttl': {
+            'type': 'integer',
+            'title': 'Captcha lifetime',
+            'description': 'Seconds after which an unsolved captcha expires',
+            'default': 300
+        },
+        'captcha_store_entries': {
+            'type': 'integer',
+            'title': 'Captcha store entries',
+            'description': 'Maximum amount of simultaneously issued captchas',
+            'default': 1000
+        },
+        'captcha_store_bytes': {
+            'type': 'integer',
+            'title': 'Captcha store size',
+            'description': 'Maximum memory in bytes used by issued captchas',
+            'default': 16777216
+        },
+        'captcha_width': {
+            'type': 'integer',
+            'title': 'Captcha width',
+            'description': 'Width of captcha images in pixels',
+            'default': 160
+        },
+        'captcha_height': {
+            'type': 'integer',
+            'title': 'Captcha height',
+            'description': 'Height of captcha images in pixels',
+            'default': 60
+        },
+        'captcha_fonts': {
+            'type': 'array',
+            'title': 'Captcha fonts',
+            'description': 'TrueType font files to render captchas with',
+            'items': {'type': 'string'},
+            'default': list(CAPTCHA_FONTS)
+        },
+        'captcha_format': {
+            'type': 'string',
+            'enum': list(CAPTCHA_FORMATS),
+            'title': 'Captcha format',
+            'description': 'Image format of captchas, JPEG is considerably smaller',
+            'default': 'PNG'
+        },
+        'captcha_quality': {
+            'type': 'integer',
+            'title': 'Captcha JPEG quality',
+            'description': 'Compression quality of JPEG captchas (1-95)',
+            'default': 70
+        },
+        'captcha_processes': {
+            'type': 'integer',
+            'title': 'Captcha processes',
+            'description': 'Render captchas in this many worker processes (0 to '
+                           'render in a thread of the node process)',
+            'default': 0
+        },
+        'accept_cache_ttl': {
+            'type': 'integer',
+            'title': 'Accept cache lifetime',
+            'description': 'Seconds to answer repeated invitation link clicks of '
+                           'accepted or pending enrollments from memory (0 to disable)',
+            'default': 60
+        },
+        'accept_cache_negative_ttl': {
+            'type': 'integer',
+            'title': 'Accept cache lifetime for unknown enrollments',
+            'description': 'Seconds to remember that an invitation link points to '
+                           'no enrollment (0 to disable)',
+            'default': 10
+        },
+        'accept_cache_entries': {
+            'type': 'integer',
+            'title': 'Accept cache entries',
+            'description': 'Maximum amount of remembered invitation links',
+            'default': 10000
+        },
+        'availability_ttl': {
+            'type': 'integer',
+            'title': 'Availability index lifetime',
+            'description': 'Seconds after which the index of taken names and mail '
+                           'addresses is reloaded, to learn about users created '
+                           'elsewhere (0 to keep it)',
+            'default': 3600
+        },
+        'reset_workers': {
+            'type': 'integer',
+            'title': 'Password reset workers',
+            'description': 'Size of the worker pool to look up accounts and tokens '
+                           'of password resets in (0 to run them on the event loop)',
+            'default': 1
+        },
+        'hash_workers': {
+            'type': 'integer',
+            'title': 'Password hashing workers',
+            'description': 'Size of the worker pool to hash passwords in (0 to hash '
+                           'on the event loop)',
+            'default': 2
+        },
+        'hash_processes': {
+            'type': 'boolean',
+            'title': 'Hash in processes',
+            'description': 'Use a process instead of a thread pool for password hashing',
+            'default': False
+        },
+        'mail_validation': {
+            'type': 'string',
+            'enum': list(VALIDATION_MODES),
+            'title': 'Mail validation',
+            'description': 'Syntax checks addresses offline, MX also contacts the '
+                           'mail servers of their domain, Verify also asks the mail '
+                           'servers, if they accept the address',
+            'default': 'Syntax'
+        },
+        'mail_validation_ttl': {
+            'type': 'integer',
+            'title': 'Mail validation lifetime',
+            'description': 'Seconds to remember valid addresses and domains',
+            'default': 86400
+        },
+        'mail_validation_negative_ttl': {
+            'type': 'integer',
+            'title': 'Mail validation negative lifetime',
+            'description': 'Seconds to remember invalid addresses and domains',
+            'default': 600
+        },
+        'mail_validation_entries': {
+            'type': 'integer',
+            'title': 'Mail validation cache entries',
+            'description': 'Maximum amount of remembered addresses and domains, each',
+            'default': 10000
+        },
+        'mail_validation_workers': {
+            'type': 'integer',
+            'title': 'Mail validation workers',
+            'description': 'Size of the worker pool to run MX and Verify lookups in '
+                           '(0 to run them on the event loop)',
+            'default': 2
+        },
+        'mail_validation_timeout': {
+            'type': 'integer',
+            'title': 'Mail validation timeout',
+            'description': 'Seconds to wait for mail servers during MX and Verify lookups',
+            'default': 10
+        },
+        'user_batch_size': {
+            'type': 'integer',
+            'title': 'User batch size',
+            'description': 'Maximum amount of accepted users to store with a single write',
+            'default': 20
+        },
+        'user_batch_window': {
+            'type': 'number',
+            'title': 'User batch window',
+            'description': 'Seconds to collect accepted users for a single write '
+                           '(0 to store every user immediately)',
+            'default': 0.05
+        },
+        'captcha_delay': {
+            'type': 'number',
+            'title': 'Captcha delay',
+            'description': 'Seconds to delay captcha delivery by, to slow down bots '
+                           '(0 to deliver immediately)',
+            'default': 0
+        },
+        'mail_rate': {
+            'type': 'integer',
+            'title': 'Mail rate',
+            'description': 'Maximum amount of queued mails to send per second',
+            'default': 10
+        },
+        'bulk_progress_interval': {
+            'type': 'integer',
+            'title': 'Bulk progress interval',
+            'description': 'Report bulk invitation progress every this many sent mails',
+            'default': 100
+        },
+        'list_page_size': {
+            'type': 'integer',
+            'title': 'Enrollment list page size',
+            'description': 'Maximum amount of enrollments returned per list request',
+            'default': 1000
+        },
+        'list_chunk_size': {
+            'type': 'integer',
+            'title': 'Enrollment list chunk size',
+            'description': 'Amount of enrollments sent per list packet',
+            'default': 100
+        },
+        'transfer_path': {
+            'type': 'string',
+            'title': 'Transfer directory',
+            'description': 'Directory for imported and exported enrollment and user '
+                           'files (empty to disable imports and exports)',
+            'default': ''
+        },
+        'transfer_chunk_size': {
+            'type': 'integer',
+            'title': 'Transfer chunk size',
+            'description': 'Amount of records imported or exported at once',
+            'default': 500
+        },
+        'metrics_file': {
+            'type': 'string',
+            'title': 'Metrics file',
+            'description': 'Periodically write handler metrics as JSON to this '
+                           'file (empty to disable)',
+            'default': ''
+        },
+        'metrics_interval': {
+            'type': 'integer',
+            'title': 'Metrics interval',
+            'description': 'Seconds between writes of the metrics file',
+            'default': 60
+        },
+        'watchdog': {
+            'type': 'boolean',
+            'title': 'Watchdog',
+            'description': 'Measure the event loop lag and record handlers blocking '
+                           'the loop for longer than the watchdog threshold',
+            'default': False
+        },
+        'watchdog_interval': {
+            'type': 'number',
+            'title': 'Watchdog interval',
+            'description': 'Seconds between loop lag measurements',
+            'default': 0.5
+        },
+        'watchdog_threshold': {
+            'type': 'integer',
+            'title': 'Watchdog threshold',
+            'description': 'Milliseconds a handler may block the loop or the loop may '
+                           'lag, before it is recorded',
+            'default': 100
+        },
+        'watchdog_entries': {
+            'type': 'integer',
+            'title': 'Watchdog entries',
+            'description': 'Amount of recorded slow handlers and loop lags to keep',
+            'default': 50
+        },
+        'mail_retries': {
+            'type': 'integer',
+            'title': 'Mail retries',
+            'description': 'Give up delivering a mail after this many failed attempts',
+            'default': 5
+        },
+        'mail_retry_delay': {
+            'type': 'integer',
+            'title': 'Mail retry delay',
+            'description': 'Seconds to wait before retrying a failed mail, doubled '
+                           'on every further attempt',
+            'default': 60
+        },
+        'expiry_days': {
+            'type': 'integer',
+            'title': 'Enrollment expiry',
+            'description': 'Days after which open and pending enrollments expire '
+                           '(0 to keep them forever)',
+            'default': 90
+        },
+        'expiry_action': {
+            'type': 'string',
+            'enum': ['Expire', 'Delete'],
+            'title': 'Expiry action',
+            'description': 'Mark stale enrollments as expired or delete them',
+            'default': 'Expire'
+        },
+        'expiry_interval': {
+            'type': 'integer',
+            'title': 'Expiry interval',
+            'description': 'Seconds between expiry sweeps',
+            'default': 3600
+        },
+        'expiry_batch': {
+            'type': 'integer',
+            'title': 'Expiry batch size',
+            'description': 'Enrollments to process per step of an expiry sweep',
+            'default': 100
+        },
+        'rate_limits': {
+            'type': 'object',
+            'title': 'Rate limits',
+            'description': 'Requests per minute and burst size per client for '
+                           'anonymous events',
+            'properties': {
+                name: {
+                    'type': 'object',
+                    'properties': {
+                        'rate': {'type': 'number', 'title': 'Requests per minute'},
+                        'burst': {'type': 'integer', 'title': 'Burst size'}
+                    }
+                } for name in ('captcha', 'enrol', 'status', 'request_reset',
+                               'reset_password')
+            },
+            'default': {
+                'captcha': {'rate': 10, 'burst': 5},
+                'enrol': {'rate': 5, 'burst': 3},
+                'status': {'rate': 30, 'burst': 10},
+                'request_reset': {'rate': 3, 'burst': 3},
+                'reset_password': {'rate': 5, 'burst': 3}
+            }
+        },
+        'rate_limit_address_factor': {
+            'type': 'integer',
+            'title': 'Address rate limit factor',
+            'description': 'Multiplier for the rate limits per source address, '
+                           'which can be shared by many clients',
+            'default': 5
         }
     }
 
+    # Setup steps and the configuration keys they depend on. On reloads,
+    # only the steps affected by changed keys are run again.
+    _setup_dependencies = (
+        ('_setup_captchas', ('captcha_pool_size', 'captcha_pool_low_water',
+                             'captcha_ttl', 'captcha_store_entries',
+                             'captcha_store_bytes')),
+        ('_setup_captcha_renderer', ('captcha_width', 'captcha_height',
+                                     'captcha_fonts', 'captcha_format',
+                                     'captcha_quality', 'captcha_processes')),
+        ('_setup_captcha_timer', ('captcha_delay',)),
+        ('_setup_accept_cache', ('accept_cache_ttl', 'accept_cache_entries')),
+        ('_setup_availability', ('availability_ttl',)),
+        ('_setup_hashing', ('hash_workers', 'hash_processes')),
+        ('_setup_resets', ('reset_workers',)),
+        ('_setup_roles', ('group_accept_invited', 'group_accept_enrolled')),
+        ('_setup_mail_validation', ('mail_validation', 'mail_validation_ttl',
+                                    'mail_validation_negative_ttl',
+                                    'mail_validation_entries',
+                                    'mail_validation_workers',
+                                    'mail_validation_timeout')),
+        ('_setup_rate_limits', ('rate_limits', 'rate_limit_address_factor')),
+        ('_setup_mail', ('mail_retries', 'mail_retry_delay')),
+        ('_setup_sweeper', ('expiry_days', 'expiry_interval')),
+        ('_setup_metrics', ('metrics_file', 'metrics_interval')),
+        ('_setup_watchdog', ('watchdog', 'watchdog_interval', 'watchdog_threshold',
+                             'watchdog_entries')),
+        ('_setup_packets', ('allow_registration',)),
+        ('_setup_templates', ('invitation_subject', 'invitation_mail',
+                              'acceptance_subject', 'acceptance_mail',
+                              'reset_subject', 'reset_mail', 'systemconfig')),
+    )
+
     def __init__(self, *args, **kwargs):
         """
         Initialize the Enrol Manager component.
@@ -210,6 +649,48 @@ the friendly robot of {{node_name}}
 
         super(EnrolManager, self).__init__("ENROL", *args, **kwargs)
 
+        self.captcha_pool = None
+        self.hash_worker = None
+        self.reset_worker = None
+        self.accepting = {}
+        self.mail_validator = None
+        self.validation_worker = None
+        self.roles = {}
+        self.user_batch = []
+        self.user_batch_timer = None
+        self.captcha_timer = None
+        self.captcha_queue = deque()
+        self.mail_timer = None
+        self.mail_queue = None
+        self.mail_flushing = False
+        self.bulk_invites = {}
+        self.sweep_timer = None
+        self.sweeping = False
+        self.rate_limiter = None
+        self.metrics = Metrics()
+        self.metrics_timer = None
+        self.transfers = set()
+        self.watchdog_timer = None
+        self.watchdog_due = None
+        self.packets = PacketCache()
+        self.captchas = None
+        self.systemconfig = None
+
+        # Snapshot of the configuration, the current setup is based on
+        self._configuration = {}
+
+        self.availability = AvailabilityIndex()
+        # Fields of the enrollment list, what the form shows and the
+        # identifying uuid and method needed for actions
+        self.list_fields = set(self._form_fields(EnrollmentForm))
+        self.list_fields.update(('uuid', 'method'))
+        # Enrollment status (None for unknown ones) by uuid, for accept
+        self.accept_cache = TTLCache()
+        # Building indices can take long on big collections, so it happens
+        # in the background
+        self.indices_ready = False
+        self.fire(Event.create('enrol_indices'))
+
         self.log("Started")
         self._setup()
 
@@ -223,23 +704,74 @@ the friendly robot of {{node_name}}
         self.log('Reloaded configuration.')
         self._setup()
 
+    @handler('enrol_indices')
+    def enrol_indices(self):
+        """Create missing indices in a worker thread"""
+
+        worker = Worker(workers=1, channel=self.uniquename + '-indices').register(self)
+        try:
+            value = yield self.call(task(prepare_indices), worker.channel)
+        finally:
+            worker.unregister()
+
+        if value.errors:
+            self.log('Could not prepare indices:', value.value[1], lvl=error)
+            return
+
+        self.indices_ready = True
+        self.log('Indices prepared', lvl=debug)
+
     def _setup(self):
-        self.image_captcha = ImageCaptcha(
-            fonts=['/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf'])
+        """Set up everything depending on configuration keys that changed
+        since the last call"""
+
+        changed = self._changed_configuration()
+
+        if self._setup_system():
+            changed.add('systemconfig')
+        elif self.systemconfig is None:
+            return
+
+        for name, keys in self._setup_dependencies:
+            if not changed.isdisjoint(keys):
+                getattr(self, name)()
+
+        self.log("Set up done, changed:", sorted(changed), lvl=verbose)
+
+    def _changed_configuration(self):
+        snapshot = {
+            key: deepcopy(getattr(self.config, key, None))
+            for key in self.configprops
+        }
 
-        self.captchas = {}
+        changed = set(
+            key for key, value in snapshot.items()
+            if key not in self._configuration or self._configuration[key] != value
+        )
+        self._configuration = snapshot
+
+        return changed
+
+    def _setup_system(self):
+        """Read the node's systemconfig, returns True if it changed"""
 
         systemconfig = objectmodels['systemconfig'].find_one({'active': True})
 
         try:
             salt = systemconfig.salt.encode('ascii')
-            self.log('Using active systemconfig salt')
         except (KeyError, AttributeError):
             self.log(
                 'No system salt found! Check your configuration. This can happen upon first start.',
                 lvl=error)
             self.unregister()
-            return
+            return False
+
+        node = (salt, systemconfig.hostname, systemconfig.name)
+        if self.systemconfig is not None and node == (
+                self.salt, self.hostname, self.node_name):
+            return False
+
+        self.log('Using active systemconfig salt')
 
         protocol = "https"
         hostname = systemconfig.hostname
@@ -248,31 +780,333 @@ the friendly robot of {{node_name}}
         self.node_name = systemconfig.name
         self.node_url = protocol + '://' + hostname
         self.invitation_url = self.node_url + '/#!/invitation/'
+        self.reset_url = self.node_url + '/#!/resetaccount/'
 
         self.salt = salt
         self.systemconfig = systemconfig
 
-        self.log("Set up done", lvl=verbose)
+        return True
+
+    def _setup_captchas(self):
+        if self.captcha_pool is None:
+            self.captcha_pool = CaptchaPool(
+                self._captcha_renderer,
+                self.config.captcha_pool_size,
+                self.config.captcha_pool_low_water
+            )
+        else:
+            self.captcha_pool.resize(
+                self.config.captcha_pool_size,
+                self.config.captcha_pool_low_water
+            )
+
+        if self.captchas is None:
+            self.captchas = CaptchaStore(
+                self.config.captcha_ttl,
+                self.config.captcha_store_entries,
+                self.config.captcha_store_bytes
+            )
+        else:
+            self.captchas.configure(
+                self.config.captcha_ttl,
+                self.config.captcha_store_entries,
+                self.config.captcha_store_bytes
+            )
+
+    def _setup_captcha_renderer(self):
+        if self.captcha_pool is not None:
+            self.captcha_pool.replace(self._captcha_renderer)
+
+    def _captcha_renderer(self):
+        """Create the configured captcha renderer, called by the pool on
+        first use"""
+
+        options = {
+            'width': self.config.captcha_width,
+            'height': self.config.captcha_height,
+            'fonts': self.config.captcha_fonts,
+            'image_format': self.config.captcha_format,
+            'quality': self.config.captcha_quality
+        }
+
+        if self.config.captcha_processes > 0:
+            return ProcessCaptchaRenderer(self.config.captcha_processes, **options)
+
+        return CaptchaRenderer(**options)
+
+    def _setup_captcha_timer(self):
+        if self.captcha_timer is not None:
+            self.captcha_timer.unregister()
+            self.captcha_timer = None
+
+        if self.config.captcha_delay > 0:
+            # A single timer delivers all due captchas in batches
+            self.captcha_timer = Timer(
+                min(self.config.captcha_delay, 0.25),
+                Event.create('captcha_transmit_due'), persist=True
+            ).register(self)
+        else:
+            while len(self.captcha_queue) > 0:
+                due, captcha, uuid = self.captcha_queue.popleft()
+                self.captcha_transmit(captcha, uuid)
+
+    def _setup_accept_cache(self):
+        self.accept_cache.ttl = self.config.accept_cache_ttl
+        self.accept_cache.max_entries = self.config.accept_cache_entries
+        self.accept_cache.clear()
+
+    def _setup_availability(self):
+        self.availability.ttl = self.config.availability_ttl
+
+    def _setup_hashing(self):
+        if self.hash_worker is not None:
+            self.hash_worker.unregister()
+            self.hash_worker = None
+
+        if self.config.hash_workers > 0:
+            self.hash_worker = Worker(
+                process=self.config.hash_processes,
+                workers=self.config.hash_workers,
+                channel=self.uniquename + '-hashing'
+            ).register(self)
+
+    def _setup_resets(self):
+        if self.reset_worker is not None:
+            self.reset_worker.unregister()
+            self.reset_worker = None
+
+        if self.config.reset_workers > 0:
+            self.reset_worker = Worker(
+                workers=self.config.reset_workers,
+                channel=self.uniquename + '-resets'
+            ).register(self)
+
+    def _setup_roles(self):
+        self.roles = {
+            'Invited': self._parse_roles(self.config.group_accept_invited),
+            'Enrolled': self._parse_roles(self.config.group_accept_enrolled)
+        }
+
+    def _setup_mail_validation(self):
+        options = (
+            self.config.mail_validation,
+            self.config.mail_validation_ttl,
+            self.config.mail_validation_negative_ttl,
+            self.config.mail_validation_entries,
+            self.config.mail_validation_timeout
+        )
+
+        if self.mail_validator is None:
+            self.mail_validator = MailValidator(*options)
+        else:
+            self.mail_validator.configure(*options)
+
+        if self.validation_worker is not None:
+            self.validation_worker.unregister()
+            self.validation_worker = None
+
+        # Syntax checks are cheap and run on the event loop
+        if self.mail_validator.mode != 'Syntax' and \
+                self.config.mail_validation_workers > 0:
+            self.validation_worker = Worker(
+                workers=self.config.mail_validation_workers,
+                channel=self.uniquename + '-validation'
+            ).register(self)
+
+    def _setup_rate_limits(self):
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter(self.config.rate_limits)
+
+        self.rate_limiter.limits = self.config.rate_limits
+        self.rate_limiter.address_factor = self.config.rate_limit_address_factor
+
+    def _setup_mail(self):
+        if self.mail_queue is None:
+            self.mail_queue = MailQueue()
+            lost = self.mail_queue.load()
+            if len(lost) > 0:
+                self.fire(Event.create('mail_secrets_lost', lost))
+
+        self.mail_queue.retries = self.config.mail_retries
+        self.mail_queue.retry_delay = self.config.mail_retry_delay
+
+        if self.mail_timer is None:
+            self.mail_timer = Timer(
+                1, Event.create('mail_queue_flush'), persist=True
+            ).register(self)
+
+    def _setup_sweeper(self):
+        if self.sweep_timer is not None:
+            self.sweep_timer.unregister()
+            self.sweep_timer = None
+
+        if self.config.expiry_days > 0:
+            self.sweep_timer = Timer(
+                self.config.expiry_interval,
+                Event.create('enrollment_sweep'), persist=True
+            ).register(self)
+
+    def _setup_metrics(self):
+        if self.metrics_timer is not None:
+            self.metrics_timer.unregister()
+            self.metrics_timer = None
+
+        if self.config.metrics_file != '' and self.config.metrics_interval > 0:
+            self.metrics_timer = Timer(
+                self.config.metrics_interval,
+                Event.create('metrics_dump'), persist=True
+            ).register(self)
+
+    def _setup_watchdog(self):
+        if self.watchdog_timer is not None:
+            self.watchdog_timer.unregister()
+            self.watchdog_timer = None
+
+        if self.config.watchdog is False:
+            self.metrics.configure_slow(0, self.config.watchdog_entries)
+            return
+
+        self.metrics.configure_slow(self.config.watchdog_threshold / 1000.0,
+                                    self.config.watchdog_entries)
+
+        self.watchdog_due = time() + self.config.watchdog_interval
+        self.watchdog_timer = Timer(
+            self.config.watchdog_interval, Event.create('watchdog_tick'), persist=True
+        ).register(self)
+
+    def _setup_templates(self):
+        static_context = {
+            'invitation_url': self.invitation_url,
+            'node_name': self.node_name,
+            'node_url': self.node_url
+        }
+        self.invitation_template = MailTemplate(
+            self.config.invitation_subject, self.config.invitation_mail, static_context
+        )
+        self.acceptance_template = MailTemplate(
+            self.config.acceptance_subject, self.config.acceptance_mail, static_context
+        )
+        self.reset_template = MailTemplate(
+            self.config.reset_subject, self.config.reset_mail, static_context
+        )
+
+    def _setup_packets(self):
+        """Build the replies, that only change with the configuration"""
+
+        self.packets.clear()
+
+        self.packets.define('status', 'status', self.config.allow_registration)
+        self.packets.define('changepassword_success', 'changepassword', True)
+        self.packets.define('changepassword_failure', 'changepassword', False)
+
+        self.packets.define('accept_accepted', 'accept', {
+            True: 'You can now log in to the system and start to use it.'
+        })
+        self.packets.define('accept_pending', 'accept', {
+            True: 'Someone has to confirm your enrollment first. '
+                  'Thank you, for your patience.'
+        })
+        self.packets.define('accept_invited', 'accept', {
+            True: 'You should have received an email with your new password '
+                  'and can now log in to the system and start to use it. <br/>'
+                  'Please change your password immediately after logging in'
+        })
+        self.packets.define('accept_activated', 'accept', {
+            True: 'Your account is now activated.'
+        })
 
     def _fail(self, event, msg="Error"):
         self.log('Sending failure feedback to', event.client.uuid, lvl=debug)
-        fail_msg = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': event.action,
-            'data': (False, msg)
-        }
-        self.fireEvent(send(event.client.uuid, fail_msg))
+        self.fireEvent(send(event.client.uuid,
+                            self.packets.feedback(event.action, False, msg)))
 
     def _acknowledge(self, event, msg="Done"):
         self.log('Sending success feedback to', event.client.uuid, lvl=debug)
-        success_msg = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': event.action,
-            'data': (True, msg)
-        }
-        self.fireEvent(send(event.client.uuid, success_msg))
+        self.fireEvent(send(event.client.uuid,
+                            self.packets.feedback(event.action, True, msg)))
+
+    def _rate_limited(self, event):
+        """Check an anonymous request against the rate limits and reject it
+        before doing any real work"""
+
+        if self.rate_limiter.allow(event.action, event.client.uuid,
+                                   getattr(event.client, 'ip', None)):
+            return False
+
+        self.log('Rate limited', event.action, 'request of', event.client.uuid,
+                 lvl=debug)
+        self._fail(event, 'Too many requests')
+        return True
+
+    def _hash(self, password):
+        """Hash a password in the worker pool, use with 'yield from'"""
+
+        with self.metrics.phase('hash'):
+            if self.hash_worker is None:
+                return std_hash(password, self.salt)
+
+            value = yield self.call(task(std_hash, password, self.salt),
+                                    self.hash_worker.channel)
+        if value.errors:
+            raise value.value[1]
+
+        return value.value
+
+    def _reset_task(self, function, *args):
+        """Run the database work of a password reset in the worker pool, use
+        with 'yield from'"""
+
+        with self.metrics.phase('db'):
+            if self.reset_worker is None:
+                return function(*args)
+
+            value = yield self.call(task(function, *args), self.reset_worker.channel)
+        if value.errors:
+            raise value.value[1]
+
+        return value.value
+
+    def _validate_mail(self, mail):
+        """Validate a mail address, running uncached lookups in the worker
+        pool, use with 'yield from'"""
+
+        with self.metrics.phase('validation'):
+            checks = self.mail_validator.pending(mail)
+            if checks is False:
+                return False
+
+            for kind, key in checks:
+                function, args = self.mail_validator.task(kind, key)
+                if self.validation_worker is None:
+                    try:
+                        result = function(*args)
+                    except Exception as e:
+                        self.log('Mail validation lookup failed:', e, lvl=warn)
+                        return False
+                else:
+                    value = yield self.call(task(function, *args),
+                                            self.validation_worker.channel)
+                    if value.errors:
+                        self.log('Mail validation lookup failed:', value.value[1],
+                                 lvl=warn)
+                        return False
+                    result = value.value
+
+                self.mail_validator.store(kind, key, result)
+                if result is not True:
+                    return False
+
+        return True
+
+    def _reject_enrol(self, event, msg):
+        """Fail an enrolment attempt and issue a fresh captcha, as every
+        captcha can only be used once"""
+
+        self._fail(event, msg)
+        self._generate_captcha(event)
 
     @handler(create)
+    @instrumented
     def create(self, event):
         """An admin user requests to create a new user"""
 
@@ -294,13 +1128,14 @@ the friendly robot of {{node_name}}
             self._fail(event, msg="Username too short")
             return
 
-        passhash = std_hash(password, self.salt)
-
-        existing = objectmodels['user'].find_one({'name': name})
-        if existing is not None:
+        with self.metrics.phase('db'):
+            exists = self.availability.user_exists(name)
+        if exists:
             self._fail(event, msg='User already exists')
             return
 
+        passhash = yield from self._hash(password)
+
         new_user = objectmodels['user']({
             'uuid': uuid,
             'name': name,
@@ -309,26 +1144,38 @@ the friendly robot of {{node_name}}
         })
 
         try:
-            new_user.save()
+            with self.metrics.phase('db'):
+                new_user.save()
+            self.availability.add_user(name, mail, uuid)
             self._acknowledge(event)
         except ValidationError as e:
             self.log("Tried to create invalid user:", e, exc=True, lvl=error)
             self._fail(event, msg="Invalid user data specified")
+        except DuplicateKeyError as e:
+            self.log("Tried to create existing user:", e, lvl=warn)
+            self._fail(event, msg="User or mail address already exists")
 
     @handler(change)
+    @instrumented
     def change(self, event):
         """An admin user requests a change to an enrolment"""
 
-        uuid = event.data['uuid']
         status = event.data['status']
 
         if status not in ['Open', 'Pending', 'Accepted', 'Denied', 'Resend']:
             self.log('Erroneous status for enrollment requested!', lvl=warn)
             return
 
+        if 'uuids' in event.data:
+            yield from self._change_many(event, event.data['uuids'], status)
+            return
+
+        uuid = event.data['uuid']
+
         self.log('Changing status of an enrollment', uuid, 'to', status)
 
-        enrollment = objectmodels['enrollment'].find_one({'uuid': uuid})
+        with self.metrics.phase('db'):
+            enrollment = objectmodels['enrollment'].find_one({'uuid': uuid})
         if enrollment is not None:
             self.log('Enrollment found', lvl=debug)
         else:
@@ -336,29 +1183,108 @@ the friendly robot of {{node_name}}
 
         if status == 'Resend':
             enrollment.timestamp = std_now()
-            enrollment.save()
+            with self.metrics.phase('db'):
+                enrollment.save()
             self._send_invitation(enrollment, event)
             reply = {True: 'Resent'}
         else:
+            # The enrollment is only marked as accepted, if its user exists
+            create = status == 'Accepted' and enrollment.method == 'Enrolled' and \
+                enrollment.status != 'Accepted'
+            if create:
+                created = yield from self._create_user(enrollment.name, enrollment.password,
+                                                       enrollment.email, 'Invited',
+                                                       event.client.uuid)
+                if not created:
+                    self._fail(event, 'Could not create the user')
+                    return
+
             enrollment.status = status
-            enrollment.save()
+            with self.metrics.phase('db'):
+                enrollment.save()
+            self.accept_cache.invalidate(uuid)
             reply = {True: enrollment.serializablefields()}
 
-        if status == 'Accepted' and enrollment.method == 'Enrolled':
-            self._create_user(enrollment.name, enrollment.password, enrollment.email,
-                              'Invited', event.client.uuid)
-            self._send_acceptance(enrollment, event)
+            if create:
+                self._send_acceptance(enrollment, event)
 
-        packet = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': 'change',
-            'data': reply
-        }
+        packet = build_packet('change', reply)
         self.log('packet:', packet, lvl=verbose)
         self.fireEvent(send(event.client.uuid, packet))
         self.log('Enrollment changed', lvl=debug)
 
+    def _change_many(self, event, uuids, status):
+        """Change the status of a list of enrollments with bulk operations
+
+        Enrollments are only marked as accepted, if their users could be
+        created. The others are reported as failed and can be retried.
+        """
+
+        self.log('Changing status of', len(uuids), 'enrollments to', status)
+
+        enrollment_model = objectmodels['enrollment']
+        found = []
+        changed = []
+        created = []
+
+        try:
+            with self.metrics.phase('db'):
+                enrollments = list(enrollment_model.find({'uuid': {'$in': uuids}}))
+            found = [enrollment.uuid for enrollment in enrollments]
+
+            if status == 'Resend':
+                with self.metrics.phase('db'):
+                    enrollment_model.collection().update_many(
+                        {'uuid': {'$in': found}}, {'$set': {'timestamp': std_now()}})
+                changed = found
+                for enrollment in enrollments:
+                    self._send_invitation(enrollment, event)
+            else:
+                accepted = []
+                if status == 'Accepted':
+                    accepted = [
+                        enrollment for enrollment in enrollments
+                        if enrollment.method == 'Enrolled' and enrollment.status != 'Accepted'
+                    ]
+                    created = yield from self._create_users([
+                        (enrollment.name, enrollment.password, enrollment.email, 'Invited')
+                        for enrollment in accepted
+                    ])
+
+                uncreated = set(
+                    enrollment.uuid for enrollment in accepted
+                    if enrollment.name not in created
+                )
+                selected = [uuid for uuid in found if uuid not in uncreated]
+                with self.metrics.phase('db'):
+                    enrollment_model.collection().update_many(
+                        {'uuid': {'$in': selected}}, {'$set': {'status': status}})
+                changed = selected
+                self.accept_cache.invalidate(*found)
+
+                for enrollment in accepted:
+                    if enrollment.name in created:
+                        self._send_acceptance(enrollment, event)
+        except Exception as e:
+            self.log('Error during batch enrollment change:', e, type(e),
+                     lvl=error, exc=True)
+
+        failed = [uuid for uuid in found if uuid not in changed]
+        if len(failed) > 0:
+            self.log('Could not change', len(failed), 'enrollments', lvl=warn)
+
+        packet = build_packet('change_batch', {
+            'status': status,
+            'changed': changed,
+            'failed': failed,
+            'missing': list(set(uuids) - set(found)),
+            'created': created
+        })
+        self.fireEvent(send(event.client.uuid, packet))
+        self.log('Enrollments changed:', len(changed), lvl=debug)
+
     @handler(changepassword)
+    @instrumented
     def changepassword(self, event):
         """An enrolled user wants to change their password"""
 
@@ -368,29 +1294,25 @@ the friendly robot of {{node_name}}
 
         # TODO: Write email to notify user of password change
 
-        user = objectmodels['user'].find_one({'uuid': uuid})
-        if std_hash(old, self.salt) == user.passhash:
-            user.passhash = std_hash(new, self.salt)
-            user.save()
+        with self.metrics.phase('db'):
+            user = objectmodels['user'].find_one({'uuid': uuid})
+        oldhash = yield from self._hash(old)
+        if oldhash == user.passhash:
+            user.passhash = yield from self._hash(new)
+            with self.metrics.phase('db'):
+                user.save()
 
-            packet = {
-                'component': 'isomer.enrol.enrolmanager',
-                'action': 'changepassword',
-                'data': True
-            }
-            self.fireEvent(send(event.client.uuid, packet))
+            self.fireEvent(send(event.client.uuid,
+                                self.packets['changepassword_success']))
             self.log('Successfully changed password for user', uuid)
         else:
-            packet = {
-                'component': 'isomer.enrol.enrolmanager',
-                'action': 'changepassword',
-                'data': False
-            }
-            self.fireEvent(send(event.client.uuid, packet))
+            self.fireEvent(send(event.client.uuid,
+                                self.packets['changepassword_failure']))
             self.log('User tried to change password without supplying old one',
                      lvl=warn)
 
     @handler(invite)
+    @instrumented
     def invite(self, event):
         """A new user has been invited to enrol by an admin user"""
 
@@ -401,10 +1323,116 @@ the friendly robot of {{node_name}}
 
         self._invite(name, method, email, event.client.uuid, event)
 
+    @handler(bulk_invite)
+    @instrumented
+    def bulk_invite(self, event):
+        """A list of new users has been invited to enrol by an admin user"""
+
+        method = event.data.get('method', 'Invited')
+        if 'csv' in event.data:
+            rows = reader(StringIO(event.data['csv']))
+            invitations = (
+                {'name': row[0].strip(), 'email': row[1].strip()}
+                for row in rows if len(row) >= 2 and row[:2] != ['name', 'email']
+            )
+        else:
+            invitations = event.data.get('invitations', [])
+
+        invitations = [
+            invitation for invitation in invitations if isinstance(invitation, dict)
+        ]
+
+        self.log('Bulk inviting', len(invitations), 'new users to enrol')
+
+        with self.metrics.phase('db'):
+            self.availability.confirm_many(
+                (invitation.get('name', None) for invitation in invitations),
+                (invitation.get('email', None) for invitation in invitations)
+            )
+
+        enrollments = []
+        rejected = []
+        names = set()
+        mails = set()
+
+        for invitation in invitations:
+            name = invitation.get('name', None)
+            email = invitation.get('email', None)
+
+            if not name or not email:
+                reason = 'Incomplete'
+            elif not (yield from self._validate_mail(email)):
+                reason = 'Invalid address'
+            elif email in mails or self.availability.mail_taken(email, False):
+                reason = 'Address taken'
+            elif name in names or self.availability.name_taken(name, False):
+                reason = 'Name taken'
+            else:
+                reason = None
+
+            if reason is not None:
+                rejected.append([name, email, reason])
+                continue
+
+            enrollment = objectmodels['enrollment']({
+                'uuid': std_uuid(),
+                'status': 'Open',
+                'name': name,
+                'method': method,
+                'email': email,
+                'password': '',
+                'timestamp': std_now()
+            })
+            try:
+                enrollment.validate()
+            except ValidationError:
+                rejected.append([name, email, 'Invalid data'])
+                continue
+
+            names.add(name)
+            mails.add(email)
+            enrollments.append(enrollment)
+
+        batch = std_uuid()
+        if len(enrollments) > 0:
+            with self.metrics.phase('db'):
+                objectmodels['enrollment'].bulk_create(enrollments)
+
+            self.bulk_invites[batch] = {
+                'client': event.client.uuid,
+                'total': len(enrollments),
+                'sent': 0
+            }
+
+        mails = []
+        for enrollment in enrollments:
+            self.availability.add_enrollment(enrollment.name, enrollment.uuid)
+
+            subject, mail = self._render_mail(self.invitation_template, enrollment)
+            mails.append((enrollment.email, subject, mail, enrollment.uuid,
+                          'invitation', batch))
+
+        with self.metrics.phase('db'):
+            self.mail_queue.enqueue_many(mails)
+
+        self.log('Bulk invitation stored:', len(enrollments), 'enrollments,',
+                 len(rejected), 'rejected', lvl=debug)
+
+        packet = build_packet('bulk_invite', {
+            'batch': batch,
+            'accepted': len(enrollments),
+            'rejected': rejected
+        })
+        self.fireEvent(send(event.client.uuid, packet))
+
     @handler(enrol)
+    @instrumented
     def enrol(self, event):
         """A user tries to self-enrol with the enrolment form"""
 
+        if self._rate_limited(event):
+            return
+
         if self.config.allow_registration is False:
             self.log('Someone tried to register although enrolment is closed.')
             return
@@ -414,256 +1442,525 @@ the friendly robot of {{node_name}}
 
         uuid = event.client.uuid
 
-        if uuid in self.captchas and event.data.get('captcha', None) == \
-                self.captchas[uuid]['text']:
+        if self.captchas.consume(uuid, event.data.get('captcha', None)):
             self.log('Captcha solved!')
         else:
             self.log('Captcha failed!')
-            self._fail(event, _('You did not solve the captcha correctly.', event))
-            self._generate_captcha(event)
-
+            self._reject_enrol(event, _('You did not solve the captcha correctly.', event))
             return
 
         mail = event.data.get('mail', None)
         if mail is None:
-            self._fail(event, _('You have to supply all required fields.', event))
+            self._reject_enrol(event, _('You have to supply all required fields.', event))
             return
-        elif not validate_email(mail):
-            self._fail(event, _('The supplied email address seems invalid', event))
+        elif not (yield from self._validate_mail(mail)):
+            self._reject_enrol(event, _('The supplied email address seems invalid', event))
             return
 
-        if objectmodels['user'].count({'mail': mail}) > 0:
-            self._fail(event, _('Your mail address cannot be used.', event))
+        with self.metrics.phase('db'):
+            taken = self.availability.mail_taken(mail)
+        if taken:
+            self._reject_enrol(event, _('Your mail address cannot be used.', event))
             return
 
         password = event.data.get('password', None)
         if password is None or len(password) < 5:
-            self._fail(event, _('Your password is not long enough.', event))
+            self._reject_enrol(event, _('Your password is not long enough.', event))
             return
 
         username = event.data.get('username', None)
         if username is None or len(username) < 1:
-            self._fail(event, _('Your username is not long enough.', event))
+            self._reject_enrol(event, _('Your username is not long enough.', event))
             return
-        elif (objectmodels['user'].count({'name': username}) > 0) or \
-                (objectmodels['enrollment'].count({'name': username}) > 0):
-            self._fail(event, _('The username you supplied is not available.', event))
+
+        with self.metrics.phase('db'):
+            # Enrollment names are not unique in the database, so names
+            # created elsewhere have to be found here
+            taken = self.availability.name_taken(username, strict=True)
+        if taken:
+            self._reject_enrol(event, _('The username you supplied is not available.', event))
             return
 
         self.log('Provided data is good to enrol.')
         if self.config.no_verify:
-            self._create_user(username, password, mail, 'Enrolled', uuid)
+            yield from self._create_user(username, password, mail, 'Enrolled', uuid)
         else:
             self._invite(username, 'Enrolled', mail, uuid, event, password)
 
     @handler(accept)
+    @instrumented
     def accept(self, event):
         """A challenge/response for an enrolment has been accepted"""
 
         self.log('Invitation accepted:', event.__dict__, lvl=debug)
         try:
             uuid = event.data
-            enrollment = objectmodels['enrollment'].find_one({
-                'uuid': uuid
-            })
+            if not isinstance(uuid, str):
+                self._fail(event)
+                return
+
+            # Repeated clicks and link previews are answered from memory
+            cached = self.accept_cache.get(uuid)
+            if cached is not MISSING:
+                self.log('Enrollment status cached:', cached, lvl=verbose)
+                self._accept_reply(event, cached)
+                return
+
+            # Clicks while the user is being created get the same answer
+            waiting = self.accepting.get(uuid, None)
+            if waiting is not None:
+                self.log('Enrollment is being accepted already', lvl=verbose)
+                waiting.append(event)
+                return
+
+            with self.metrics.phase('db'):
+                enrollment = objectmodels['enrollment'].find_one({
+                    'uuid': uuid
+                })
 
             if enrollment is not None:
                 self.log('Enrollment found', lvl=debug)
                 if enrollment.status == 'Open':
                     self.log('Enrollment is still open', lvl=debug)
-                    if enrollment.method == 'Invited' and self.config.auto_accept_invited:
-                        enrollment.status = 'Accepted'
-
-                        data = 'You should have received an email with your new password ' \
-                               'and can now log in to the system and start to use it. <br/>' \
-                               'Please change your password immediately after logging in'
-                        password = std_human_uid().replace(" ", '')
-
-                        self._create_user(enrollment.name, password, enrollment.email,
-                                          enrollment.method, uuid)
-                        self._send_acceptance(enrollment, event, password)
-                    elif enrollment.method == 'Enrolled' and self.config.auto_accept_enrolled:
-                        enrollment.status = 'Accepted'
-                        data = 'Your account is now activated.'
-
-                        self._create_user(enrollment.name, enrollment.password,
-                                          enrollment.email, enrollment.method,
-                                          uuid)
-
-                        # TODO: Evaluate if sending an acceptance mail makes sense
-                        # self._send_acceptance(enrollment, event)
-                    else:
-                        enrollment.status = 'Pending'
-                        data = 'Someone has to confirm your enrollment ' \
-                               'first. Thank you, for your patience.'
-                        # TODO: Alert admin users
-                    enrollment.save()
-
-                # Reaffirm acceptance to end user, when clicking on the link multiple times
-                elif enrollment.status == 'Accepted':
-                    data = 'You can now log in to the system and start to use it.'
-                elif enrollment.status == 'Pending':
-                    data = 'Someone has to confirm your enrollment ' \
-                           'first. Thank you, for your patience.'
+                    self.accepting[uuid] = waiting = [event]
+                    try:
+                        reply = yield from self._accept_open(enrollment, event)
+                    finally:
+                        del self.accepting[uuid]
+
+                    for client_event in waiting:
+                        if reply is None:
+                            self._fail(client_event, 'Your account could not be activated')
+                        else:
+                            self.fireEvent(send(client_event.client.uuid,
+                                                self.packets[reply]))
                 else:
-                    self.log('Enrollment has been closed already!', lvl=warn)
-                    self._fail(event)
-                    return
-                packet = {
-                    'component': 'isomer.enrol.enrolmanager',
-                    'action': 'accept',
-                    'data': {True: data}
-                }
-                self.fireEvent(send(event.client.uuid, packet))
+                    self.accept_cache.put(uuid, enrollment.status)
+                    self._accept_reply(event, enrollment.status)
             else:
                 self.log('No enrollment available.', lvl=warn)
+                self.accept_cache.put(uuid, None, self.config.accept_cache_negative_ttl)
                 self._fail(event)
         except Exception as e:
             self.log('Error during invitation accept handling:', e, type(e),
                      lvl=warn, exc=True)
 
+    def _accept_open(self, enrollment, event):
+        """Accept an open enrollment, use with 'yield from'
+
+        Users are created before the enrollment is stored as accepted, if
+        that fails, the enrollment stays open.
+
+        :return: Name of the reply packet or None, if the user could not be
+        created
+        """
+
+        uuid = enrollment.uuid
+
+        if enrollment.method == 'Invited' and self.config.auto_accept_invited:
+            reply = 'accept_invited'
+            password = std_human_uid().replace(" ", '')
+        elif enrollment.method == 'Enrolled' and self.config.auto_accept_enrolled:
+            reply = 'accept_activated'
+            password = enrollment.password
+        else:
+            enrollment.status = 'Pending'
+            with self.metrics.phase('db'):
+                enrollment.save()
+            self.accept_cache.put(uuid, enrollment.status)
+            # TODO: Alert admin users
+            return 'accept_pending'
+
+        created = yield from self._create_user(enrollment.name, password,
+                                               enrollment.email, enrollment.method,
+                                               uuid)
+        if not created:
+            self.log('Enrollment stays open, user could not be created', lvl=warn)
+            self.accept_cache.invalidate(uuid)
+            return None
+
+        enrollment.status = 'Accepted'
+        with self.metrics.phase('db'):
+            enrollment.save()
+        self.accept_cache.put(uuid, enrollment.status)
+
+        if reply == 'accept_invited':
+            self._send_acceptance(enrollment, event, password)
+
+        # TODO: Evaluate if sending an acceptance mail to enrolled users makes sense
+
+        return reply
+
+    def _accept_reply(self, event, status):
+        """Answer a repeated accept of an already handled enrollment"""
+
+        # Reaffirm acceptance to end user, when clicking on the link multiple times
+        if status == 'Accepted':
+            reply = 'accept_accepted'
+        elif status == 'Pending':
+            reply = 'accept_pending'
+        else:
+            if status is None:
+                self.log('No enrollment available.', lvl=warn)
+            else:
+                self.log('Enrollment has been closed already!', lvl=warn)
+            self._fail(event)
+            return
+
+        self.fireEvent(send(event.client.uuid, self.packets[reply]))
+
+    @handler('objectcreation')
+    def objectcreation(self, event):
+        """Learn about users and enrollments created elsewhere"""
+
+        if event.schema in ('user', 'enrollment'):
+            with self.metrics.phase('db'):
+                self.availability.update(event.schema, event.uuid)
+
+    @handler('objectchange')
+    def objectchange(self, event):
+        """Forget the cached state of users and enrollments changed elsewhere"""
+
+        if event.schema == 'enrollment':
+            self.accept_cache.invalidate(event.uuid)
+        if event.schema in ('user', 'enrollment'):
+            with self.metrics.phase('db'):
+                self.availability.update(event.schema, event.uuid)
+
+    @handler('objectdeletion')
+    def objectdeletion(self, event):
+        """Forget the cached state of deleted users and enrollments"""
+
+        if event.schema == 'enrollment':
+            self.accept_cache.invalidate(event.uuid)
+        if event.schema in ('user', 'enrollment'):
+            self.availability.remove(event.schema, event.uuid)
+
     @handler(status)
+    @instrumented
     def status(self, event):
         """An anonymous client wants to know if we're open for enrollment"""
 
-        self.log('Registration status requested')
+        if self._rate_limited(event):
+            return
 
-        response = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': 'status',
-            'data': self.config.allow_registration
-        }
+        self.log('Registration status requested')
 
-        self.fire(send(event.client.uuid, response))
+        self.fire(send(event.client.uuid, self.packets['status']))
 
     @handler(captcha)
+    @instrumented
     def captcha(self, event):
         """An anonymous client requests a captcha challenge"""
 
+        if self._rate_limited(event):
+            return
+
         self._generate_captcha(event)
 
+    @handler('clientdisconnect')
+    def clientdisconnect(self, event):
+        """Drop pending captchas of disconnected clients"""
+
+        self.captchas.discard(event.clientuuid)
+
+    @staticmethod
+    def _reset_query(data):
+        """Return the query for the account a reset was requested for, by
+        name or mail address, or None"""
+
+        if not isinstance(data, dict):
+            return None
+
+        selectors = [
+            {field: data[key]} for key, field in (('username', 'name'), ('email', 'mail'))
+            if isinstance(data.get(key, None), str) and data[key] != ''
+        ]
+
+        if len(selectors) == 0:
+            return None
+        if len(selectors) == 1:
+            return selectors[0]
+
+        return {'$or': selectors}
+
     @handler(request_reset)
+    @instrumented
     def request_reset(self, event):
-        """An anonymous client requests a password reset"""
+        """An anonymous client requests a password reset
 
-        self.log('Password reset request received:', event.__dict__, lvl=hilight)
+        The reply is the same for known and unknown accounts and sent before
+        looking the account up, so neither its content nor its timing tells
+        whether an account exists.
+        """
 
-        user_object = objectmodels['user']
+        if self._rate_limited(event):
+            return
 
-        email = event.data.get('email', None)
-        email_user = None
+        query = self._reset_query(event.data)
+        if query is None:
+            self._fail(event, msg="Enter your username or mail address")
+            return
 
-        if email is not None and user_object.count({'mail': email}) > 0:
-            email_user = user_object.find_one({'mail': email})
+        self.log('Password reset request received', lvl=debug)
+        self._acknowledge(event, "If the account exists, a mail with a reset "
+                                 "link has been sent to its address.")
+        # Let the reply go out, before doing any account dependent work
+        yield
 
-        if email_user is None:
-            self._fail(event, msg="Mail address unknown")
+        try:
+            user, token = yield from self._reset_task(
+                request_token, query, self.config.reset_ttl
+            )
+        except Exception as e:
+            self.log('Could not issue reset token:', e, type(e), lvl=error)
             return
 
+        if user is None:
+            self.log('Password reset requested for unknown account', lvl=debug)
+            return
+
+        self._send_reset(user, token)
+
+    @handler(reset_password)
+    @instrumented
+    def reset_password(self, event):
+        """An anonymous client sets a new password with a reset token"""
+
+        if self._rate_limited(event):
+            return
+
+        data = event.data if isinstance(event.data, dict) else {}
+        password = data.get('password', None)
+
+        if not isinstance(password, str) or len(password) < minimum_password_length:
+            self._fail(event, msg="Password too short")
+            return
+
+        # Hashed before redeeming, so invalid tokens take as long to answer
+        passhash = yield from self._hash(password)
+
+        try:
+            owner = yield from self._reset_task(
+                set_password, data.get('token', None), passhash
+            )
+        except Exception as e:
+            self.log('Could not reset password:', e, type(e), lvl=error)
+            self._fail(event, msg="Could not change your password")
+            return
+
+        if owner is None:
+            self.log('Password reset with invalid token', lvl=debug)
+            self._fail(event, msg="Invalid or expired reset link")
+            return
+
+        self.log('Password reset for user', owner)
+        self._acknowledge(event, "Your password has been changed.")
+
     @handler(delete)
+    @instrumented
     def delete(self, event):
         self.log('Deleting user')
 
-        user_object = objectmodels['user'].find_one({'uuid': event.data})
-        profile_object = objectmodels['profile'].find_one({'owner': event.data})
+        with self.metrics.phase('db'):
+            user_object = objectmodels['user'].find_one({'uuid': event.data})
+            profile_object = objectmodels['profile'].find_one({'owner': event.data})
 
-        user_object.delete()
-        if profile_object is not None:
-            profile_object.delete()
+            user_object.delete()
+            if profile_object is not None:
+                profile_object.delete()
+
+        self.availability.remove_user(user_object.name, getattr(user_object, 'mail', None),
+                                      user_object.uuid)
 
         self.log('User deleted:', user_object.name)
         self._acknowledge(event, event.data)
 
+    @staticmethod
+    def _user_selector(event):
+        """Get the database filter for a single ('uuid') or a list ('uuids')
+        of users from an event"""
+
+        uuids = event.data.get('uuids', None)
+        if isinstance(uuids, list) and len(uuids) > 0:
+            return {'uuid': {'$in': uuids}}
+
+        uuid = event.data.get('uuid', None)
+        if uuid is None:
+            return None
+
+        return {'uuid': uuid}
+
+    def _update_users(self, selector, update):
+        """Apply a partial update atomically to all selected users"""
+
+        collection = objectmodels['user'].collection()
+        with self.metrics.phase('db'):
+            if isinstance(selector['uuid'], dict):
+                return collection.update_many(selector, update)
+
+            return collection.update_one(selector, update)
+
     @handler(delrole)
+    @instrumented
     def delrole(self, event):
         self.log('Deleting user role')
         role = event.data.get('role', None)
-        uuid = event.data.get('uuid', None)
+        selector = self._user_selector(event)
 
-        if role is None or uuid is None:
+        if role is None or selector is None:
             self._fail(event, 'Bad Arguments')
             return
 
-        user_object = objectmodels['user'].find_one({'uuid': uuid})
-        user_object.roles.remove(role)
-        user_object.save()
+        result = self._update_users(selector, {'$pull': {'roles': role}})
+
+        if result.matched_count == 0:
+            self._fail(event, 'Unknown user')
+            return
 
-        self.log('User role deleted:', user_object.name, role)
+        self.log('User role deleted:', role, 'from', result.modified_count, 'users')
         self._acknowledge(event)
 
     @handler(addrole)
+    @instrumented
     def addrole(self, event):
         self.log('Adding user role')
         role = event.data.get('role', None)
-        uuid = event.data.get('uuid', None)
+        selector = self._user_selector(event)
 
-        if role is None or uuid is None:
+        if role is None or selector is None:
             self._fail(event, 'Bad Arguments')
             return
 
-        user_object = objectmodels['user'].find_one({'uuid': uuid})
+        result = self._update_users(selector, {'$addToSet': {'roles': role}})
 
-        if role in user_object.roles:
-            self._fail(event, 'Role already assigned')
+        if result.matched_count == 0:
+            self._fail(event, 'Unknown user')
             return
 
-        user_object.roles.append(role)
-        user_object.save()
+        if result.modified_count == 0:
+            self._fail(event, 'Role already assigned')
+            return
 
-        self.log('User role added:', user_object.name, role)
+        self.log('User role added:', role, 'to', result.modified_count, 'users')
         self._acknowledge(event)
 
     @handler(toggle)
+    @instrumented
     def toggle(self, event):
         self.log('Toggling user activation')
         status = event.data.get('status', None)
-        uuid = event.data.get('uuid', None)
+        selector = self._user_selector(event)
 
-        if status is None or uuid is None:
+        if status is None or selector is None:
             self._fail(event, 'Bad Arguments')
             return
 
-        user_object = objectmodels['user'].find_one({'uuid': uuid})
-        user_object.active = status
-        user_object.save()
+        result = self._update_users(selector, {'$set': {'active': status}})
+
+        if result.matched_count == 0:
+            self._fail(event, 'Unknown user')
+            return
 
-        self.log('Toggled user:', user_object.name, ', activated:', status)
+        self.log('Toggled', result.matched_count, 'users, activated:', status)
         self._acknowledge(event)
 
-    @staticmethod
-    def __generate_captcha_string():
-        """Generates a randomized collection of 6 letters and digits"""
+    @handler('enrollment_sweep')
+    @instrumented
+    def enrollment_sweep(self):
+        """Expire or delete stale open and pending enrollments in small
+        batches, handing back control to the event loop in between"""
+
+        if self.sweeping:
+            self.log('Enrollment sweep still in progress', lvl=warn)
+            return
+
+        self.sweeping = True
 
-        return "".join(choice(ascii_letters + digits) for i in range(6))
+        # Enrollment timestamps are written with std_now(), so the cutoff is
+        # derived from it to compare the same clock in the same format
+        now = datetime.fromisoformat(std_now())
+        cutoff = (now - timedelta(days=self.config.expiry_days)).isoformat()
+        query = {
+            'status': {'$in': ['Open', 'Pending']},
+            'timestamp': {'$lt': cutoff}
+        }
+        collection = objectmodels['enrollment'].collection()
+        processed = 0
+
+        try:
+            while True:
+                with self.metrics.phase('db'):
+                    batch = list(collection.find(
+                        query, {'_id': 1, 'uuid': 1, 'name': 1},
+                        limit=self.config.expiry_batch
+                    ))
+                if len(batch) == 0:
+                    break
+
+                ids = [item['_id'] for item in batch]
+                with self.metrics.phase('db'):
+                    if self.config.expiry_action == 'Delete':
+                        collection.delete_many({'_id': {'$in': ids}})
+                    else:
+                        collection.update_many({'_id': {'$in': ids}},
+                                               {'$set': {'status': 'Expired'}})
+
+                if self.config.expiry_action == 'Delete':
+                    for item in batch:
+                        self.availability.remove_enrollment(item.get('name', None),
+                                                            item.get('uuid', None))
+
+                self.accept_cache.invalidate(*[item.get('uuid', None) for item in batch])
+
+                processed += len(batch)
+                yield
+        finally:
+            self.sweeping = False
+
+        self.log('Enrollment sweep processed', processed, 'stale enrollments')
 
     def _generate_captcha(self, event):
         self.log('Generating requested captcha')
 
-        text = self.__generate_captcha_string()
+        with self.metrics.phase('captcha'):
+            text, image = self.captcha_pool.pop()
         now = time()
 
         captcha = {
             'text': text,
-            'image': self.image_captcha.generate(text),
+            'image': image,
             'time': now
         }
-        # self.image_captcha.write(text, '/tmp/captcha.png')
-        self.captchas[event.client.uuid] = captcha
+        self.captchas.put(event.client.uuid, captcha)
+        self.log('Captcha store:', self.captchas.stats(), lvl=verbose)
 
-        Timer(3, Event.create('captcha_transmit', captcha, event.client.uuid)).register(
-            self)
+        if self.captcha_timer is None:
+            self.captcha_transmit(captcha, event.client.uuid)
+        else:
+            self.captcha_queue.append(
+                (now + self.config.captcha_delay, captcha, event.client.uuid)
+            )
+
+    @handler('captcha_transmit_due')
+    @instrumented
+    def captcha_transmit_due(self):
+        """Transmit all delayed captchas that are due"""
+
+        now = time()
+
+        while len(self.captcha_queue) > 0 and self.captcha_queue[0][0] <= now:
+            due, captcha, uuid = self.captcha_queue.popleft()
+            # Skip captchas of disconnected clients or superseded ones
+            if self.captchas.get(uuid) is captcha:
+                self.captcha_transmit(captcha, uuid)
 
     def captcha_transmit(self, captcha, uuid):
-        """Delayed transmission of a requested captcha"""
+        """Transmission of a requested captcha"""
 
         self.log('Transmitting captcha')
 
-        response = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': 'captcha',
-            'data': b64encode(captcha['image'].getvalue()).decode('utf-8')
-        }
-        self.fire(send(uuid, response))
+        self.fire(send(uuid, build_packet('captcha', captcha['image'])))
 
     def _invite(self, name, method, email, uuid, event, password=""):
         """Actually invite a given user"""
@@ -678,82 +1975,251 @@ the friendly robot of {{node_name}}
             'timestamp': std_now()
         }
         enrollment = objectmodels['enrollment'](props)
-        enrollment.save()
+        with self.metrics.phase('db'):
+            enrollment.save()
+        self.availability.add_enrollment(name, enrollment.uuid)
 
         self.log('Enrollment stored', lvl=debug)
 
         self._send_invitation(enrollment, event)
 
-        packet = {
-            'component': 'isomer.enrol.enrolmanager',
-            'action': 'invite',
-            'data': [True, email]
-        }
-        self.fireEvent(send(uuid, packet))
+        self.fireEvent(send(uuid, build_packet('invite', [True, email])))
 
     def _create_user(self, username, password, mail, method, uuid):
-        """Create a new user and all initial data"""
+        """Create a new user and all initial data, use with 'yield from'
 
-        try:
-            if method == 'Invited':
-                config_role = self.config.group_accept_invited
-            else:
-                config_role = self.config.group_accept_enrolled
+        The user and its profile are stored with the next user batch, the
+        client is notified when the batch has been written.
 
-            roles = []
-            if ',' in config_role:
-                for item in config_role.split(','):
-                    roles.append(item.lstrip().rstrip())
-            else:
-                roles = [config_role]
-
-            newuser = objectmodels['user']({
-                'name': username,
-                'passhash': std_hash(password, self.salt),
-                'mail': mail,
-                'uuid': std_uuid(),
-                'roles': roles,
-                'created': std_now()
-            })
+        :return: True, if the user has been stored
+        """
 
-            if method == 'Invited':
-                newuser.needs_password_change = True
+        try:
+            passhash = yield from self._hash(password)
 
-            newuser.save()
+            newuser = self._new_user(username, passhash, mail, method)
+            newuser.validate()
         except Exception as e:
             self.log("Problem creating new user: ", type(e), e,
                      lvl=error)
+            self._notify_created(uuid, mail, False)
+            return False
+
+        newprofile = objectmodels['profile']({
+            'uuid': std_uuid(),
+            'owner': newuser.uuid
+        })
+        self.log("New profile uuid: ", newprofile.uuid,
+                 lvl=verbose)
+
+        entry = {
+            'user': newuser,
+            'profile': newprofile,
+            'uuid': uuid,
+            'created': None
+        }
+        self.user_batch.append(entry)
+
+        if len(self.user_batch) >= self.config.user_batch_size or \
+                self.config.user_batch_window <= 0:
+            self._flush_users()
+        elif self.user_batch_timer is None:
+            self.user_batch_timer = Timer(
+                self.config.user_batch_window, Event.create('user_batch_flush')
+            ).register(self)
+
+        # Every stored batch is announced, until the one of this user
+        while entry['created'] is None:
+            yield self.wait('user_batch_stored')
+
+        return entry['created']
+
+    @handler('user_batch_flush')
+    @instrumented
+    def user_batch_flush(self):
+        """Store the users collected during the batch window"""
+
+        self.user_batch_timer = None
+        self._flush_users()
+
+    def _flush_users(self):
+        """Store all batched users and their profiles with one write each and
+        notify their clients"""
+
+        if self.user_batch_timer is not None:
+            self.user_batch_timer.unregister()
+            self.user_batch_timer = None
+
+        batch, self.user_batch = self.user_batch, []
+        if len(batch) == 0:
             return
 
-        try:
-            newprofile = objectmodels['profile']({
-                'uuid': std_uuid(),
-                'owner': newuser.uuid
-            })
-            self.log("New profile uuid: ", newprofile.uuid,
-                     lvl=verbose)
+        self.log('Storing a batch of', len(batch), 'new users', lvl=debug)
 
-            newprofile.save()
+        failed = self._insert_many('user', [entry['user'] for entry in batch])
 
-            packet = {
-                'component': 'isomer.enrol.enrolmanager',
-                'action': 'enrol',
-                'data': [True, mail]
-            }
-            self.fireEvent(send(uuid, packet))
+        stored = []
+        for index, entry in enumerate(batch):
+            if index in failed:
+                self.log('Problem creating new user', entry['user'].name, lvl=error)
+                entry['created'] = False
+                self._notify_created(entry['uuid'], entry['user'].mail, False)
+            else:
+                entry['created'] = True
+                stored.append(entry)
+                self.availability.add_user(entry['user'].name, entry['user'].mail,
+                                           entry['user'].uuid)
+
+        failed = self._insert_many('profile', [entry['profile'] for entry in stored])
+
+        for index, entry in enumerate(stored):
+            # The account is usable without a profile, but the client is told
+            if index in failed:
+                self.log('Problem creating new profile for', entry['user'].name,
+                         lvl=error)
+            self._notify_created(entry['uuid'], entry['user'].mail, index not in failed)
 
             # TODO: Notify crew-admins
+
+        self.fire(Event.create('user_batch_stored'))
+
+    def _insert_many(self, schema, objects):
+        """Insert objects with a single unordered write
+
+        :return: Indices of the objects, that could not be stored
+        """
+
+        documents = [obj._fields for obj in objects]
+        try:
+            with self.metrics.phase('db'):
+                objectmodels[schema].collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = set(item['index'] for item in e.details.get('writeErrors', []))
+            self.log('Could not store', len(failed), 'of', len(objects), schema,
+                     'objects:', e, lvl=warn)
+            return failed
         except Exception as e:
-            self.log("Problem creating new profile: ", type(e),
-                     e, lvl=error)
+            self.log('Could not store', schema, 'objects:', type(e), e, lvl=error)
+            return set(range(len(objects)))
+
+        return set()
+
+    def _notify_created(self, uuid, mail, success):
+        self.fireEvent(send(uuid, build_packet('enrol', [success, mail])))
+
+    @staticmethod
+    def _parse_roles(config_role):
+        """Split a comma separated group configuration into a list of roles"""
+
+        roles = []
+        if ',' in config_role:
+            for item in config_role.split(','):
+                roles.append(item.lstrip().rstrip())
+        else:
+            roles = [config_role]
+
+        return roles
+
+    def _roles(self, method):
+        """Get the list of roles for newly accepted users"""
+
+        if method == 'Invited':
+            return list(self.roles['Invited'])
+
+        return list(self.roles['Enrolled'])
+
+    def _new_user(self, username, passhash, mail, method):
+        """Construct a new user object"""
+
+        newuser = objectmodels['user']({
+            'name': username,
+            'passhash': passhash,
+            'mail': mail,
+            'uuid': std_uuid(),
+            'roles': self._roles(method),
+            'created': std_now()
+        })
+
+        if method == 'Invited':
+            newuser.needs_password_change = True
+
+        return newuser
+
+    def _hash_many(self, passwords):
+        """Hash a list of passwords concurrently in the worker pool, use
+        with 'yield from'"""
+
+        with self.metrics.phase('hash'):
+            if self.hash_worker is None:
+                return [std_hash(password, self.salt) for password in passwords]
+
+            values = [
+                self.fire(task(std_hash, password, self.salt), self.hash_worker.channel)
+                for password in passwords
+            ]
+            while not all(value.result for value in values):
+                yield
+
+        for value in values:
+            if value.errors:
+                raise value.value[1]
+
+        return [value.value for value in values]
+
+    def _create_users(self, accounts):
+        """Create a list of new users and their profiles with bulk inserts,
+        use with 'yield from'
+
+        :param accounts: List of (username, password, mail, method) tuples
+        :return: Names of the created users
+        """
+
+        if len(accounts) == 0:
+            return []
+
+        passhashes = yield from self._hash_many(
+            [password for username, password, mail, method in accounts]
+        )
+
+        users = []
+        for (username, password, mail, method), passhash in zip(accounts, passhashes):
+            try:
+                newuser = self._new_user(username, passhash, mail, method)
+                newuser.validate()
+            except ValidationError as e:
+                self.log("Problem creating new user: ", type(e), e, lvl=error)
+                continue
+
+            users.append(newuser)
+
+        if len(users) == 0:
+            return []
+
+        failed = self._insert_many('user', users)
+        users = [newuser for index, newuser in enumerate(users) if index not in failed]
+
+        profiles = [
+            objectmodels['profile']({
+                'uuid': std_uuid(),
+                'owner': newuser.uuid
+            }) for newuser in users
+        ]
+        failed = self._insert_many('profile', profiles)
+
+        for index, newuser in enumerate(users):
+            # The account is usable without a profile
+            if index in failed:
+                self.log('Problem creating new profile for', newuser.name, lvl=error)
+            self.availability.add_user(newuser.name, newuser.mail, newuser.uuid)
+
+        return [newuser.name for newuser in users]
 
     def _send_invitation(self, enrollment, event):
         """Send an invitation mail to an open enrolment"""
 
         self.log('Sending enrollment status mail to user')
 
-        self._send_mail(self.config.invitation_subject, self.config.invitation_mail,
-                        enrollment, event)
+        self._send_mail(self.invitation_template, enrollment, event, kind='invitation')
 
     def _send_acceptance(self, enrollment, event, password=None):
         """Send an acceptance mail to an open enrolment"""
@@ -761,27 +2227,472 @@ the friendly robot of {{node_name}}
         self.log('Sending acceptance status mail to user')
 
         if password is not None:
-            password_hint = '\n\nPS: Your new password is ' + password + ' - please change it after your first login!'
+            password_hint = '\n\nPS: Your new password is ' + placeholder('password') + \
+                            ' - please change it after your first login!'
+            secrets = {'password': password}
+        else:
+            password_hint = ''
+            secrets = None
+
+        self._send_mail(self.acceptance_template, enrollment, event, password_hint,
+                        kind='acceptance', secrets=secrets)
+
+    def _send_reset(self, user, token):
+        """Queue a password reset mail"""
+
+        self.log('Sending password reset mail to user', lvl=debug)
+
+        context = {
+            'name': user['name'],
+            'reset_url': self.reset_url + placeholder('token')
+        }
+        with self.metrics.phase('template'):
+            subject, mail = self.reset_template.render(context)
+
+        # Keyed by the user, so a not yet sent reset mail is replaced
+        with self.metrics.phase('db'):
+            self.mail_queue.enqueue(user['mail'], subject, mail, user['uuid'], 'reset',
+                                    secrets={'token': token})
+
+    @staticmethod
+    def _form_fields(form):
+        """Collect the names of all fields an object form displays"""
+
+        fields = []
+        for item in form:
+            if isinstance(item, str):
+                fields.append(item)
+            elif isinstance(item, dict):
+                if isinstance(item.get('key', None), str):
+                    fields.append(item['key'])
+                fields.extend(EnrolManager._form_fields(item.get('items', [])))
+
+        return fields
+
+    @staticmethod
+    def _list_query(data):
+        """Build the database filter of a list request, None if invalid"""
+
+        query = {}
+
+        for field in ('status', 'method'):
+            value = data.get(field, None)
+            if value is None:
+                continue
+            if isinstance(value, str):
+                query[field] = value
+            elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+                query[field] = {'$in': value}
+            else:
+                return None
+
+        timestamp = {}
+        for key, operator in (('since', '$gte'), ('until', '$lt')):
+            value = data.get(key, None)
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                return None
+            timestamp[operator] = value
+        if len(timestamp) > 0:
+            query['timestamp'] = timestamp
+
+        cursor = data.get('cursor', None)
+        if cursor is not None:
+            if not isinstance(cursor, dict) or \
+                    not isinstance(cursor.get('timestamp', None), str) or \
+                    not isinstance(cursor.get('uuid', None), str):
+                return None
+
+            after = {'$or': [
+                {'timestamp': {'$lt': cursor['timestamp']}},
+                {'timestamp': cursor['timestamp'], 'uuid': {'$lt': cursor['uuid']}}
+            ]}
+            query = {'$and': [query, after]} if len(query) > 0 else after
+
+        return query
+
+    def _timed(self, iterable, phase):
+        """Iterate, accounting the time spent fetching items to a phase"""
+
+        iterator = iter(iterable)
+        while True:
+            with self.metrics.phase(phase):
+                item = next(iterator, MISSING)
+            if item is MISSING:
+                return
+
+            yield item
+
+    @handler(list_enrollments)
+    @instrumented
+    def list(self, event):
+        """An admin user requests a page of enrollments, newest first
+
+        Optional filters are 'status' and 'method' (a value or a list of
+        values) and a 'since'/'until' timestamp range. The page is sent in
+        chunks, the last one carries the 'cursor' to request the next page
+        with, if there is one.
+        """
+
+        data = event.data if isinstance(event.data, dict) else {}
+
+        query = self._list_query(data)
+        if query is None:
+            self._fail(event, 'Invalid list request')
+            return
+
+        limit = data.get('limit', self.config.list_page_size)
+        if not isinstance(limit, int) or limit <= 0:
+            limit = self.config.list_page_size
+        limit = min(limit, self.config.list_page_size)
+        chunk_size = max(1, self.config.list_chunk_size)
+
+        projection = {field: 1 for field in self.list_fields}
+        projection['_id'] = 0
+
+        # One more than requested tells, whether there is a next page
+        results = objectmodels['enrollment'].collection().find(
+            query, projection
+        ).sort([('timestamp', -1), ('uuid', -1)]).limit(limit + 1)
+
+        def transmit(items, final, cursor=None):
+            packet = build_packet('list', {
+                'items': items,
+                'final': final,
+                'cursor': cursor,
+                'tag': data.get('tag', None)
+            })
+            self.fireEvent(send(event.client.uuid, packet))
+
+        chunk = []
+        count = 0
+        last = None
+        cursor = None
+
+        for item in self._timed(results, 'db'):
+            if count == limit:
+                cursor = {'timestamp': last.get('timestamp', ''), 'uuid': last['uuid']}
+                break
+
+            if len(chunk) == chunk_size:
+                transmit(chunk, False)
+                chunk = []
+                # Let other events through between chunks
+                yield
+
+            chunk.append(item)
+            last = item
+            count += 1
+
+        transmit(chunk, True, cursor)
+        self.log('Listed', count, 'enrollments', lvl=debug)
+
+    def _transfer_file(self, event):
+        """Check a transfer request and return its kind, file name and format"""
+
+        data = event.data if isinstance(event.data, dict) else {}
+        kind = data.get('kind', None)
+        filename = data.get('filename', None)
+        file_format = data.get('format', None)
+
+        if self.config.transfer_path == '':
+            self._fail(event, 'Imports and exports are disabled')
+        elif kind not in TRANSFER_KINDS or file_format not in TRANSFER_FORMATS + (None,):
+            self._fail(event, 'Invalid transfer request')
+        elif not isinstance(filename, str) or filename.startswith('.') or \
+                basename(filename) != filename:
+            # Only plain file names inside the transfer directory
+            self._fail(event, 'Invalid file name')
+        else:
+            path = join(self.config.transfer_path, filename)
+            if path in self.transfers:
+                self._fail(event, 'Transfer of this file is running already')
+                return None
+
+            return kind, path, file_format or detect_format(filename)
+
+        return None
 
-            acceptance_text = self.config.acceptance_mail + password_hint
+    def _transfer_progress(self, event, progress):
+        self.fireEvent(send(event.client.uuid, build_packet(event.action, progress)))
+
+    @handler(export_records)
+    @instrumented
+    def export_records(self, event):
+        """An admin user requests an export of all enrollments or users to a
+        file in the transfer directory"""
+
+        request = self._transfer_file(event)
+        if request is None:
+            return
+
+        kind, path, file_format = request
+        secrets = event.data.get('secrets', False) is True
+
+        self.log('Exporting', kind, 'to', path)
+        self.transfers.add(path)
+        written = 0
+        try:
+            with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+                for written in stream_export(kind, f, file_format, secrets,
+                                             self.config.transfer_chunk_size):
+                    self._transfer_progress(event, {'kind': kind, 'exported': written,
+                                                    'done': False})
+                    # Let other events through between chunks
+                    yield
+            replace(path + '.tmp', path)
+        except OSError as e:
+            self.log('Could not export', kind, ':', e, lvl=error)
+            self._fail(event, 'Could not write export file')
+            return
+        finally:
+            self.transfers.discard(path)
+
+        self._transfer_progress(event, {'kind': kind, 'exported': written, 'done': True})
+        self.log('Exported', written, kind)
+
+    @handler(import_records)
+    @instrumented
+    def import_records(self, event):
+        """An admin user requests an import of enrollments or users from a
+        file in the transfer directory, an interrupted import is resumed
+        unless 'restart' is requested"""
+
+        request = self._transfer_file(event)
+        if request is None:
+            return
+
+        kind, path, file_format = request
+
+        self.log('Importing', kind, 'from', path)
+        self.transfers.add(path)
+        try:
+            importer = Importer(
+                kind, path, file_format, self.config.transfer_chunk_size, self.salt,
+                self._roles('Invited'), event.data.get('restart', False) is True,
+                self._imported
+            )
+            for progress in importer.run():
+                self._transfer_progress(event, progress)
+                yield
+        except (OSError, ValueError) as e:
+            self.log('Could not import', kind, ':', e, lvl=error)
+            self._fail(event, 'Could not read import file')
+        finally:
+            self.transfers.discard(path)
+
+    def _imported(self, documents):
+        """Account for imported enrollments or users"""
+
+        for document in documents:
+            if 'email' in document:
+                self.availability.add_enrollment(document['name'], document['uuid'])
+                self.accept_cache.invalidate(document['uuid'])
+            else:
+                self.availability.add_user(document['name'], document.get('mail', None),
+                                           document['uuid'])
+
+    def _gauges(self):
+        """Return the current sizes of the component's queues and stores"""
+
+        timers = (self.captcha_timer, self.mail_timer, self.sweep_timer,
+                  self.metrics_timer, self.watchdog_timer)
+
+        return {
+            'captcha_store': self.captchas.stats(),
+            'captcha_pool': self.captcha_pool.stats(),
+            'captcha_transmissions_pending': len(self.captcha_queue),
+            'timers': sum(1 for timer in timers if timer is not None),
+            'mail_queue': len(self.mail_queue),
+            'bulk_invites': len(self.bulk_invites),
+            'accept_cache': self.accept_cache.stats(),
+            'mail_validation': self.mail_validator.stats(),
+            'rate_limit_buckets': self.rate_limiter.stats()['buckets']
+        }
+
+    def _metrics(self):
+        result = self.metrics.snapshot()
+        result['gauges'] = self._gauges()
+        result['time'] = time()
+
+        return result
+
+    @handler(metrics)
+    def report_metrics(self, event):
+        """An admin user requests the handler metrics, optionally resetting
+        them afterwards"""
+
+        packet = build_packet('metrics', self._metrics())
+        self.fireEvent(send(event.client.uuid, packet))
+
+        if isinstance(event.data, dict) and event.data.get('reset', False) is True:
+            self.metrics.reset()
+
+    @handler(slow_handlers)
+    def report_slow_handlers(self, event):
+        """An admin user requests the handlers that blocked the event loop,
+        optionally resetting them afterwards"""
+
+        packet = build_packet('slow_handlers', self.metrics.slow_snapshot())
+        self.fireEvent(send(event.client.uuid, packet))
+
+        if isinstance(event.data, dict) and event.data.get('reset', False) is True:
+            self.metrics.reset_slow()
+
+    @handler('watchdog_tick')
+    def watchdog_tick(self):
+        """Measure how late the watchdog timer fired"""
+
+        now = time()
+        lag = max(0.0, now - self.watchdog_due)
+        self.watchdog_due = now + self.config.watchdog_interval
+
+        entry = self.metrics.lag(lag)
+        if entry is not None:
+            self.log('Event loop lagged by %.1f ms, blocked longest by:' % entry['duration'],
+                     entry['handler'], lvl=warn)
+
+    @handler('metrics_dump')
+    def metrics_dump(self):
+        """Write the current metrics to the configured file"""
+
+        filename = self.config.metrics_file
+        try:
+            with open(filename + '.tmp', 'w') as f:
+                dump(self._metrics(), f, indent=2)
+            replace(filename + '.tmp', filename)
+        except OSError as e:
+            self.log('Could not write metrics file:', e, lvl=warn)
+
+    @handler(mail_status)
+    @instrumented
+    def mail_status(self, event):
+        """An admin user requests the outbound mail queue status"""
+
+        enrollment = None
+        if isinstance(event.data, dict):
+            enrollment = event.data.get('enrollment', None)
+
+        packet = build_packet('mail_status', self.mail_queue.status(enrollment))
+        self.fireEvent(send(event.client.uuid, packet))
+
+    @handler('mail_queue_flush')
+    @instrumented
+    def mail_queue_flush(self):
+        """Deliver due queued mails at the configured rate"""
+
+        # Slow deliveries must not let the timer start further flushes
+        if self.mail_flushing:
+            return
+
+        self.mail_flushing = True
+        try:
+            for mail in self.mail_queue.due(self.config.mail_rate):
+                yield from self._deliver(mail)
+        finally:
+            self.mail_flushing = False
+
+    @handler('mail_secrets_lost')
+    def mail_secrets_lost(self, mails):
+        """Send reset links instead of acceptance mails, whose generated
+        passwords were lost with a restart"""
+
+        for mail in mails:
+            if getattr(mail, 'kind', None) != 'acceptance':
+                continue
+
+            try:
+                user, token = yield from self._reset_task(
+                    request_token, {'mail': mail.recipient}, self.config.reset_ttl
+                )
+            except Exception as e:
+                self.log('Could not issue reset token:', e, type(e), lvl=error)
+                continue
+
+            if user is None:
+                self.log('No user found for lost acceptance mail to', mail.recipient,
+                         lvl=warn)
+                continue
+
+            self.log('Sending a reset link instead of the lost acceptance mail to',
+                     mail.recipient)
+            self._send_reset(user, token)
+
+    def _deliver(self, mail):
+        """Deliver a queued mail, use with 'yield from'"""
+
+        if self.config.mail_send is False:
+            self.log('Mail sending disabled, dropping mail to', mail.recipient,
+                     lvl=warn)
+            with self.metrics.phase('db'):
+                self.mail_queue.delivered(mail)
+            return
+
+        with self.metrics.phase('mail'):
+            value = yield self.call(send_mail(mail.recipient, mail.subject,
+                                              self.mail_queue.body(mail)))
+
+        if value.errors:
+            self.log('Could not deliver mail to', mail.recipient, lvl=warn)
+            with self.metrics.phase('db'):
+                self.mail_queue.retry(mail)
+            if mail.status == 'Queued':
+                return
         else:
-            acceptance_text = self.config.acceptance_mail
+            with self.metrics.phase('db'):
+                self.mail_queue.delivered(mail)
 
-        self._send_mail(self.config.acceptance_subject, acceptance_text, enrollment,
-                        event)
+        batch = getattr(mail, 'batch', None)
+        if batch is not None:
+            self._bulk_progress(batch)
 
-    def _send_mail(self, subject, template, enrollment, event):
-        """Connect to mail server and send actual email"""
+    def _bulk_progress(self, batch):
+        """Account for a processed bulk invitation and report progress to its client"""
+
+        progress = self.bulk_invites.get(batch, None)
+        if progress is None:
+            return
+
+        progress['sent'] += 1
+
+        done = progress['sent'] == progress['total']
+        if done or progress['sent'] % self.config.bulk_progress_interval == 0:
+            packet = build_packet('bulk_invite_progress', {
+                'batch': batch,
+                'sent': progress['sent'],
+                'total': progress['total']
+            })
+            self.fireEvent(send(progress['client'], packet, fail_quiet=True))
+
+        if done:
+            del self.bulk_invites[batch]
+
+    def _render_mail(self, template, enrollment, postscript=''):
+        """Render a mail template for an enrollment"""
 
         context = {
             'name': enrollment.name,
-            'invitation_url': self.invitation_url,
-            'node_name': self.node_name,
-            'node_url': self.node_url,
             'uuid': enrollment.uuid
         }
 
-        mail = render(template, context)
+        with self.metrics.phase('template'):
+            subject, mail = template.render(context)
+        mail += postscript
         self.log('Mail:', mail, lvl=verbose)
 
-        self.fireEvent(send_mail(enrollment.email, render(subject, context), mail))
+        return subject, mail
+
+    def _send_mail(self, template, enrollment, event, postscript='', kind=None,
+                   secrets=None):
+        """Render a mail and queue it for delivery
+
+        :param secrets: Values of placeholders in the postscript, which are
+            not stored with the queued mail
+        """
+
+        subject, mail = self._render_mail(template, enrollment, postscript)
+
+        with self.metrics.phase('db'):
+            self.mail_queue.enqueue(enrollment.email, subject, mail, enrollment.uuid, kind,
+                                    secrets=secrets)
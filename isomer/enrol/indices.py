@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Indices
+===============
+
+Database indices the enrol module's lookups depend on.
+
+The schema 'indices' of isomer only create text or geo indices, which do
+not help equality lookups, and the user schema is not ours to change. So
+the needed indices are declared here and created in the background after
+startup, named with the prefix 'enrol_'.
+
+Any existing index on the same keys serves the lookups and is kept, if its
+options differ from the declared ones, a warning is logged. Only indices
+of this module, recognized by their name, are replaced when their declared
+options change. If existing duplicates prevent building a unique index, a
+plain one is built under another name, which is kept on later starts
+instead of trying again.
+
+"""
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from isomer.database import objectmodels
+from isomer.logger import isolog, debug, warn
+
+# Per schema: index keys and options. Unique indices fall back to plain
+# ones, if existing data violates the constraint.
+INDICES = {
+    'enrollment': [
+        ([('uuid', ASCENDING)], {'unique': True}),
+        ([('name', ASCENDING)], {}),
+        ([('status', ASCENDING), ('timestamp', ASCENDING)], {}),
+        ([('timestamp', DESCENDING), ('uuid', DESCENDING)], {}),
+    ],
+    'user': [
+        ([('uuid', ASCENDING)], {'unique': True}),
+        ([('name', ASCENDING)], {'unique': True}),
+        # Users without a mail address (missing or empty) may coexist
+        ([('mail', ASCENDING)], {
+            'unique': True,
+            'partialFilterExpression': {'mail': {'$type': 'string', '$gt': ''}}
+        }),
+    ],
+    'profile': [
+        ([('owner', ASCENDING)], {}),
+    ],
+    'enrolmail': [
+        ([('status', ASCENDING)], {}),
+        ([('enrollment', ASCENDING), ('kind', ASCENDING)], {}),
+    ],
+    'resettoken': [
+        ([('token', ASCENDING)], {'unique': True}),
+        ([('owner', ASCENDING)], {}),
+        # Expired tokens are removed by the database
+        ([('expires', ASCENDING)], {'expireAfterSeconds': 0}),
+    ]
+}
+
+# Options compared between declared and existing indices, with defaults
+OPTIONS = {
+    'unique': False,
+    'sparse': False,
+    'partialFilterExpression': None,
+    'expireAfterSeconds': None
+}
+
+PREFIX = 'enrol_'
+
+# Fields the enrol module filters on, per schema
+LOOKUPS = {
+    'enrollment': ['uuid', 'name', 'status'],
+    'user': ['uuid', 'name', 'mail'],
+    'profile': ['owner'],
+    'enrolmail': ['status', 'enrollment'],
+    'resettoken': ['token', 'owner']
+}
+
+
+def log(*args, **kwargs):
+    isolog(emitter='ENROL-INDICES', *args, **kwargs)
+
+
+def index_name(keys, fallback=False):
+    """Return the name of a declared index or of its non-unique fallback"""
+
+    name = PREFIX + '_'.join('%s_%s' % (field, direction) for field, direction in keys)
+
+    return name + '_plain' if fallback else name
+
+
+def _differences(information, options):
+    return sorted(
+        option for option, default in OPTIONS.items()
+        if information.get(option, default) != options.get(option, default)
+    )
+
+
+def _build(collection, schema, keys, options):
+    """Build a declared index, falling back to a plain one for unique
+    indices, that existing duplicates prevent"""
+
+    try:
+        collection.create_index(keys, background=True, name=index_name(keys), **options)
+        return
+    except OperationFailure as e:
+        if not options.get('unique', False):
+            log('Could not create index on', schema, keys, ':', e, lvl=warn)
+            return
+
+        log('Could not create unique index on', schema, keys,
+            '- check for duplicates:', e, lvl=warn)
+
+    try:
+        collection.create_index(keys, background=True, name=index_name(keys, True))
+    except OperationFailure as e:
+        log('Could not create index on', schema, keys, ':', e, lvl=warn)
+
+
+def ensure_indices():
+    """Create all declared indices, that do not exist yet"""
+
+    for schema, indices in INDICES.items():
+        collection = objectmodels[schema].collection()
+        existing = {
+            tuple(tuple(key) for key in information['key']): (name, information)
+            for name, information in collection.index_information().items()
+        }
+
+        for keys, options in indices:
+            found = existing.get(tuple(keys), None)
+            if found is None:
+                _build(collection, schema, keys, options)
+                continue
+
+            name, information = found
+            differences = _differences(information, options)
+            if len(differences) == 0:
+                continue
+
+            if name == index_name(keys):
+                log('Replacing index', name, 'of', schema, 'with changed options',
+                    differences, lvl=warn)
+                collection.drop_index(name)
+                _build(collection, schema, keys, options)
+            else:
+                log('Keeping index', name, 'of', schema, 'which differs in',
+                    differences, 'from the declared one', lvl=warn)
+
+        log('Indices of', schema, 'ensured', lvl=debug)
+
+
+def unindexed_lookups():
+    """Return (schema, field) pairs of lookups, that would have to scan their
+    collection, as no index starts with the field"""
+
+    result = []
+
+    for schema, fields in LOOKUPS.items():
+        information = objectmodels[schema].collection().index_information()
+        leading = set(index['key'][0][0] for index in information.values())
+
+        for field in fields:
+            if field not in leading:
+                result.append((schema, field))
+
+    return result
+
+
+def check_indices():
+    """Warn about lookups that fall back to collection scans"""
+
+    missing = unindexed_lookups()
+
+    for schema, field in missing:
+        log('Lookups of', schema, 'by', field, 'are not indexed and will scan '
+            'the whole collection', lvl=warn)
+
+    return len(missing) == 0
+
+
+def prepare_indices():
+    """Ensure and check all indices, e.g. in a worker"""
+
+    ensure_indices()
+
+    return check_indices()
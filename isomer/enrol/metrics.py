@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Metrics
+===============
+
+Latency metrics of the EnrolManager's event handlers.
+
+Handlers decorated with @instrumented are timed from their invocation
+until they finish, including the time generator handlers spend waiting,
+e.g. for a password hash from the worker pool. Inside a handler, phases
+(database, hashing, captcha, template) are timed with Metrics.phase and
+attributed to the handler invocation that is currently running, even when
+several generator handlers are interleaved on the event loop.
+
+Optionally, every step a handler runs on the event loop without yielding
+is timed, too. Steps exceeding a threshold block the loop and are kept in a
+ring buffer together with the size of their event's data. A watchdog
+measures how late a periodic timer fires (the loop lag) and blames lags on
+the handler that blocked the loop the longest since its last tick.
+
+"""
+
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from inspect import getfullargspec
+from json import dumps
+from time import perf_counter, time
+from types import GeneratorType
+
+from circuits import Event
+
+
+class Histogram(object):
+    """Latency histogram with fixed, roughly logarithmic millisecond buckets"""
+
+    bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+              2500, 5000, 10000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, milliseconds):
+        self.buckets[bisect_left(self.bounds, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the percentile"""
+
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= rank:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                break
+
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets': {
+                str(bound): amount for bound, amount in
+                zip(self.bounds + ('inf',), self.buckets) if amount > 0
+            }
+        }
+
+
+class Call(object):
+    """A single, running handler invocation"""
+
+    __slots__ = ('name', 'start', 'phases', 'event')
+
+    def __init__(self, name, event=None):
+        self.name = name
+        self.start = perf_counter()
+        self.phases = {}
+        self.event = event
+
+
+def data_size(event):
+    """Return the serialized size of an event's data, if it has any"""
+
+    try:
+        return len(dumps(getattr(event, 'data', None), default=str))
+    except (TypeError, ValueError):
+        return None
+
+
+class Metrics(object):
+    """Per handler invocation counts, latencies and phase latencies"""
+
+    def __init__(self, slow_threshold=0.0, slow_entries=50):
+        """
+        :param slow_threshold: Record handler steps blocking the loop for at
+            least this many seconds, 0 to disable
+        :param slow_entries: Size of the ring buffer of slow steps and lags
+        """
+
+        self.current = None
+        self.slow_threshold = slow_threshold
+        self.slow = deque(maxlen=slow_entries)
+        self.reset()
+        self.reset_slow()
+
+    def reset(self):
+        self.started = time()
+        self.handlers = {}
+
+    def reset_slow(self):
+        self.slow.clear()
+        self.loop_lag = Histogram()
+        self.longest = (0.0, None)
+
+    def configure_slow(self, threshold, entries):
+        self.slow_threshold = threshold
+        if entries != self.slow.maxlen:
+            self.slow = deque(self.slow, maxlen=entries)
+
+    def _record(self, name):
+        record = self.handlers.get(name, None)
+        if record is None:
+            record = self.handlers[name] = {
+                'calls': 0,
+                'errors': 0,
+                'latency': Histogram(),
+                'phases': {}
+            }
+
+        return record
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the current handler invocation"""
+
+        call = self.current
+        if call is None:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            call.phases[name] = call.phases.get(name, 0.0) + perf_counter() - start
+
+    def run(self, name, function, *args, **kwargs):
+        """Call a handler and record its invocation"""
+
+        event = None
+        for argument in args:
+            if isinstance(argument, Event):
+                event = argument
+                break
+
+        call = Call(name, event)
+
+        previous = self.current
+        self.current = call
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            self._finish(call, True)
+            raise
+        finally:
+            self.current = previous
+            self._step(call, perf_counter() - start)
+
+        if isinstance(result, GeneratorType):
+            return self._follow(call, result)
+
+        self._finish(call, False)
+        return result
+
+    def _follow(self, call, generator):
+        """Drive a generator handler, making its invocation the current one
+        whenever it runs"""
+
+        value = None
+        error = None
+
+        while True:
+            previous = self.current
+            self.current = call
+            start = perf_counter()
+            try:
+                if error is None:
+                    step = generator.send(value)
+                else:
+                    step = generator.throw(error)
+            except StopIteration as e:
+                self._finish(call, False)
+                return e.value
+            except BaseException:
+                self._finish(call, True)
+                raise
+            finally:
+                self.current = previous
+                self._step(call, perf_counter() - start)
+
+            try:
+                value = yield step
+                error = None
+            except BaseException as e:
+                value = None
+                error = e
+
+    def _step(self, call, duration):
+        """Account for a handler having run on the loop without yielding"""
+
+        if duration > self.longest[0]:
+            self.longest = (duration, call.name)
+
+        if 0 < self.slow_threshold <= duration:
+            self.slow.append({
+                'kind': 'handler',
+                'handler': call.name,
+                'time': time(),
+                'duration': duration * 1000,
+                'data_size': data_size(call.event)
+            })
+
+    def lag(self, lag):
+        """Record the loop lag measured by a watchdog and blame large ones on
+        the handler that blocked the loop the longest since the last call
+
+        :return: The recorded lag entry, if the lag exceeded the threshold
+        """
+
+        blocking, culprit = self.longest
+        self.longest = (0.0, None)
+
+        self.loop_lag.observe(lag * 1000)
+
+        if self.slow_threshold <= 0 or lag < self.slow_threshold:
+            return None
+
+        entry = {
+            'kind': 'lag',
+            'handler': culprit,
+            'time': time(),
+            'duration': lag * 1000,
+            'blocking': blocking * 1000
+        }
+        self.slow.append(entry)
+
+        return entry
+
+    def _finish(self, call, failed):
+        record = self._record(call.name)
+        record['calls'] += 1
+        if failed:
+            record['errors'] += 1
+
+        record['latency'].observe((perf_counter() - call.start) * 1000)
+
+        for phase, duration in call.phases.items():
+            histogram = record['phases'].get(phase, None)
+            if histogram is None:
+                histogram = record['phases'][phase] = Histogram()
+            histogram.observe(duration * 1000)
+
+    def slow_snapshot(self):
+        """Return the loop lag and the recorded slow steps and lags, worst
+        first"""
+
+        return {
+            'threshold': self.slow_threshold * 1000,
+            'loop_lag': self.loop_lag.snapshot(),
+            'entries': sorted(self.slow, key=lambda entry: entry['duration'],
+                              reverse=True)
+        }
+
+    def snapshot(self):
+        """Return all recorded metrics as plain, serializable values"""
+
+        return {
+            'since': self.started,
+            'handlers': {
+                name: {
+                    'calls': record['calls'],
+                    'errors': record['errors'],
+                    'latency': record['latency'].snapshot(),
+                    'phases': {
+                        phase: histogram.snapshot()
+                        for phase, histogram in record['phases'].items()
+                    }
+                }
+                for name, record in self.handlers.items()
+            }
+        }
+
+
+def instrumented(function):
+    """Record invocations of a component's handler in its 'metrics'
+
+    Apply below @handler, which inspects the arguments of the function.
+    """
+
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        return self.metrics.run(function.__name__, function, self, *args, **kwargs)
+
+    args = getfullargspec(function).args
+    wrapper.event = len(args) > 1 and args[1] == 'event'
+
+    return wrapper
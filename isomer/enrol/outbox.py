@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Outbox
+==============
+
+Persistent outbound mail queue of the enrol module.
+
+Queued mails are stored as 'enrolmail' objects, so they survive restarts,
+and mirrored in memory ordered by their next delivery attempt. Only one mail
+per kind and enrollment is queued: resending an invitation that has not gone
+out yet replaces the queued one. Failed deliveries are retried with
+exponential backoff.
+
+Secrets, like generated passwords and reset links, are never stored: the
+stored body holds placeholders (see placeholder()) and the secret values
+are only kept in memory, until the mail is delivered or given up on. Mails
+whose secrets were lost with a restart can not be delivered complete, they
+are marked as failed with a reason when the queue is loaded and kept, so
+admins can see whose mail did not go out.
+
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+
+from isomer.database import objectmodels
+from isomer.logger import isolog, debug, warn
+from isomer.misc.std import std_now, std_uuid
+
+
+def placeholder(name):
+    """Return the placeholder of a secret value in a stored mail body"""
+
+    return '[[' + name + ']]'
+
+
+class MailQueue(object):
+    """Rate agnostic, persistent queue of outbound mails"""
+
+    def __init__(self, retries=5, retry_delay=60):
+        """
+        :param retries: Give up on a mail after this many failed attempts
+        :param retry_delay: Seconds to wait after the first failed attempt,
+            doubled for every further one
+        """
+
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+        self._mails = {}
+        self._secrets = {}
+        self._keys = {}
+        self._heap = []
+        self._counter = count()
+
+    def log(self, *args, **kwargs):
+        isolog(emitter='ENROL-OUTBOX', *args, **kwargs)
+
+    def __len__(self):
+        return len(self._mails)
+
+    def load(self):
+        """Restore all still queued mails from the database
+
+        :return: Mails, that failed as their secrets were lost
+        """
+
+        lost = []
+
+        for mail in objectmodels['enrolmail'].find({'status': 'Queued'}):
+            if len(getattr(mail, 'secrets', [])) > 0:
+                self.log('Not delivering mail to', mail.recipient, 'as its secrets '
+                         'were lost', lvl=warn)
+                mail.status = 'Failed'
+                mail.reason = 'Secrets lost with a restart'
+                mail.save()
+                self.failed += 1
+                lost.append(mail)
+                continue
+            self._add(mail)
+
+        self.log('Restored', len(self._mails), 'queued mails', lvl=debug)
+
+        return lost
+
+    def enqueue(self, recipient, subject, body, enrollment=None, kind=None,
+                batch=None, secrets=None):
+        """Queue a mail, replacing a not yet sent one of the same kind for
+        the same enrollment
+
+        :param secrets: Values of the placeholders in the body, which are
+            only kept in memory
+        """
+
+        key = (enrollment, kind)
+        if enrollment is not None and key in self._keys:
+            mail = self._mails[self._keys[key]]
+            mail.recipient = recipient
+            mail.subject = subject
+            mail.body = body
+            mail.secrets = sorted(secrets or {})
+            mail.save()
+            self._keep_secrets(mail, secrets)
+
+            self.coalesced += 1
+            self.log('Coalesced mail to', recipient, lvl=debug)
+            return mail
+
+        mail = self._create(recipient, subject, body, enrollment, kind, batch)
+        mail.secrets = sorted(secrets or {})
+        mail.save()
+        self._keep_secrets(mail, secrets)
+        self._add(mail)
+
+        return mail
+
+    def _keep_secrets(self, mail, secrets):
+        if secrets:
+            self._secrets[mail.uuid] = dict(secrets)
+        else:
+            self._secrets.pop(mail.uuid, None)
+
+    def body(self, mail):
+        """Return the body of a mail with its secrets filled in"""
+
+        body = mail.body
+        for name, value in self._secrets.get(mail.uuid, {}).items():
+            body = body.replace(placeholder(name), value)
+
+        return body
+
+    def enqueue_many(self, mails):
+        """Queue a batch of new mails with a single database write
+
+        :param mails: Iterable of (recipient, subject, body, enrollment,
+            kind, batch) tuples
+        """
+
+        mails = [self._create(*item) for item in mails]
+        if len(mails) == 0:
+            return
+
+        objectmodels['enrolmail'].bulk_create(mails)
+
+        for mail in mails:
+            self._add(mail)
+
+    def due(self, limit, now=None):
+        """Remove and return up to limit mails that are due for delivery"""
+
+        if now is None:
+            now = time()
+
+        result = []
+        while len(self._heap) > 0 and len(result) < limit:
+            next_attempt, index, uuid = self._heap[0]
+            if next_attempt > now:
+                break
+
+            heappop(self._heap)
+            mail = self._mails.get(uuid, None)
+            if mail is None or mail.next_attempt != next_attempt:
+                continue
+
+            self._remove(mail)
+            result.append(mail)
+
+        return result
+
+    def delivered(self, mail):
+        """Drop a successfully delivered mail from the queue"""
+
+        mail.delete()
+        self._secrets.pop(mail.uuid, None)
+        self.sent += 1
+
+    def retry(self, mail, now=None):
+        """Reschedule a mail after a failed delivery attempt"""
+
+        if now is None:
+            now = time()
+
+        mail.attempts += 1
+
+        if mail.attempts >= self.retries:
+            self.log('Giving up delivering mail to', mail.recipient, 'after',
+                     mail.attempts, 'attempts', lvl=warn)
+            mail.status = 'Failed'
+            mail.reason = 'Delivery failed %i times' % mail.attempts
+            mail.save()
+            self._secrets.pop(mail.uuid, None)
+            self.failed += 1
+            return
+
+        mail.next_attempt = now + self.retry_delay * 2 ** (mail.attempts - 1)
+        mail.save()
+        self._add(mail)
+
+    def status(self, enrollment=None):
+        """Return queue statistics or the queued mails of an enrollment"""
+
+        if enrollment is not None:
+            return [
+                {
+                    'kind': mail.kind,
+                    'recipient': mail.recipient,
+                    'status': mail.status,
+                    'reason': getattr(mail, 'reason', None),
+                    'attempts': mail.attempts,
+                    'next_attempt': mail.next_attempt
+                }
+                for mail in objectmodels['enrolmail'].find({'enrollment': enrollment})
+            ]
+
+        return {
+            'queued': len(self._mails),
+            'sent': self.sent,
+            'failed': self.failed,
+            'coalesced': self.coalesced
+        }
+
+    @staticmethod
+    def _create(recipient, subject, body, enrollment=None, kind=None, batch=None):
+        props = {
+            'uuid': std_uuid(),
+            'recipient': recipient,
+            'subject': subject,
+            'body': body,
+            'status': 'Queued',
+            'attempts': 0,
+            'next_attempt': time(),
+            'timestamp': std_now()
+        }
+        if enrollment is not None:
+            props['enrollment'] = enrollment
+        if kind is not None:
+            props['kind'] = kind
+        if batch is not None:
+            props['batch'] = batch
+
+        return objectmodels['enrolmail'](props)
+
+    def _add(self, mail):
+        self._mails[mail.uuid] = mail
+        enrollment = getattr(mail, 'enrollment', None)
+        if enrollment is not None:
+            self._keys[(enrollment, getattr(mail, 'kind', None))] = mail.uuid
+
+        heappush(self._heap, (mail.next_attempt, next(self._counter), mail.uuid))
+
+    def _remove(self, mail):
+        del self._mails[mail.uuid]
+        enrollment = getattr(mail, 'enrollment', None)
+        if enrollment is not None:
+            self._keys.pop((enrollment, getattr(mail, 'kind', None)), None)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Packets
+===============
+
+Response packets of the EnrolManager.
+
+All replies are built with packet(). Replies that only change with the
+configuration (e.g. the registration status) and the success and failure
+feedback messages are built once and shared by all replies, instead of
+building the same dictionaries for every request. Shared packets must not
+be modified after they have been sent.
+
+"""
+
+COMPONENT = 'isomer.enrol.enrolmanager'
+
+
+def packet(action, data):
+    """Build a response packet of the enrol component"""
+
+    return {
+        'component': COMPONENT,
+        'action': action,
+        'data': data
+    }
+
+
+class PacketCache(object):
+    """Shared, invariant response packets"""
+
+    def __init__(self, max_feedback=1000):
+        """
+        :param max_feedback: Maximum amount of remembered feedback packets
+        """
+
+        self.max_feedback = max_feedback
+
+        self._fixed = {}
+        self._feedback = {}
+
+    def __getitem__(self, name):
+        return self._fixed[name]
+
+    def define(self, name, action, data):
+        """Build a named packet, replacing an earlier definition"""
+
+        self._fixed[name] = packet(action, data)
+
+    def feedback(self, action, success, msg):
+        """Return the packet of a success or failure message"""
+
+        if not isinstance(msg, str):
+            return packet(action, (success, msg))
+
+        key = (action, success, msg)
+        result = self._feedback.get(key, None)
+        if result is None:
+            # Messages are a small, fixed set (times languages), this only
+            # guards against unexpected growth
+            if len(self._feedback) >= self.max_feedback:
+                self._feedback.clear()
+            result = self._feedback[key] = packet(action, (success, msg))
+
+        return result
+
+    def clear(self):
+        self._fixed.clear()
+        self._feedback.clear()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Ratelimit
+=================
+
+Token bucket rate limiting for anonymous enrol events.
+
+Every (event, client) and (event, address) pair gets a bucket that refills
+at a configured rate up to a burst size. A request is only let through, if
+both of its buckets still hold a token.
+
+"""
+
+from time import time
+
+
+class RateLimiter(object):
+    """Token buckets keyed by client uuid and by source address"""
+
+    def __init__(self, limits, address_factor=5, max_buckets=100000):
+        """
+        :param limits: Dictionary of event names to {'rate': requests per
+            minute, 'burst': maximum tokens}
+        :param address_factor: Multiplier for the limits of source addresses,
+            which may be shared by many clients
+        :param max_buckets: Prune full buckets when more than this are held
+        """
+
+        self.limits = limits
+        self.address_factor = address_factor
+        self.max_buckets = max_buckets
+
+        self.rejected = {}
+
+        self._buckets = {}
+
+    def allow(self, action, client, address=None, now=None):
+        """Check and take a token for an event of a client, returns False if
+        the request should be rejected"""
+
+        limit = self.limits.get(action, None)
+        if limit is None:
+            return True
+
+        if now is None:
+            now = time()
+
+        if len(self._buckets) > self.max_buckets:
+            self.prune(now)
+
+        rate = limit['rate'] / 60.0
+        burst = limit['burst']
+
+        client_key = (action, 'client', client)
+        allowed = self._peek(client_key, rate, burst, now)
+
+        if allowed and address is not None:
+            address_key = (action, 'address', address)
+            allowed = self._peek(address_key, rate * self.address_factor,
+                                 burst * self.address_factor, now)
+            if allowed:
+                self._take(address_key)
+
+        if not allowed:
+            self.rejected[action] = self.rejected.get(action, 0) + 1
+            return False
+
+        self._take(client_key)
+        return True
+
+    def prune(self, now=None):
+        """Drop all buckets that have refilled completely"""
+
+        if now is None:
+            now = time()
+
+        for key, (tokens, last, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+    def stats(self):
+        """Return the amount of buckets and rejected requests per event"""
+
+        return {
+            'buckets': len(self._buckets),
+            'rejected': dict(self.rejected)
+        }
+
+    def _peek(self, key, rate, burst, now):
+        tokens, last, old_rate, old_burst = self._buckets.get(key, (burst, now, rate, burst))
+        tokens = min(burst, tokens + (now - last) * rate)
+        self._buckets[key] = (tokens, now, rate, burst)
+
+        return tokens >= 1
+
+    def _take(self, key):
+        tokens, last, rate, burst = self._buckets[key]
+        self._buckets[key] = (tokens - 1, last, rate, burst)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Resets
+==============
+
+Password reset tokens.
+
+Tokens are random strings, of which only the SHA-256 hash is stored as
+'resettoken' object. The collection is indexed on the hash, so redeeming a
+token is a single indexed lookup and delete, and on the expiry date with a
+TTL index, so the database removes expired tokens by itself. As the TTL
+monitor only runs periodically, redemption checks the expiry date, too.
+
+Issuing a token keeps the earlier ones of the user: concurrent requests
+may finish in any order, and the mail queue only sends the last of their
+coalesced mails, whose token must still be valid. Setting a password
+removes all tokens of the user.
+
+request_token() and set_password() bundle the database work of a reset
+request and a redemption, so the EnrolManager can run each of them as one
+task in its worker pool instead of on the event loop.
+
+"""
+
+from datetime import datetime, timedelta
+from hashlib import sha256
+from os import urandom
+
+from isomer.database import objectmodels
+from isomer.misc.std import std_uuid
+
+
+def token_hash(token):
+    return sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_token(owner, ttl):
+    """Store a new reset token for a user, returns the token"""
+
+    token = urandom(32).hex()
+
+    objectmodels['resettoken'].collection().insert_one({
+        'uuid': std_uuid(),
+        'owner': owner,
+        'token': token_hash(token),
+        'expires': datetime.utcnow() + timedelta(seconds=ttl)
+    })
+
+    return token
+
+
+def redeem_token(token):
+    """Consume a reset token, returns the uuid of its owner or None if the
+    token is unknown or expired"""
+
+    if not isinstance(token, str) or token == '':
+        return None
+
+    document = objectmodels['resettoken'].collection().find_one_and_delete(
+        {'token': token_hash(token), 'expires': {'$gt': datetime.utcnow()}},
+        {'owner': 1, '_id': 0}
+    )
+
+    return None if document is None else document['owner']
+
+
+def request_token(query, ttl):
+    """Look up the account matching a reset query and issue a token for it,
+    returns the user and the token or (None, None) for unknown accounts and
+    accounts without mail address"""
+
+    user = objectmodels['user'].collection().find_one(
+        query, {'uuid': 1, 'name': 1, 'mail': 1, '_id': 0}
+    )
+
+    if user is None or not user.get('mail', None):
+        return None, None
+
+    return user, issue_token(user['uuid'], ttl)
+
+
+def set_password(token, passhash):
+    """Redeem a reset token and store the new password hash of its owner,
+    returns the uuid of the owner or None if the token is invalid"""
+
+    owner = redeem_token(token)
+    if owner is None:
+        return None
+
+    objectmodels['resettoken'].collection().delete_many({'owner': owner})
+
+    result = objectmodels['user'].collection().update_one(
+        {'uuid': owner}, {'$set': {'passhash': passhash}}
+    )
+
+    return owner if result.matched_count > 0 else None
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Schema: Resettoken
+==================
+
+Contains
+--------
+
+resettoken: Issued password reset token of a user
+
+
+"""
+
+from isomer.schemata.defaultform import *
+from isomer.schemata.base import base_object
+
+ResetTokenSchema = base_object('resettoken')
+
+ResetTokenSchema['properties'].update({
+    'token': {
+        'type': 'string', 'title': 'Token',
+        'description': 'SHA-256 hash of the token sent to the user'
+    },
+    'expires': {
+        'format': 'datetimepicker',
+        'title': 'Expires',
+        'description': 'Date (stored as native date for the TTL index) after '
+                       'which the token is invalid'
+    }
+})
+
+ResetTokenForm = [
+    'owner', 'expires',
+    editbuttons
+]
+
+ResetToken = {'schema': ResetTokenSchema, 'form': ResetTokenForm}
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Templates
+=================
+
+Compiled mail templates.
+
+Subject and body are parsed once, whenever the configuration is (re)loaded,
+and rendered with a pre-bound static context of node information.
+
+"""
+
+from pystache import parse
+from pystache.renderer import Renderer
+
+
+class MailTemplate(object):
+    """A parsed mail subject and body with a static rendering context"""
+
+    def __init__(self, subject, body, static_context=None):
+        """
+        :param subject: Mustache template of the mail subject
+        :param body: Mustache template of the mail body
+        :param static_context: Context values that are the same for all mails
+        """
+
+        self.subject = parse(subject)
+        self.body = parse(body)
+        self.static_context = static_context if static_context is not None else {}
+
+        self._renderer = Renderer()
+
+    def render(self, context):
+        """Render subject and body, context takes precedence over static values"""
+
+        return (
+            self._renderer.render(self.subject, self.static_context, context),
+            self._renderer.render(self.body, self.static_context, context)
+        )
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Testing
+===============
+
+Support for running the EnrolManager offline, shared by the tests and the
+benchmarks: an in-memory database (see memorydb), an EnrolManager reading
+its configuration from defaults and overrides, stand-ins for the client and
+user objects of isomer's client manager and a local mail sink.
+
+Usage:
+
+    from isomer.enrol.testing import memorydb
+    memorydb.install()
+
+    from isomer.enrol.testing import ConfiguredEnrolManager, MailSink
+
+"""
+
+from threading import Lock
+from time import sleep
+
+from circuits import Component, Worker, handler, task
+
+from isomer.enrol.enrolmanager import EnrolManager
+
+
+class Configuration(object):
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def save(self):
+        pass
+
+
+class ConfiguredEnrolManager(EnrolManager):
+    """EnrolManager reading its configuration from defaults and overrides
+    instead of the database"""
+
+    overrides = {}
+
+    def _read_config(self):
+        values = {key: value.get('default', None) for key, value in self.configprops.items()}
+        values.update(self.overrides)
+        self.config = Configuration(values)
+
+    def _write_config(self):
+        pass
+
+
+class Client(object):
+    """Stand-in for the client objects of isomer's client manager"""
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        # Spread over some addresses, like clients of different hosts
+        self.ip = '127.0.0.%i' % (hash(uuid) % 250 + 1)
+        self.language = 'en'
+
+
+class User(object):
+    """Stand-in for the user objects of isomer's client manager"""
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class MailSink(Component):
+    """Local stand-in for the mail component, taking delay seconds per mail
+
+    Mails are delivered in a pool of threads, like by a mail server handling
+    several connections. Delivered mails are recorded as (recipient,
+    subject, body) along with the peak amount of concurrent deliveries.
+    """
+
+    channel = 'mailsink'
+
+    def init(self, delay=0.0):
+        self.delay = delay
+        self.mails = []
+        self.active = 0
+        self.peak = 0
+        self.lock = Lock()
+
+        Worker(channel='mailsink-worker', workers=4).register(self)
+
+    def _deliver(self, recipient, subject, body):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+            self.mails.append((recipient, subject, body))
+
+    @handler('send_mail', channel='*')
+    def send_mail(self, event):
+        yield self.call(task(self._deliver, event.to_address, event.subject, event.mail_text),
+                        'mailsink-worker')
+        yield True
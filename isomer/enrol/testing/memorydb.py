@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: In-memory database
+==========================
+
+A small, in-memory stand-in for isomer's objectmodels and the pymongo
+collections behind them, covering the queries and updates the enrol
+module uses. It is meant for offline tests and benchmarks, not for
+correctness tests of queries: only a subset of the MongoDB operators is
+supported.
+
+Usage:
+
+    from isomer.enrol.testing import memorydb
+    memorydb.install()
+
+"""
+
+from copy import deepcopy
+from itertools import count
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+SCHEMATA = ('user', 'profile', 'enrollment', 'enrolmail', 'resettoken', 'systemconfig')
+
+
+def _get(document, key):
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _compare(value, operator, argument):
+    if operator == '$in':
+        if isinstance(value, list):
+            return any(item in argument for item in value)
+        return value in argument
+    if operator == '$nin':
+        return not _compare(value, '$in', argument)
+    if operator == '$ne':
+        return value != argument
+    if operator == '$exists':
+        return (value is not None) == argument
+    if operator == '$type':
+        types = {'string': str, 'bool': bool, 'array': list, 'object': dict}
+        return isinstance(value, types[argument])
+    if value is None:
+        return False
+    if operator == '$lt':
+        return value < argument
+    if operator == '$lte':
+        return value <= argument
+    if operator == '$gt':
+        return value > argument
+    if operator == '$gte':
+        return value >= argument
+
+    raise NotImplementedError(operator)
+
+
+def matches(document, query):
+    """Check if a document matches a MongoDB style query"""
+
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(document, item) for item in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, item) for item in condition):
+                return False
+        else:
+            value = _get(document, key)
+            if isinstance(condition, dict) and \
+                    all(operator.startswith('$') for operator in condition):
+                if not all(_compare(value, operator, argument)
+                           for operator, argument in condition.items()):
+                    return False
+            elif isinstance(value, list) and not isinstance(condition, list):
+                if condition not in value:
+                    return False
+            elif value != condition:
+                return False
+
+    return True
+
+
+def _project(document, projection):
+    if projection is None:
+        return deepcopy(document)
+
+    include = [key for key, value in projection.items() if value and key != '_id']
+    if len(include) == 0:
+        result = deepcopy(document)
+    else:
+        result = {key: deepcopy(document[key]) for key in include if key in document}
+        result['_id'] = document['_id']
+
+    if not projection.get('_id', 1):
+        result.pop('_id', None)
+
+    return result
+
+
+class Result(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Cursor(object):
+    def __init__(self, documents, projection):
+        self._documents = documents
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._documents.sort(key=lambda document: (_get(document, field) is not None,
+                                                       _get(document, field)),
+                                 reverse=order < 0)
+        return self
+
+    def limit(self, amount):
+        self._limit = amount
+        return self
+
+    def __iter__(self):
+        documents = self._documents
+        if self._limit > 0:
+            documents = documents[:self._limit]
+
+        for document in documents:
+            yield _project(document, self._projection)
+
+
+class Collection(object):
+    """The used subset of a pymongo collection"""
+
+    _ids = count()
+
+    def __init__(self, name):
+        self.name = name
+        self.documents = []
+        self.indices = {'_id_': {'key': [('_id', 1)]}}
+
+    def _unique_check(self, document, ignore=None, others=None):
+        for index in self.indices.values():
+            if not index.get('unique', False):
+                continue
+            fields = [field for field, direction in index['key']]
+            values = [_get(document, field) for field in fields]
+            if index.get('sparse', False) and all(value is None for value in values):
+                continue
+            partial = index.get('partialFilterExpression', None)
+            if partial is not None and not matches(document, partial):
+                continue
+            for other in self.documents if others is None else others:
+                if other is ignore or (partial is not None and not matches(other, partial)):
+                    continue
+                if [_get(other, field) for field in fields] == values:
+                    raise DuplicateKeyError('%s: %s' % (self.name, values), 11000)
+
+    def _select(self, query):
+        return [document for document in self.documents if matches(document, query)]
+
+    def find(self, query=None, projection=None, limit=0):
+        cursor = Cursor(self._select(query or {}), projection)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    def find_one(self, query=None, projection=None):
+        for document in self.documents:
+            if matches(document, query or {}):
+                return _project(document, projection)
+        return None
+
+    def find_one_and_delete(self, query, projection=None):
+        for document in self.documents:
+            if matches(document, query):
+                self.documents.remove(document)
+                return _project(document, projection)
+        return None
+
+    def count_documents(self, query):
+        return len(self._select(query))
+
+    def insert_one(self, document):
+        # Like pymongo, set the _id of the given document
+        document.setdefault('_id', next(self._ids))
+        self._unique_check(document)
+        self.documents.append(deepcopy(document))
+        return Result(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        inserted = []
+        errors = []
+
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self.insert_one(document).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'errmsg': str(e)})
+                if ordered:
+                    break
+
+        if len(errors) > 0:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(inserted)})
+
+        return Result(inserted_ids=inserted)
+
+    insert = insert_many
+
+    def replace_one(self, query, document, upsert=False):
+        for index, other in enumerate(self.documents):
+            if matches(other, query):
+                document = deepcopy(document)
+                document['_id'] = other['_id']
+                self._unique_check(document, other)
+                self.documents[index] = document
+                return Result(matched_count=1, modified_count=1)
+
+        if upsert:
+            self.insert_one(document)
+        return Result(matched_count=0, modified_count=0)
+
+    def _update(self, document, update):
+        for operator, fields in update.items():
+            for key, value in fields.items():
+                if operator == '$set':
+                    document[key] = deepcopy(value)
+                elif operator == '$unset':
+                    document.pop(key, None)
+                elif operator == '$inc':
+                    document[key] = document.get(key, 0) + value
+                elif operator == '$addToSet':
+                    items = document.setdefault(key, [])
+                    if value in items:
+                        return False
+                    items.append(value)
+                elif operator == '$pull':
+                    items = document.get(key, [])
+                    if value not in items:
+                        return False
+                    document[key] = [item for item in items if item != value]
+                else:
+                    raise NotImplementedError(operator)
+
+        return True
+
+    def update_one(self, query, update):
+        for document in self.documents:
+            if matches(document, query):
+                modified = self._update(document, update)
+                return Result(matched_count=1, modified_count=int(modified))
+
+        return Result(matched_count=0, modified_count=0)
+
+    def update_many(self, query, update):
+        selected = self._select(query)
+        modified = sum(1 for document in selected if self._update(document, update))
+        return Result(matched_count=len(selected), modified_count=modified)
+
+    def delete_one(self, query):
+        for document in self.documents:
+            if matches(document, query):
+                self.documents.remove(document)
+                return Result(deleted_count=1)
+
+        return Result(deleted_count=0)
+
+    def delete_many(self, query):
+        before = len(self.documents)
+        self.documents = [document for document in self.documents
+                          if not matches(document, query)]
+        return Result(deleted_count=before - len(self.documents))
+
+    def create_index(self, keys, unique=False, sparse=False, partialFilterExpression=None,
+                     expireAfterSeconds=None, name=None, **kwargs):
+        keys = list(keys)
+        if name is None:
+            name = '_'.join('%s_%s' % (field, direction) for field, direction in keys)
+
+        # Like index_information() of MongoDB, only set options are listed
+        index = {'key': keys}
+        for option, value in (('unique', unique), ('sparse', sparse),
+                              ('partialFilterExpression', partialFilterExpression),
+                              ('expireAfterSeconds', expireAfterSeconds)):
+            if value not in (None, False):
+                index[option] = value
+
+        for other_name, other in self.indices.items():
+            if other_name == name and other != index:
+                raise OperationFailure('Index with name: %s already exists with '
+                                       'different options' % name, 85)
+            if other_name != name and other['key'] == keys:
+                raise OperationFailure('Index already exists with a different name: %s'
+                                       % other_name, 85)
+
+        if unique:
+            # Building a unique index fails on existing duplicates
+            indices, self.indices = self.indices, {name: index}
+            try:
+                for position, document in enumerate(self.documents):
+                    self._unique_check(document, ignore=document,
+                                       others=self.documents[:position])
+            finally:
+                self.indices = indices
+
+        self.indices[name] = index
+        return name
+
+    def drop_index(self, keys):
+        name = keys if isinstance(keys, str) else \
+            '_'.join('%s_%s' % (field, direction) for field, direction in keys)
+        del self.indices[name]
+
+    def index_information(self):
+        return deepcopy(self.indices)
+
+
+class Model(object):
+    """The used subset of an isomer object model"""
+
+    _collection = None
+
+    def __init__(self, fields=None):
+        object.__setattr__(self, '_fields', dict(fields or {}))
+
+    def __getattr__(self, key):
+        try:
+            return self._fields[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self._fields[key] = value
+
+    def validate(self):
+        pass
+
+    def serializablefields(self):
+        result = dict(self._fields)
+        result.pop('_id', None)
+        return result
+
+    def save(self):
+        collection = self.collection()
+        if '_id' in self._fields:
+            collection.replace_one({'_id': self._fields['_id']}, self._fields)
+        else:
+            collection.insert_one(self._fields)
+
+    def delete(self):
+        self.collection().delete_one({'_id': self._fields['_id']})
+
+    @classmethod
+    def collection(cls):
+        return cls._collection
+
+    @classmethod
+    def find(cls, query=None, *args, **kwargs):
+        for document in cls._collection.find(query, *args, **kwargs):
+            yield cls(document)
+
+    @classmethod
+    def find_one(cls, query=None, *args, **kwargs):
+        document = cls._collection.find_one(query, *args, **kwargs)
+        return cls(document) if document is not None else None
+
+    @classmethod
+    def count(cls, query=None):
+        return cls._collection.count_documents(query or {})
+
+    @classmethod
+    def bulk_create(cls, objects):
+        cls._collection.insert_many([model._fields for model in objects])
+
+
+def model_factory(name):
+    return type(name, (Model,), {'_collection': Collection(name)})
+
+
+def install(schemata=SCHEMATA, salt='benchmarksalt', hostname='localhost',
+            node_name='Benchmark'):
+    """Replace isomer's objectmodels with in-memory ones and create an active
+    systemconfig. Enrol modules imported already are rebound, too."""
+
+    import sys
+    import isomer.database
+
+    objectmodels = {name: model_factory(name) for name in schemata}
+    isomer.database.objectmodels = objectmodels
+
+    for name, module in list(sys.modules.items()):
+        if name.startswith('isomer.enrol') and hasattr(module, 'objectmodels'):
+            module.objectmodels = objectmodels
+
+    objectmodels['systemconfig']({
+        'uuid': 'systemconfig',
+        'active': True,
+        'salt': salt,
+        'hostname': hostname,
+        'name': node_name
+    }).save()
+
+    return objectmodels
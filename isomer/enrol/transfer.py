@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Transfer
+================
+
+Streaming import and export of enrollments and users as CSV or JSONL
+files, e.g. to migrate between nodes or to seed a new deployment.
+
+Exports read the collection with a cursor and write one object at a time,
+so their memory use does not depend on the collection size.
+
+Imports read the file in chunks. Every record of a chunk is validated
+against its schema, then the chunk is written with one bulk insert per
+collection. Imported users get a profile, like users created by the
+EnrolManager. After every chunk, the file position is stored in a
+checkpoint file next to the imported one, so an interrupted import can be
+resumed. Records whose uuid or name exists already are skipped, which
+makes repeating a chunk after a crash harmless. Records without a uuid get
+one derived from their name (and mail address), so they get the same one
+on every run.
+
+Both run as generators yielding their progress after every chunk, so the
+EnrolManager can interleave them with other events.
+
+"""
+
+import csv
+import os
+from json import dumps, loads, dump, load
+from uuid import NAMESPACE_URL, uuid5
+
+from jsonschema import Draft4Validator
+from pymongo.errors import BulkWriteError
+
+from isomer.database import objectmodels
+from isomer.logger import isolog, debug, warn
+from isomer.misc.std import std_hash, std_now, std_uuid
+from isomer.schemata.user import UserSchema
+
+from isomer.enrol.enrollment import EnrollmentSchema
+
+FORMATS = ('csv', 'jsonl')
+
+# Namespace of the uuids derived for imported records without one
+IMPORT_NAMESPACE = uuid5(NAMESPACE_URL, 'https://github.com/isomeric/isomer-enrol/import')
+
+KINDS = {
+    'enrollments': {
+        'schema': 'enrollment',
+        'validator': Draft4Validator(EnrollmentSchema),
+        'properties': EnrollmentSchema['properties'],
+        'fields': ['uuid', 'status', 'name', 'method', 'email', 'timestamp'],
+        'secrets': ['password']
+    },
+    'users': {
+        'schema': 'user',
+        'validator': Draft4Validator(UserSchema),
+        'properties': UserSchema['properties'],
+        'fields': ['uuid', 'name', 'mail', 'roles', 'active', 'needs_password_change',
+                   'created', 'lastlogin'],
+        'secrets': ['passhash']
+    }
+}
+
+
+def log(*args, **kwargs):
+    isolog(emitter='ENROL-TRANSFER', *args, **kwargs)
+
+
+def detect_format(path):
+    """Guess the format of a file from its extension, JSONL by default"""
+
+    if path.lower().endswith('.csv'):
+        return 'csv'
+
+    return 'jsonl'
+
+
+def stream_export(kind, output, file_format='jsonl', secrets=False, chunk_size=500):
+    """Write all objects of a kind to a file object, yields the amount
+    written so far after every chunk
+
+    :param kind: One of KINDS
+    :param output: Text file object to write to
+    :param file_format: One of FORMATS
+    :param secrets: Include passwords and password hashes
+    :param chunk_size: Amount of objects to write between progress reports
+    """
+
+    fields = KINDS[kind]['fields'] + (KINDS[kind]['secrets'] if secrets else [])
+    projection = dict({field: 1 for field in fields}, _id=0)
+
+    if file_format == 'csv':
+        writer = csv.DictWriter(output, fields, extrasaction='ignore')
+        writer.writeheader()
+
+    cursor = objectmodels[KINDS[kind]['schema']].collection().find(
+        {}, projection, batch_size=chunk_size)
+
+    written = 0
+    for document in cursor:
+        if file_format == 'csv':
+            for key, value in document.items():
+                if isinstance(value, list):
+                    document[key] = ','.join(value)
+            writer.writerow(document)
+        else:
+            output.write(dumps(document, default=str) + '\n')
+
+        written += 1
+        if written % chunk_size == 0:
+            yield written
+
+    yield written
+
+
+def _coerce(value, definition):
+    """Convert a CSV cell to the type its schema property expects"""
+
+    kind = definition.get('type', 'string')
+    if kind == 'array':
+        return [item.strip() for item in value.split(',') if item.strip() != '']
+    if kind == 'boolean':
+        return value.strip().lower() in ('1', 'true', 'yes')
+
+    return value
+
+
+class Importer(object):
+    """Resumable, chunked import of a CSV or JSONL file"""
+
+    def __init__(self, kind, path, file_format=None, chunk_size=500, salt=None,
+                 roles=None, restart=False, on_stored=None):
+        """
+        :param kind: One of KINDS
+        :param path: File to import
+        :param file_format: One of FORMATS, guessed from the path if None
+        :param chunk_size: Amount of records to validate and write at once
+        :param salt: System salt to hash plain 'password' fields of users with
+        :param roles: Roles of imported users without any
+        :param restart: Ignore an existing checkpoint and start over
+        :param on_stored: Called with the list of stored documents after every chunk
+        """
+
+        self.kind = kind
+        self.path = path
+        self.file_format = file_format or detect_format(path)
+        self.chunk_size = chunk_size
+        self.salt = salt
+        self.roles = roles if roles is not None else ['crew']
+        self.on_stored = on_stored
+
+        self.checkpoint_path = path + '.checkpoint'
+        self.state = {
+            'position': 0,
+            'record': 0,
+            'imported': 0,
+            'skipped': 0,
+            'rejected': 0
+        }
+
+        if not restart and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.state.update(load(f))
+            log('Resuming import of', path, 'at record', self.state['record'])
+
+    def _save_checkpoint(self):
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            dump(self.state, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def _records(self, f):
+        """Yield (line, record, file position after the record) from the file"""
+
+        lines = iter(f.readline, '')
+
+        if self.file_format == 'csv':
+            rows = csv.reader(lines)
+            header = [field.strip() for field in next(rows, [])]
+            properties = KINDS[self.kind]['properties']
+            if self.state['position'] > 0:
+                f.seek(self.state['position'])
+
+            for row in rows:
+                self.state['record'] += 1
+                record = {
+                    key: _coerce(value, properties.get(key, {}))
+                    for key, value in zip(header, row) if value != ''
+                }
+                yield self.state['record'], record, f.tell()
+        else:
+            f.seek(self.state['position'])
+
+            for text in lines:
+                if text.strip() == '':
+                    continue
+                self.state['record'] += 1
+                try:
+                    record = loads(text)
+                except ValueError:
+                    record = None
+                yield self.state['record'], record, f.tell()
+
+    def run(self):
+        """Import the file, yields the progress after every chunk"""
+
+        with open(self.path, newline='' if self.file_format == 'csv' else None,
+                  encoding='utf-8') as f:
+            chunk = []
+            position = self.state['position']
+            for line, record, position in self._records(f):
+                chunk.append((line, record))
+                if len(chunk) >= self.chunk_size:
+                    yield self._store(chunk, position)
+                    chunk = []
+
+            yield self._store(chunk, position, done=True)
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _store(self, chunk, position, done=False):
+        rejected = []
+        documents = []
+
+        for line, record in chunk:
+            document, reason = self._prepare(record)
+            if reason is None:
+                documents.append((line, document))
+            else:
+                rejected.append([line, reason])
+
+        prepared = [document['uuid'] for line, document in documents]
+        documents, skipped = self._new(documents)
+        stored, failed = self._insert(documents)
+        rejected.extend(failed)
+
+        if self.kind == 'users':
+            # Includes users stored by an interrupted run
+            self._create_profiles(prepared)
+
+        if self.on_stored is not None and len(stored) > 0:
+            self.on_stored(stored)
+
+        self.state['position'] = position
+        self.state['imported'] += len(stored)
+        self.state['skipped'] += skipped
+        self.state['rejected'] += len(rejected)
+        if not done:
+            self._save_checkpoint()
+
+        log('Imported chunk of', self.path, 'up to record', self.state['record'], lvl=debug)
+
+        return dict(self.state, kind=self.kind, done=done,
+                    rejected_records=sorted(rejected))
+
+    def _prepare(self, record):
+        """Complete and validate a record, returns the document or the reason
+        it was rejected"""
+
+        if not isinstance(record, dict):
+            return None, 'Unreadable'
+
+        properties = KINDS[self.kind]['properties']
+        document = {
+            key: value for key, value in record.items() if key in properties
+        }
+        if self.kind == 'enrollments':
+            if not document.get('name') or not document.get('email'):
+                return None, 'Incomplete'
+            document.setdefault('uuid', str(uuid5(
+                IMPORT_NAMESPACE, 'enrollment:%s:%s' % (document['name'], document['email'])
+            )))
+            document.setdefault('status', 'Open')
+            document.setdefault('method', 'Invited')
+            document.setdefault('password', '')
+            document.setdefault('timestamp', std_now())
+        else:
+            if not document.get('name'):
+                return None, 'Incomplete'
+            document.setdefault('uuid', str(uuid5(IMPORT_NAMESPACE,
+                                                  'user:%s' % document['name'])))
+            if 'passhash' not in document:
+                password = record.get('password', None)
+                if not password or self.salt is None:
+                    return None, 'No password'
+                document['passhash'] = std_hash(password, self.salt)
+            document.setdefault('roles', list(self.roles))
+            document.setdefault('created', std_now())
+
+        for error in KINDS[self.kind]['validator'].iter_errors(document):
+            return None, 'Invalid: ' + error.message
+
+        return document, None
+
+    def _new(self, documents):
+        """Drop documents that exist already, e.g. from an interrupted run"""
+
+        if len(documents) == 0:
+            return documents, 0
+
+        uuids = [document['uuid'] for line, document in documents]
+        names = [document['name'] for line, document in documents]
+        query = {'$or': [{'uuid': {'$in': uuids}}, {'name': {'$in': names}}]}
+
+        existing = set()
+        collection = objectmodels[KINDS[self.kind]['schema']].collection()
+        for document in collection.find(query, {'uuid': 1, 'name': 1, '_id': 0}):
+            existing.add(document.get('uuid'))
+            existing.add(document.get('name'))
+
+        result = []
+        for line, document in documents:
+            if document['uuid'] in existing or document['name'] in existing:
+                continue
+            existing.add(document['uuid'])
+            existing.add(document['name'])
+            result.append((line, document))
+
+        return result, len(documents) - len(result)
+
+    def _insert(self, documents):
+        """Insert documents with one unordered write, returns the stored
+        documents and the rejections"""
+
+        if len(documents) == 0:
+            return [], []
+
+        collection = objectmodels[KINDS[self.kind]['schema']].collection()
+        try:
+            collection.insert_many([document for line, document in documents],
+                                   ordered=False)
+        except BulkWriteError as e:
+            failed = set(item['index'] for item in e.details.get('writeErrors', []))
+            log('Could not store', len(failed), 'of', len(documents), self.kind,
+                lvl=warn)
+            return (
+                [document for index, (line, document) in enumerate(documents)
+                 if index not in failed],
+                [[line, 'Not stored'] for index, (line, document) in enumerate(documents)
+                 if index in failed]
+            )
+
+        return [document for line, document in documents], []
+
+    def _create_profiles(self, uuids):
+        """Create the missing profiles of imported users"""
+
+        if len(uuids) == 0:
+            return
+
+        owners = [
+            user['uuid'] for user in objectmodels['user'].collection().find(
+                {'uuid': {'$in': uuids}}, {'uuid': 1, '_id': 0})
+        ]
+
+        profiles = objectmodels['profile'].collection()
+        existing = set(
+            profile['owner'] for profile in
+            profiles.find({'owner': {'$in': owners}}, {'owner': 1, '_id': 0})
+        )
+
+        missing = [
+            {'uuid': std_uuid(), 'owner': owner} for owner in owners
+            if owner not in existing
+        ]
+        if len(missing) > 0:
+            profiles.insert_many(missing, ordered=False)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+
+
+Module: Validation
+==================
+
+Cached validation of mail addresses.
+
+Depending on the mode, an address is checked in up to three steps:
+
+* Syntax: the address is matched against the RFC 2822 'addr-spec', offline
+* MX: the mail servers of the domain are looked up and contacted
+* Verify: the mail servers are asked, if they accept the address
+
+Results are cached per address (syntax, verify) and per domain (MX), so
+repeated signups from the same domains and retried addresses cost nothing.
+Negative results are cached, too, with their own lifetime. Lookups, which
+could not come to a conclusion (e.g. DNS timeouts), are not cached and
+count as invalid.
+
+The network checks are plain functions without shared state, so they can
+be run in a worker pool. Their results are stored by the caller. They need
+the optional pyDNS package (the 'validation' extra), without it the
+validator falls back to syntax checks.
+
+"""
+
+import validate_email as validate_email_module
+from validate_email import validate_email
+
+from isomer.enrol.cache import TTLCache, MISSING
+from isomer.logger import isolog, warn
+
+VALIDATION_MODES = ('Syntax', 'MX', 'Verify')
+
+
+def log(*args, **kwargs):
+    isolog(emitter='ENROL-VALIDATION', *args, **kwargs)
+
+
+def network_checks_available():
+    """Check if the DNS library needed for MX and Verify checks is installed"""
+
+    return getattr(validate_email_module, 'DNS', None) is not None
+
+
+def check_domain(domain, timeout=10):
+    """Check if a domain has reachable mail servers, None if unsure"""
+
+    return validate_email('postmaster@' + domain, check_mx=True, smtp_timeout=timeout)
+
+
+def check_address(mail, timeout=10):
+    """Check if the mail servers accept an address, None if unsure"""
+
+    return validate_email(mail, verify=True, smtp_timeout=timeout)
+
+
+def domain_of(mail):
+    return mail.rsplit('@', 1)[-1].lower()
+
+
+class MailValidator(object):
+    """Mail address validation with result caches per address and domain"""
+
+    def __init__(self, mode='Syntax', ttl=86400, negative_ttl=600, max_entries=10000,
+                 timeout=10):
+        """
+        :param mode: One of VALIDATION_MODES
+        :param ttl: Lifetime of positive results in seconds
+        :param negative_ttl: Lifetime of negative results in seconds
+        :param max_entries: Maximum amount of cached results, per cache
+        :param timeout: Timeout of mail server connections in seconds
+        """
+
+        self.addresses = TTLCache(ttl, max_entries)
+        self.domains = TTLCache(ttl, max_entries)
+
+        self.configure(mode, ttl, negative_ttl, max_entries, timeout)
+
+    def configure(self, mode, ttl, negative_ttl, max_entries, timeout):
+        if mode not in VALIDATION_MODES:
+            raise ValueError('Unknown mail validation mode: %s' % mode)
+
+        if mode != 'Syntax' and not network_checks_available():
+            log('Mail validation mode', mode, 'needs the pyDNS package, falling '
+                'back to Syntax', lvl=warn)
+            mode = 'Syntax'
+
+        self.mode = mode
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+
+        for cache in (self.addresses, self.domains):
+            cache.ttl = ttl
+            cache.max_entries = max_entries
+            cache.clear()
+
+    def syntax(self, mail):
+        """Check the syntax of an address, offline"""
+
+        if not isinstance(mail, str):
+            return False
+
+        result = self.addresses.get(('syntax', mail))
+        if result is MISSING:
+            result = validate_email(mail) is True
+            self.store('syntax', mail, result)
+
+        return result
+
+    def pending(self, mail):
+        """Return False, if the address is known to be invalid, otherwise the
+        list of (kind, key) checks, that have no cached result yet"""
+
+        if not self.syntax(mail):
+            return False
+
+        checks = []
+        if self.mode == 'Syntax':
+            return checks
+
+        domain = domain_of(mail)
+        result = self.domains.get(domain)
+        if result is False:
+            return False
+        elif result is MISSING:
+            checks.append(('domain', domain))
+
+        if self.mode == 'Verify':
+            result = self.addresses.get(('verify', mail))
+            if result is False:
+                return False
+            elif result is MISSING:
+                checks.append(('verify', mail))
+
+        return checks
+
+    def task(self, kind, key):
+        """Return the function and arguments of a check, to be run by the caller"""
+
+        if kind == 'domain':
+            return check_domain, (key, self.timeout)
+
+        return check_address, (key, self.timeout)
+
+    def store(self, kind, key, result):
+        """Cache the result of a check, inconclusive (None) ones are not
+        cached"""
+
+        if result is None:
+            return
+
+        ttl = None if result else self.negative_ttl
+        if kind == 'domain':
+            self.domains.put(key, result, ttl)
+        else:
+            self.addresses.put((kind, key), result, ttl)
+
+    def validate(self, mail):
+        """Validate an address synchronously, running all pending checks"""
+
+        checks = self.pending(mail)
+        if checks is False:
+            return False
+
+        for kind, key in checks:
+            function, args = self.task(kind, key)
+            result = function(*args)
+            self.store(kind, key, result)
+            if result is not True:
+                return False
+
+        return True
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'addresses': self.addresses.stats(),
+            'domains': self.domains.stats()
+        }
@@ -64,10 +64,18 @@ This software package is a plugin module for Isomer.
         'validate_email>=1.3',
         'isomer-mail>=0.0.2'
     ],
+    extras_require={
+        # MX and Verify mail validation
+        'validation': ['py3dns']
+    },
     entry_points="""[isomer.components]
     enrol=isomer.enrol.enrolmanager:EnrolManager
     [isomer.schemata]
     enrollment=isomer.enrol.enrollment:Enrollment
+    enrolmail=isomer.enrol.enrolmail:EnrolMail
+    resettoken=isomer.enrol.resettoken:ResetToken
+    [isomer.management]
+    enrol=isomer.enrol.cli:enrol
     """,
     test_suite="tests.main.main",
 )
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Shared helpers: an EnrolManager with the default configuration, running
+on the in-memory database, with a local mail sink and stand-in clients
+"""
+
+import unittest
+from time import sleep, time
+
+from circuits import Component, Manager, handler
+
+import isomer.logger
+
+from isomer.enrol.testing import memorydb, ConfiguredEnrolManager, Client, MailSink, User
+
+memorydb.install()
+
+
+class Replies(Component):
+    """Collects the packets sent to clients"""
+
+    channel = 'isomer-web'
+
+    def init(self):
+        self.packets = []
+
+    @handler('send')
+    def send(self, event):
+        self.packets.append((event.uuid, event.packet))
+
+    def of(self, action):
+        return [packet['data'] for uuid, packet in self.packets
+                if packet.get('action', None) == action]
+
+
+class EnrolTestCase(unittest.TestCase):
+    """Runs an EnrolManager on a fresh in-memory database per test"""
+
+    def setUp(self):
+        isomer.logger.verbosity['global'] = isomer.logger.off
+        isomer.logger.verbosity['console'] = isomer.logger.off
+
+        self.objectmodels = memorydb.install()
+        self.manager = None
+
+    def start(self, mail_delay=0.0, **overrides):
+        ConfiguredEnrolManager.overrides = dict(
+            {'captcha_pool_size': 0, 'rate_limits': {}}, **overrides)
+
+        self.manager = Manager()
+        self.sink = MailSink(mail_delay).register(self.manager)
+        self.replies = Replies().register(self.manager)
+        self.enrol = ConfiguredEnrolManager()
+        self.enrol.register(self.manager)
+        self.manager.start()
+        self.wait(lambda: self.enrol.indices_ready)
+
+    def tearDown(self):
+        if self.manager is not None:
+            self.manager.stop()
+
+    @staticmethod
+    def wait(condition, timeout=10):
+        deadline = time() + timeout
+        while not condition() and time() < deadline:
+            sleep(0.05)
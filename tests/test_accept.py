@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Accepting enrollments from the links sent by mail
+"""
+
+from isomer.enrol import enrolmanager
+
+from tests.support import EnrolTestCase, Client
+
+
+class AcceptTest(EnrolTestCase):
+    def setUp(self):
+        super(AcceptTest, self).setUp()
+        self.start(hash_workers=1, auto_accept_enrolled=True)
+
+        self.objectmodels['enrollment']({
+            'uuid': 'enrollment',
+            'status': 'Open',
+            'name': 'alice',
+            'method': 'Enrolled',
+            'email': 'alice@example.org',
+            'password': 'password',
+            'timestamp': '2020-01-01T00:00:00'
+        }).save()
+
+    def accept(self, *clients):
+        for client in clients:
+            self.manager.fire(enrolmanager.accept('accept', 'enrollment', Client(client)))
+
+        self.wait(lambda: len(self.replies.of('accept')) >= len(clients))
+
+        return self.replies.of('accept')
+
+    def status(self):
+        return self.objectmodels['enrollment'].collection().find_one(
+            {'uuid': 'enrollment'})['status']
+
+    def test_repeated_clicks_create_one_user(self):
+        replies = self.accept('first', 'second', 'third')
+
+        self.assertEqual(len(replies), 3)
+        self.assertTrue(all(True in reply for reply in replies))
+        self.assertEqual(self.status(), 'Accepted')
+        self.assertEqual(self.objectmodels['user'].count(), 1)
+
+    def test_enrollment_stays_open_if_user_is_not_created(self):
+        self.objectmodels['user']({
+            'uuid': 'existing', 'name': 'other', 'mail': 'alice@example.org',
+            'passhash': 'hash'
+        }).save()
+
+        replies = self.accept('first')
+
+        self.assertEqual(replies[0][0], False)
+        self.assertEqual(self.status(), 'Open')
+
+        self.replies.packets.clear()
+        replies = self.accept('second')
+
+        self.assertEqual(replies[0][0], False)
+        self.assertEqual(self.objectmodels['user'].count(), 1)
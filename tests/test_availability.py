@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+In-memory index of taken names and mail addresses
+"""
+
+import unittest
+
+from isomer.enrol.testing import memorydb
+
+from isomer.enrol.availability import AvailabilityIndex
+
+
+class AvailabilityIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.objectmodels = memorydb.install()
+        self.users = self.objectmodels['user'].collection()
+        self.enrollments = self.objectmodels['enrollment'].collection()
+
+        self.users.insert_one({'uuid': 'alice', 'name': 'alice', 'mail': 'alice@example.org'})
+        self.enrollments.insert_one({'uuid': 'enrollment', 'name': 'bob'})
+
+        self.index = AvailabilityIndex()
+        self.index.warm()
+
+    def test_changed_objects_are_updated_without_warming(self):
+        warmed = self.index.warmed
+        self.users.update_one({'uuid': 'alice'}, {'$set': {'name': 'carol'}})
+        self.users.insert_one({'uuid': 'dave', 'name': 'dave', 'mail': 'dave@example.org'})
+
+        self.index.update('user', 'alice')
+        self.index.update('user', 'dave')
+
+        self.assertEqual(self.index.warmed, warmed)
+        self.assertFalse(self.index.user_exists('alice', confirm=False))
+        self.assertTrue(self.index.user_exists('carol', confirm=False))
+        self.assertTrue(self.index.mail_taken('dave@example.org', confirm=False))
+
+    def test_deleted_objects_are_forgotten(self):
+        self.users.delete_many({'uuid': 'alice'})
+        self.enrollments.delete_many({'uuid': 'enrollment'})
+
+        self.index.remove('user', 'alice')
+        self.index.remove('enrollment', 'enrollment')
+
+        lookups = self.index.lookups
+        self.assertFalse(self.index.mail_taken('alice@example.org'))
+        self.assertFalse(self.index.name_taken('bob'))
+        self.assertEqual(self.index.lookups, lookups)
+
+    def test_strict_checks_find_unannounced_enrollments(self):
+        self.enrollments.insert_one({'uuid': 'other', 'name': 'erin'})
+
+        self.assertFalse(self.index.name_taken('erin'))
+        self.assertTrue(self.index.name_taken('erin', strict=True))
+        self.assertTrue(self.index.name_taken('erin', confirm=False))
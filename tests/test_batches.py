@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Micro-batched storage of accepted users
+"""
+
+from time import sleep
+
+from isomer.enrol import enrolmanager
+
+from tests.support import EnrolTestCase, Client
+
+
+class UserBatchTest(EnrolTestCase):
+    def setUp(self):
+        super(UserBatchTest, self).setUp()
+        self.start(hash_workers=0, auto_accept_enrolled=True, user_batch_window=0.5)
+
+        for number in range(3):
+            self.objectmodels['enrollment']({
+                'uuid': 'enrollment-%i' % number,
+                'status': 'Open',
+                'name': 'user-%i' % number,
+                'method': 'Enrolled',
+                'email': 'user-%i@example.org' % number,
+                'password': 'password',
+                'timestamp': '2020-01-01T00:00:00'
+            }).save()
+
+    def test_accepts_wait_for_their_batch_without_polling(self):
+        for number in range(3):
+            self.manager.fire(enrolmanager.accept('accept', 'enrollment-%i' % number,
+                                                  Client('client-%i' % number)))
+        sleep(0.2)
+
+        self.assertEqual(self.objectmodels['user'].count(), 0)
+        self.assertEqual(len(self.manager._tasks), 0)
+
+        self.wait(lambda: len(self.replies.of('accept')) == 3)
+
+        self.assertEqual(self.objectmodels['user'].count(), 3)
+        self.assertEqual(len(self.replies.of('enrol')), 3)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Pre-rendered captcha pool
+"""
+
+import unittest
+
+from tests.support import EnrolTestCase
+
+from isomer.enrol.captchas import CaptchaPool
+
+
+class FlakyRenderer(object):
+    """Renderer failing its first batches, like a broken process pool"""
+
+    batch = 2
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.stopped = 0
+
+    def generate(self, text):
+        return 'image:' + text
+
+    def generate_many(self, texts):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('Renderer failed')
+
+        return [self.generate(text) for text in texts]
+
+    def stop(self):
+        self.stopped += 1
+
+
+class CaptchaPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.renderer = FlakyRenderer(failures=2)
+        self.pool = CaptchaPool(lambda: self.renderer, size=4, low_water=1)
+        self.pool.retry_delay = 0.01
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_refill_recovers_from_render_failures(self):
+        text, image = self.pool.pop()
+        self.assertEqual(image, 'image:' + text)
+
+        EnrolTestCase.wait(lambda: self.pool.stats()['available'] == 4, timeout=3)
+
+        self.assertEqual(self.pool.stats()['available'], 4)
+        self.assertGreaterEqual(self.renderer.stopped, 2)
+
+        self.pool.pop()
+        self.assertEqual(self.pool.stats()['hits'], 1)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Status changes of enrollments by admins
+"""
+
+from isomer.enrol import enrolmanager
+
+from tests.support import EnrolTestCase, Client, User
+
+
+class BatchChangeTest(EnrolTestCase):
+    def setUp(self):
+        super(BatchChangeTest, self).setUp()
+        self.start(hash_workers=0)
+
+        for number in range(3):
+            self.objectmodels['enrollment']({
+                'uuid': 'enrollment-%i' % number,
+                'status': 'Pending',
+                'name': 'user-%i' % number,
+                'method': 'Enrolled',
+                'email': 'user-%i@example.org' % number,
+                'password': 'password',
+                'timestamp': '2020-01-01T00:00:00'
+            }).save()
+
+    def change(self, data):
+        self.manager.fire(enrolmanager.change(User('admin'), 'change', data, Client('admin')))
+        self.wait(lambda: len(self.replies.of('change_batch')) > 0)
+
+        return self.replies.of('change_batch')[0]
+
+    def statuses(self):
+        return {
+            enrollment['uuid']: enrollment['status'] for enrollment in
+            self.objectmodels['enrollment'].collection().find()
+        }
+
+    def test_accepting_creates_users_and_profiles(self):
+        reply = self.change({
+            'uuids': ['enrollment-%i' % number for number in range(3)] + ['unknown'],
+            'status': 'Accepted'
+        })
+
+        self.assertEqual(sorted(reply['created']), ['user-0', 'user-1', 'user-2'])
+        self.assertEqual(reply['failed'], [])
+        self.assertEqual(reply['missing'], ['unknown'])
+        self.assertEqual(set(self.statuses().values()), {'Accepted'})
+        self.assertEqual(self.objectmodels['user'].count(), 3)
+        self.assertEqual(self.objectmodels['profile'].count(), 3)
+
+    def test_name_collision_fails_only_its_enrollment(self):
+        self.objectmodels['user']({
+            'uuid': 'existing', 'name': 'user-1', 'mail': 'other@example.org',
+            'passhash': 'hash'
+        }).save()
+
+        reply = self.change({
+            'uuids': ['enrollment-%i' % number for number in range(3)],
+            'status': 'Accepted'
+        })
+
+        self.assertEqual(sorted(reply['created']), ['user-0', 'user-2'])
+        self.assertEqual(reply['failed'], ['enrollment-1'])
+        self.assertEqual(self.statuses(), {
+            'enrollment-0': 'Accepted',
+            'enrollment-1': 'Pending',
+            'enrollment-2': 'Accepted'
+        })
+        self.assertEqual(self.objectmodels['user'].count(), 3)
+        self.assertEqual(self.objectmodels['profile'].count(), 2)
+
+        self.wait(lambda: len(self.sink.mails) == 2, timeout=3)
+        self.assertEqual(sorted(mail[0] for mail in self.sink.mails),
+                         ['user-0@example.org', 'user-2@example.org'])
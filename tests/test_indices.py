@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Database indices and duplicate users
+"""
+
+from isomer.enrol import enrolmanager
+from isomer.enrol.indices import ensure_indices, index_name
+
+from tests.support import EnrolTestCase, Client, User
+
+
+class UserIndexTest(EnrolTestCase):
+    def users(self):
+        return self.objectmodels['user'].collection()
+
+    def test_users_without_mail_may_coexist(self):
+        ensure_indices()
+
+        self.users().insert_one({'uuid': '1', 'name': 'one', 'mail': ''})
+        self.users().insert_one({'uuid': '2', 'name': 'two', 'mail': ''})
+        self.users().insert_one({'uuid': '3', 'name': 'three'})
+
+        self.assertEqual(self.users().count_documents({}), 3)
+
+    def test_foreign_index_on_the_same_keys_is_kept(self):
+        self.users().create_index([('mail', 1)], unique=True, sparse=True)
+
+        ensure_indices()
+
+        information = self.users().index_information()
+        self.assertTrue(information['mail_1']['sparse'])
+        self.assertNotIn(index_name([('mail', 1)]), information)
+
+    def test_own_index_with_changed_options_is_replaced(self):
+        self.users().create_index([('mail', 1)], unique=True, sparse=True,
+                                  name=index_name([('mail', 1)]))
+
+        ensure_indices()
+
+        options = self.users().index_information()[index_name([('mail', 1)])]
+        self.assertIn('partialFilterExpression', options)
+        self.assertFalse(options.get('sparse', False))
+
+    def test_duplicates_fall_back_to_a_plain_index_once(self):
+        self.users().insert_one({'uuid': '1', 'name': 'twin', 'mail': 'a@example.org'})
+        self.users().insert_one({'uuid': '2', 'name': 'twin', 'mail': 'b@example.org'})
+
+        ensure_indices()
+
+        fallback = index_name([('name', 1)], fallback=True)
+        self.assertIn(fallback, self.users().index_information())
+
+        created = []
+        create_index = self.users().create_index
+        self.users().create_index = lambda *args, **kwargs: created.append(args)
+        try:
+            ensure_indices()
+        finally:
+            self.users().create_index = create_index
+
+        self.assertEqual(created, [])
+
+    def test_creating_a_user_with_a_taken_mail_address_fails(self):
+        self.start(hash_workers=0)
+        self.users().insert_one({'uuid': 'existing', 'name': 'taken', 'mail': 'b@example.org'})
+
+        self.manager.fire(enrolmanager.create(User('admin'), 'create', {
+            'name': 'new',
+            'mail': 'b@example.org',
+            'password': 'password',
+            'password_verify': 'password'
+        }, Client('admin')))
+        self.wait(lambda: len(self.replies.of('create')) > 0)
+
+        self.assertEqual(self.replies.of('create'),
+                         [(False, 'User or mail address already exists')])
+        self.assertEqual(self.users().count_documents({}), 1)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Outbound mail queue, delivered to a local mail sink
+"""
+
+import unittest
+from time import time
+
+from circuits import Event
+
+from isomer.enrol.testing import memorydb
+
+from isomer.enrol.outbox import MailQueue, placeholder
+
+from tests.support import EnrolTestCase
+
+
+class MailQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.objectmodels = memorydb.install()
+        self.queue = MailQueue(retries=2, retry_delay=10)
+
+    def stored(self):
+        return list(self.objectmodels['enrolmail'].collection().find())
+
+    def test_resends_are_coalesced(self):
+        self.queue.enqueue('a@example.org', 'Subject', 'First', 'enrollment', 'invitation')
+        self.queue.enqueue('a@example.org', 'Subject', 'Second', 'enrollment', 'invitation')
+
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.coalesced, 1)
+        self.assertEqual([mail['body'] for mail in self.stored()], ['Second'])
+
+    def test_secrets_are_not_stored(self):
+        mail = self.queue.enqueue('a@example.org', 'Subject',
+                                  'Password: ' + placeholder('password'),
+                                  'enrollment', 'acceptance', secrets={'password': 'hunter2'})
+
+        self.assertEqual(self.queue.body(mail), 'Password: hunter2')
+        self.assertNotIn('hunter2', repr(self.stored()))
+
+        self.queue.delivered(mail)
+        self.assertEqual(self.stored(), [])
+
+    def test_mails_with_lost_secrets_fail_on_load(self):
+        self.queue.enqueue('a@example.org', 'Subject', 'Plain', 'plain', 'invitation')
+        self.queue.enqueue('b@example.org', 'Subject', 'Password: ' + placeholder('password'),
+                           'secret', 'acceptance', secrets={'password': 'hunter2'})
+
+        restarted = MailQueue()
+        lost = restarted.load()
+
+        self.assertEqual(len(restarted), 1)
+        self.assertEqual([mail.recipient for mail in lost], ['b@example.org'])
+        self.assertEqual(restarted.status('secret'), [{
+            'kind': 'acceptance',
+            'recipient': 'b@example.org',
+            'status': 'Failed',
+            'reason': 'Secrets lost with a restart',
+            'attempts': 0,
+            'next_attempt': lost[0].next_attempt
+        }])
+
+    def test_failed_deliveries_are_retried_with_backoff(self):
+        self.queue.enqueue('a@example.org', 'Subject', placeholder('token'),
+                           secrets={'token': 'secret'})
+        now = time() + 1
+
+        mail = self.queue.due(10, now)[0]
+        self.queue.retry(mail, now)
+        self.assertEqual(self.queue.due(10, now + 9), [])
+
+        mail = self.queue.due(10, now + 10)[0]
+        self.queue.retry(mail, now + 10)
+
+        self.assertEqual(mail.status, 'Failed')
+        self.assertEqual(self.queue.failed, 1)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.body(mail), placeholder('token'))
+
+
+class MailDeliveryTest(EnrolTestCase):
+    def enrollment(self, number):
+        return self.objectmodels['enrollment']({
+            'uuid': 'enrollment-%i' % number,
+            'name': 'user-%i' % number,
+            'email': 'user-%i@example.org' % number
+        })
+
+    def test_generated_passwords_are_delivered_but_not_stored(self):
+        self.start()
+
+        self.enrol._send_acceptance(self.enrollment(0), None, 'hunter2')
+        self.assertNotIn('hunter2', repr(list(
+            self.objectmodels['enrolmail'].collection().find())))
+
+        self.manager.fire(Event.create('mail_queue_flush'), self.enrol.channel)
+        self.wait(lambda: len(self.sink.mails) > 0)
+
+        self.assertEqual(len(self.sink.mails), 1)
+        self.assertIn('hunter2', self.sink.mails[0][2])
+        self.wait(lambda: self.objectmodels['enrolmail'].count() == 0)
+        self.assertEqual(self.objectmodels['enrolmail'].count(), 0)
+
+    def test_lost_acceptance_mails_are_replaced_by_reset_links(self):
+        self.objectmodels['user']({
+            'uuid': 'user-0', 'name': 'user-0', 'mail': 'user-0@example.org',
+            'passhash': 'hash'
+        }).save()
+        MailQueue().enqueue('user-0@example.org', 'Accepted', 'Password: ' +
+                            placeholder('password'), 'enrollment-0', 'acceptance',
+                            secrets={'password': 'hunter2'})
+
+        self.start()
+        self.wait(lambda: self.objectmodels['resettoken'].count() > 0)
+        self.manager.fire(Event.create('mail_queue_flush'), self.enrol.channel)
+        self.wait(lambda: len(self.sink.mails) > 0)
+
+        recipient, subject, body = self.sink.mails[0]
+        self.assertEqual(recipient, 'user-0@example.org')
+        self.assertIn('/#!/resetaccount/', body)
+        self.assertEqual(self.enrol.mail_queue.status('enrollment-0')[0]['status'],
+                         'Failed')
+
+    def test_slow_deliveries_do_not_overlap(self):
+        self.start(mail_delay=0.5, mail_rate=1)
+
+        for number in range(3):
+            self.enrol._send_invitation(self.enrollment(number), None)
+        for i in range(3):
+            self.manager.fire(Event.create('mail_queue_flush'), self.enrol.channel)
+
+        self.wait(lambda: len(self.sink.mails) == 3)
+
+        self.assertEqual(sorted(mail[0] for mail in self.sink.mails),
+                         ['user-%i@example.org' % number for number in range(3)])
+        self.assertEqual(self.sink.peak, 1)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Password resets by anonymous clients, with the lookups in the worker pool
+"""
+
+from isomer.misc.std import std_hash
+
+from isomer.enrol import enrolmanager
+
+from tests.support import EnrolTestCase, Client
+
+
+class ResetTest(EnrolTestCase):
+    def setUp(self):
+        super(ResetTest, self).setUp()
+        self.start(hash_workers=0, reset_workers=1)
+
+        self.objectmodels['user']({
+            'uuid': 'alice', 'name': 'alice', 'mail': 'alice@example.org',
+            'passhash': 'hash'
+        }).save()
+
+    def fire(self, action, data, client):
+        self.manager.fire(getattr(enrolmanager, action)(action, data, Client(client)))
+
+    def reply(self, action, client):
+        self.wait(lambda: any(uuid == client for uuid, packet in self.replies.packets
+                              if packet.get('action', None) == action))
+
+        return [packet['data'] for uuid, packet in self.replies.packets
+                if uuid == client and packet['action'] == action][0]
+
+    def request_token(self, data):
+        self.fire('request_reset', data, 'requester')
+        self.reply('request_reset', 'requester')
+        self.wait(lambda: len(self.sink.mails) > 0, timeout=3)
+
+        recipient, subject, body = self.sink.mails[-1]
+        self.assertEqual(recipient, 'alice@example.org')
+
+        return body.split('/#!/resetaccount/')[1].split()[0]
+
+    def test_token_sets_password_once(self):
+        token = self.request_token({'username': 'alice'})
+        self.assertEqual(self.objectmodels['resettoken'].count(), 1)
+
+        self.fire('reset_password', {'token': token, 'password': 'newpassword'}, 'first')
+        self.assertTrue(self.reply('reset_password', 'first')[0])
+
+        user = self.objectmodels['user'].collection().find_one({'uuid': 'alice'})
+        self.assertEqual(user['passhash'], std_hash('newpassword', self.enrol.salt))
+
+        self.fire('reset_password', {'token': token, 'password': 'otherpassword'}, 'second')
+        self.assertFalse(self.reply('reset_password', 'second')[0])
+
+    def test_mailed_token_of_concurrent_requests_is_valid(self):
+        for client in ('first', 'second', 'third'):
+            self.fire('request_reset', {'username': 'alice'}, client)
+        self.wait(lambda: self.objectmodels['resettoken'].count() == 3)
+
+        token = self.request_token({'email': 'alice@example.org'})
+
+        self.fire('reset_password', {'token': token, 'password': 'newpassword'}, 'reset')
+        self.assertTrue(self.reply('reset_password', 'reset')[0])
+        self.assertEqual(self.objectmodels['resettoken'].count(), 0)
+
+    def test_unknown_accounts_get_the_same_reply(self):
+        self.fire('request_reset', {'email': 'nobody@example.org'}, 'unknown')
+        self.fire('request_reset', {'email': 'alice@example.org'}, 'known')
+
+        self.assertEqual(self.reply('request_reset', 'unknown'),
+                         self.reply('request_reset', 'known'))
+        self.wait(lambda: self.objectmodels['resettoken'].count() > 0)
+        self.assertEqual(self.objectmodels['resettoken'].count(), 1)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Periodic sweep of stale enrollments
+"""
+
+from unittest.mock import patch
+
+from circuits import Event
+
+from isomer.enrol import enrolmanager
+
+from tests.support import EnrolTestCase
+
+
+class SweepTest(EnrolTestCase):
+    def setUp(self):
+        super(SweepTest, self).setUp()
+        self.start(expiry_days=7)
+
+        for number, timestamp in enumerate(('2030-01-01T12:00:00+00:00',
+                                            '2030-01-09T12:00:00+00:00')):
+            self.objectmodels['enrollment']({
+                'uuid': 'enrollment-%i' % number,
+                'status': 'Open',
+                'name': 'user-%i' % number,
+                'timestamp': timestamp
+            }).save()
+
+    def statuses(self):
+        return {
+            enrollment['uuid']: enrollment['status'] for enrollment in
+            self.objectmodels['enrollment'].collection().find()
+        }
+
+    def test_cutoff_uses_the_clock_of_the_timestamps(self):
+        with patch.object(enrolmanager, 'std_now', lambda: '2030-01-10T12:00:00+00:00'):
+            self.manager.fire(Event.create('enrollment_sweep'), self.enrol.channel)
+            self.wait(lambda: 'Expired' in self.statuses().values(), timeout=3)
+
+        self.assertEqual(self.statuses(), {
+            'enrollment-0': 'Expired',
+            'enrollment-1': 'Open'
+        })
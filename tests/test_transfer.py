@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Import of enrollments and users
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from json import dumps
+
+from isomer.enrol.testing import memorydb
+
+from isomer.enrol.transfer import Importer
+
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.objectmodels = memorydb.install()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'enrollments.jsonl')
+
+        with open(self.path, 'w') as f:
+            for number in range(5):
+                f.write(dumps({
+                    'name': 'user-%i' % number,
+                    'email': 'user-%i@example.org' % number
+                }) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_import(self, **kwargs):
+        return list(Importer('enrollments', self.path, chunk_size=2, **kwargs).run())[-1]
+
+    def test_repeated_import_without_uuids_is_skipped(self):
+        first = self.run_import()
+        # Like resuming from a checkpoint written before a crash
+        second = self.run_import(restart=True)
+
+        self.assertEqual(first['imported'], 5)
+        self.assertEqual(second['imported'], 0)
+        self.assertEqual(second['skipped'], 5)
+        self.assertEqual(self.objectmodels['enrollment'].count(), 5)
+
+    def test_derived_uuids_are_stable(self):
+        self.run_import()
+        uuids = sorted(enrollment['uuid'] for enrollment in
+                       self.objectmodels['enrollment'].collection().find())
+
+        self.objectmodels = memorydb.install()
+        self.run_import()
+
+        self.assertEqual(sorted(enrollment['uuid'] for enrollment in
+                                self.objectmodels['enrollment'].collection().find()), uuids)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Isomer - The distributed application framework
+# ==============================================
+# Copyright (C) 2011-2019 Heiko 'riot' Weinen <riot@c-base.org> and others.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Heiko 'riot' Weinen"
+__license__ = "AGPLv3"
+
+"""
+Mail address validation
+"""
+
+import unittest
+from unittest import mock
+
+from isomer.enrol import validation
+from isomer.enrol.validation import MailValidator
+
+
+class ValidationFallbackTest(unittest.TestCase):
+    def test_network_modes_need_pydns(self):
+        with mock.patch.object(validation.validate_email_module, 'DNS', None):
+            validator = MailValidator('MX')
+
+            self.assertEqual(validator.mode, 'Syntax')
+            self.assertEqual(validator.pending('user@example.org'), [])
+            self.assertTrue(validator.validate('user@example.org'))
+            self.assertFalse(validator.validate('not an address'))
+
+    def test_network_modes_are_used_with_pydns(self):
+        with mock.patch.object(validation.validate_email_module, 'DNS', object()):
+            validator = MailValidator('Verify')
+
+            self.assertEqual(validator.mode, 'Verify')
+            self.assertEqual(validator.pending('user@example.org'),
+                             [('domain', 'example.org'), ('verify', 'user@example.org')])